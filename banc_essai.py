@@ -0,0 +1,215 @@
+'''Banc d'essai reproductible des étapes du routage, sur le vrai réseau et sur des réseaux synthétiques.
+
+Les réseaux synthétiques sont générés (avec une graine fixe) dans le format de caps_metro.txt, avec un fichier
+de coordonnées par ligne dans le format de orange.txt. Chaque étape est chronométrée séparément, puis mesurée
+une seconde fois sous tracemalloc pour sa mémoire maximale. Les résultats sont écrits en JSON; l'option
+--comparer signale les étapes qui ont ralenti par rapport à un résultat précédent.
+
+Exemples:
+    python banc_essai.py --tailles 100 1000 10000 -o banc.json
+    python banc_essai.py --tailles 100 1000 10000 -o nouveau.json --comparer banc.json
+    python banc_essai.py --tailles 1000000 --sans-memoire       le plus grand réseau, long à préparer
+'''
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import contraction
+import metro
+
+TAILLES_DEFAUT = (100, 1000, 10000, 100000)    # 10⁶ sur demande (--tailles ... 1000000): la hiérarchie s'y construit en Python pur
+ESPACEMENT = 10         # Distance sur la carte entre deux stations voisines d'une même ligne
+METRES_PAR_UNITE = 12   # Ordre de grandeur du vrai réseau (voir metro.calibrer_heuristique)
+
+def generer_reseau(n, dossier, graine=0):
+    '''Génère dans le dossier un réseau d'environ n stations: k lignes horizontales et k lignes verticales de m
+    stations chacune, qui se croisent en k*k stations de correspondance. Écrit le fichier du graphe
+    (caps_metro.txt) et un fichier de coordonnées par ligne (ligne_0.txt, ligne_1.txt, ...).
+    Retourne (fichier du graphe, liste des fichiers de lignes).'''
+    hasard = random.Random(graine)
+    k = max(2, round(math.sqrt(n) / 5))
+    m = max(2, math.ceil((n + k * k) / (2 * k)))           # 2km - k² stations en tout
+    rangees = sorted(hasard.sample(range(m), k))            # Position des lignes horizontales
+    colonnes = sorted(hasard.sample(range(m), k))           # Position des lignes verticales
+    positions = {}
+
+    def station(rangee, colonne):
+        '''Retourne le nom de la station à cette position de la grille (et lui choisit des coordonnées la première fois)'''
+        nom = 'S%d-%d' % (rangee, colonne)
+        if nom not in positions:
+            positions[nom] = (colonne * ESPACEMENT + hasard.randint(-2, 2), rangee * ESPACEMENT + hasard.randint(-2, 2))
+        return nom
+
+    lignes = [[station(r, c) for c in range(m)] for r in rangees] + [[station(r, c) for r in range(m)] for c in colonnes]
+    fichier_graphe = os.path.join(dossier, 'caps_metro.txt')
+    fichiers_lignes = []
+    with open(fichier_graphe, 'w', encoding='utf-8') as graphe:
+        graphe.write('# RESEAU SYNTHETIQUE (graine %d)\n# FORMAT DE CHAQUE LIGNE: (DEPART, ARRIVEE, LONGUEUR)\n' % graine)
+        for (numero, ligne) in enumerate(lignes):
+            graphe.write('\n# LIGNE %d\n' % numero)
+            for (depart, arrivee) in zip(ligne, ligne[1:]):
+                distance = math.dist(positions[depart], positions[arrivee])
+                graphe.write('%s %s %d\n' % (depart, arrivee, round(distance * METRES_PAR_UNITE * hasard.uniform(1, 1.3)) + 1))
+            fichier_ligne = os.path.join(dossier, 'ligne_%d.txt' % numero)
+            with open(fichier_ligne, 'w', encoding='utf-8') as fp:
+                fp.write('\n'.join('%s %d %d' % ((nom,) + positions[nom]) for nom in ligne))
+            fichiers_lignes.append(fichier_ligne)
+    return fichier_graphe, fichiers_lignes
+
+def fichiers_montreal():
+    '''Retourne le fichier du graphe et les fichiers de lignes du vrai réseau de Montréal'''
+    return metro.FICHIER_GRAPHE, [metro.fichier_ligne(couleur) for couleur in metro.COULEURS_LIGNES]
+
+def mesurer(fonction, repetitions):
+    '''Appelle fonction() 'repetitions' fois et retourne (temps médian, temps minimal, dernier résultat).
+    La mémoire maximale est mesurée à part par mesurer_memoire, car tracemalloc ralentit le programme.'''
+    temps = []
+    resultat = None
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        resultat = fonction()
+        temps.append(time.perf_counter() - debut)
+    return statistics.median(temps), min(temps), resultat
+
+def mesurer_memoire(fonction):
+    '''Retourne le nombre maximal d'octets alloués pendant un appel à fonction()'''
+    tracemalloc.start()
+    try:
+        fonction()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def banc_reseau(fichier_graphe, fichiers_lignes, requetes=20, repetitions=3, graine=0, memoire=True):
+    '''Chronomètre chaque étape du routage sur un réseau et retourne le dictionnaire des résultats'''
+    hasard = random.Random(graine)
+    etapes = {}
+
+    def etape(nom, fonction, repetitions=repetitions):
+        mediane, minimum, resultat = mesurer(fonction, repetitions)
+        etapes[nom] = {'secondes': mediane, 'secondes_min': minimum}
+        if memoire:
+            etapes[nom]['memoire_max_octets'] = mesurer_memoire(fonction)
+        return resultat
+
+    G = etape('lire_fichier_graphe', lambda: metro.lire_fichier_graphe(fichier_graphe), 1)
+    C = etape('compiler_fichier_graphe', lambda: metro.compiler_fichier_graphe(fichier_graphe), 1)
+    instantane = os.path.join(tempfile.mkdtemp(prefix='banc_csr_'), 'graphe.csr')
+    try:
+        etape('ecrire_instantane', lambda: metro.ecrire_instantane(C, instantane, fichier_graphe), 1)
+        etape('lire_instantane', lambda: metro.lire_instantane(instantane, fichier_graphe))
+    finally:
+        shutil.rmtree(os.path.dirname(instantane))
+    stations = etape('dictionnaire_stations', lambda: metro.charger_stations(fichiers_lignes))
+
+    # Les mêmes requêtes aléatoires (points sur la carte et paires de stations) pour toutes les étapes
+    noms = list(stations)
+    xs = [x for (x, y) in stations.values()]
+    ys = [y for (x, y) in stations.values()]
+    points = [(hasard.uniform(min(xs), max(xs)), hasard.uniform(min(ys), max(ys))) for _ in range(requetes)]
+    paires = [(hasard.choice(noms), hasard.choice(noms)) for _ in range(requetes)]
+
+    etape('depart_metro', lambda: [metro.depart_metro(stations, point) for point in points])
+    index = etape('index_spatial', lambda: metro.IndexSpatial(stations), 1)
+    etape('index_spatial_requetes', lambda: [index.plus_proche(point) for point in points])
+
+    compteurs_total = {}
+    def recherches(graphe, garder=None):
+        resultats = []
+        for (depart, arrivee) in paires:
+            compteurs = {}
+            resultats.append(metro.recherche_dijkstra(graphe, graphe.sommet(depart), graphe.sommet(arrivee), compteurs))
+            if garder is not None:
+                for (cle, valeur) in compteurs.items():
+                    garder[cle] = garder.get(cle, 0) + valeur
+        return resultats
+    precedents = etape('dijkstra', lambda: recherches(G))
+    etape('dijkstra_csr', lambda: recherches(C))
+    recherches(G, compteurs_total)
+    etape('reconstruction_chemin',
+          lambda: [metro.reconstruire_chemin(G, precedent, G.sommet(arrivee))
+                   for (precedent, (_, arrivee)) in zip(precedents, paires) if precedent is not None])
+    (H, statistiques_hierarchie) = etape('construction_hierarchie', lambda: contraction.construire(C), 1)
+    etape('hierarchie', lambda: [H.trajet(H.sommet(depart), H.sommet(arrivee)) for (depart, arrivee) in paires])
+
+    return {'stations': len(stations), 'aretes': len(C._cibles) // (1 if C.estOriente() else 2),
+            'requetes': requetes, 'compteurs_dijkstra': compteurs_total,
+            'raccourcis_hierarchie': statistiques_hierarchie['raccourcis'], 'etapes': etapes}
+
+def lancer(tailles, requetes=20, repetitions=3, graine=0, memoire=True, dossier=None, journal=sys.stderr):
+    '''Lance le banc d'essai sur le vrai réseau puis sur un réseau synthétique de chaque taille'''
+    resultats = {}
+    print('montreal...', file=journal)
+    resultats['montreal'] = banc_reseau(*fichiers_montreal(), requetes, repetitions, graine, memoire)
+    for n in tailles:
+        print('%d stations...' % n, file=journal)
+        dossier_reseau = os.path.join(dossier, str(n)) if dossier else tempfile.mkdtemp(prefix='banc_%d_' % n)
+        os.makedirs(dossier_reseau, exist_ok=True)
+        try:
+            fichier_graphe, fichiers_lignes = generer_reseau(n, dossier_reseau, graine)
+            resultats[str(n)] = banc_reseau(fichier_graphe, fichiers_lignes, requetes, repetitions, graine, memoire)
+        finally:
+            if not dossier:
+                shutil.rmtree(dossier_reseau)
+    return {'version': 1, 'python': platform.python_version(), 'machine': platform.machine(), 'graine': graine,
+            'requetes': requetes, 'repetitions': repetitions, 'resultats': resultats}
+
+def comparer(ancien, nouveau, seuil=0.10, plancher=0.001):
+    '''Compare deux résultats du banc d'essai. Retourne la liste des régressions: les étapes dont le temps médian
+    a augmenté de plus de 'seuil' (10 % par défaut) et d'au moins 'plancher' secondes (pour ignorer le bruit des
+    étapes très courtes), sous forme de (réseau, étape, ancien temps, nouveau temps).'''
+    regressions = []
+    for (reseau, resultat) in nouveau['resultats'].items():
+        avant = ancien['resultats'].get(reseau)
+        if avant is None:
+            continue
+        for (nom, mesure) in resultat['etapes'].items():
+            if nom in avant['etapes']:
+                temps_avant = avant['etapes'][nom]['secondes']
+                if mesure['secondes'] > temps_avant * (1 + seuil) and mesure['secondes'] - temps_avant >= plancher:
+                    regressions.append((reseau, nom, temps_avant, mesure['secondes']))
+    return regressions
+
+def main(arguments=None):
+    parseur = argparse.ArgumentParser(description="Banc d'essai du routage sur des réseaux de 10² à 10⁶ stations.")
+    parseur.add_argument('--tailles', type=int, nargs='*', default=list(TAILLES_DEFAUT), help='nombres de stations des réseaux synthétiques')
+    parseur.add_argument('--requetes', type=int, default=20, help='nombre de requêtes par étape')
+    parseur.add_argument('--repetitions', type=int, default=3, help='nombre de répétitions de chaque étape (le temps médian est gardé)')
+    parseur.add_argument('--graine', type=int, default=0)
+    parseur.add_argument('--sans-memoire', action='store_true', help='ne pas mesurer la mémoire maximale (plus rapide)')
+    parseur.add_argument('--dossier', help='garder les réseaux générés dans ce dossier')
+    parseur.add_argument('-o', '--sortie', default='-', help="fichier JSON des résultats ('-' pour la sortie standard)")
+    parseur.add_argument('--comparer', help='résultat JSON précédent auquel comparer les nouveaux résultats')
+    parseur.add_argument('--seuil', type=float, default=0.10, help='ralentissement relatif signalé comme une régression')
+    parseur.add_argument('--plancher', type=float, default=0.001, help='ralentissement minimal (en secondes) signalé comme une régression')
+    args = parseur.parse_args(arguments)
+
+    resultats = lancer(args.tailles, args.requetes, args.repetitions, args.graine, not args.sans_memoire, args.dossier)
+    texte = json.dumps(resultats, indent=2)
+    if args.sortie == '-':
+        print(texte)
+    else:
+        with open(args.sortie, 'w', encoding='utf-8') as fp:
+            fp.write(texte + '\n')
+
+    if args.comparer:
+        with open(args.comparer, 'r', encoding='utf-8') as fp:
+            regressions = comparer(json.load(fp), resultats, args.seuil, args.plancher)
+        for (reseau, nom, avant, apres) in regressions:
+            print('RÉGRESSION %s / %s: %.6f s -> %.6f s (%+.0f %%)' % (reseau, nom, avant, apres, 100 * (apres / avant - 1)),
+                  file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
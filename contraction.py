@@ -0,0 +1,422 @@
+'''Hiérarchie de contraction (contraction hierarchies) pour les trajets point à point sur de grands réseaux.
+
+Le prétraitement (hors ligne) retire les stations une à une, de la moins importante à la plus importante. Quand une
+station est retirée, un raccourci est ajouté entre deux de ses voisins si le seul trajet le plus court entre eux
+passait par elle. Chaque station reçoit ainsi un rang. Une requête fait ensuite deux recherches de Dijkstra qui ne
+montent que vers des stations de rang plus élevé: une à partir du départ et une (à l'envers) à partir de la
+destination. Elles ne fixent que quelques centaines de stations, même sur un réseau de centaines de milliers.
+
+L'ordre des stations et les raccourcis sont enregistrés dans un fichier binaire (nom du graphe + '.ch'), projeté en
+mémoire au chargement et reconstruit seulement si le fichier du graphe a changé.
+
+Exemples:
+    python contraction.py caps_metro.txt                   construit (ou relit) la hiérarchie et affiche ses statistiques
+    python contraction.py reseau.txt --verifier 100        compare 100 trajets au hasard avec dijkstra
+    python contraction.py caps_metro.txt --trajet ANGRIGNON LONGUEUIL
+'''
+
+import argparse
+import heapq
+import json
+import math
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+from array import array
+
+import metro
+
+LIMITE_TEMOINS = 500    # Nombre maximal de stations fixées par une recherche de témoin pendant la construction
+SANS_MILIEU = -1        # Milieu d'une arête qui n'est pas un raccourci
+
+# Une hiérarchie garde deux graphes compacts (format CSR, comme metro.GrapheCSR) qui ne vont que vers le haut:
+# 'haut' contient les arêtes u -> x avec rang[u] < rang[x], rangées avec u, et 'bas' les arêtes u -> x avec
+# rang[u] > rang[x], rangées avec x (pour la recherche à l'envers à partir de la destination). Chaque arête
+# garde la station qu'elle contourne (son milieu) si c'est un raccourci, pour pouvoir retrouver le vrai trajet.
+class HierarchieContraction:
+    def __init__(self, noms, rangs, haut, bas, oriente=False, tampon=None):
+        '''Crée la hiérarchie à partir des noms, des rangs et des deux graphes montants, chacun sous forme de
+        quatre tableaux (debuts, cibles, poids, milieux)'''
+        self._noms = noms
+        self._indices = {nom: i for (i, nom) in enumerate(noms)}
+        self._rangs = rangs
+        self._haut = haut
+        self._bas = bas if oriente else haut    # Non orienté: les arêtes montantes sont les mêmes dans les deux sens
+        self._oriente = oriente
+        self._tampon = tampon       # Projection mémoire du fichier, gardée ouverte tant que la hiérarchie existe
+        self._empreinte = None      # sha256 du fichier du graphe dont elle a été construite (voir charger_hierarchie)
+
+    def taille(self):
+        '''Retourne le nombre de stations'''
+        return len(self._noms)
+
+    def empreinte(self):
+        '''Retourne le sha256 du fichier du graphe de la hiérarchie (comme metro.GrapheCSR.empreinte)'''
+        return self._empreinte
+
+    def nombreAretes(self):
+        '''Retourne le nombre d'arêtes montantes (arêtes du graphe et raccourcis)'''
+        return len(self._haut[1]) + (len(self._bas[1]) if self._oriente else 0)
+
+    def sommet(self, nom):
+        '''Retourne le numéro de la station de ce nom'''
+        return self._indices.get(nom)
+
+    def nomSommet(self, s):
+        '''Retourne le nom de la station s'''
+        return self._noms[s]
+
+    def _aretes(self, graphe, s):
+        '''Retourne les triplets (voisin, poids, milieu) des arêtes de la station s dans un des deux graphes montants'''
+        (debuts, cibles, poids, milieux) = graphe
+        debut, fin = debuts[s], debuts[s+1]
+        return zip(cibles[debut:fin], poids[debut:fin], milieux[debut:fin])
+
+    def _milieu(self, origine, destination):
+        '''Retourne le milieu de l'arête montante de origine à destination (chaque station n'a qu'une arête
+        montante par voisin)'''
+        if self._rangs[origine] < self._rangs[destination]:
+            (s, autre, (debuts, cibles, _, milieux)) = (origine, destination, self._haut)
+        else:
+            (s, autre, (debuts, cibles, _, milieux)) = (destination, origine, self._bas)
+        for i in range(debuts[s], debuts[s+1]):
+            if cibles[i] == autre:
+                return milieux[i]
+        raise KeyError((origine, destination))
+
+    def _deplier(self, origine, destination, chemin):
+        '''Ajoute au chemin les stations de l'arête (origine, destination), raccourcis dépliés, sans l'origine'''
+        pile = [(origine, destination)]
+        while pile:
+            (a, b) = pile.pop()
+            milieu = self._milieu(a, b)
+            if milieu == SANS_MILIEU:
+                chemin.append(b)
+            else:
+                pile.append((milieu, b))    # Dépile d'abord (a, milieu), puis (milieu, b)
+                pile.append((a, milieu))
+
+    def recherche(self, depart, destination, compteurs=None):
+        '''Fait les deux recherches montantes et retourne (longueur, liste des numéros des stations) du trajet le plus
+        court, ou None si la destination est inatteignable. Chaque recherche s'arrête quand le plus petit élément de
+        son tas dépasse la longueur du meilleur trajet trouvé. 'compteurs' reçoit les compteurs de dijkstra.'''
+        dist = ({depart: 0}, {destination: 0})
+        precedent = ({depart: None}, {destination: None})
+        tas = ([(0, depart)], [(0, destination)])
+        graphes = (self._haut, self._bas)
+        meilleure_longueur = 0 if depart == destination else math.inf
+        rencontre = depart if depart == destination else None
+        sommets_fixes = 0
+        aretes_relachees = 0
+        insertions = 2
+        cote = 1
+        while tas[0] or tas[1]:
+            if tas[1 - cote]:
+                cote = 1 - cote     # Alterne entre les deux recherches
+            distance, station_actuelle = heapq.heappop(tas[cote])
+            if distance >= meilleure_longueur:
+                tas[cote].clear()   # Cette recherche ne peut plus trouver de trajet plus court
+                continue
+            if distance > dist[cote][station_actuelle]:
+                continue
+            sommets_fixes += 1
+            if station_actuelle in dist[1 - cote] and distance + dist[1 - cote][station_actuelle] < meilleure_longueur:
+                meilleure_longueur = distance + dist[1 - cote][station_actuelle]
+                rencontre = station_actuelle
+            for (voisin, poids, _) in self._aretes(graphes[cote], station_actuelle):
+                aretes_relachees += 1
+                nouvelle_distance = distance + poids
+                if nouvelle_distance < dist[cote].get(voisin, math.inf):
+                    dist[cote][voisin] = nouvelle_distance
+                    precedent[cote][voisin] = station_actuelle
+                    heapq.heappush(tas[cote], (nouvelle_distance, voisin))
+                    insertions += 1
+        if compteurs is not None:
+            compteurs.update(sommets_fixes=sommets_fixes, aretes_relachees=aretes_relachees, insertions_tas=insertions)
+        if rencontre is None:
+            return None
+
+        montee = [rencontre]        # Du point de rencontre jusqu'au départ, en suivant la recherche avant
+        while precedent[0][montee[-1]] is not None:
+            montee.append(precedent[0][montee[-1]])
+        montee.reverse()
+        descente = [rencontre]      # Du point de rencontre jusqu'à la destination, en suivant la recherche arrière
+        while precedent[1][descente[-1]] is not None:
+            descente.append(precedent[1][descente[-1]])
+        sommets = montee[:-1] + descente
+        chemin = [depart]
+        for (a, b) in zip(sommets, sommets[1:]):
+            self._deplier(a, b, chemin)
+        return meilleure_longueur, chemin
+
+    def trajet(self, depart, destination, compteurs=None):
+        '''Retourne la liste des noms des stations du trajet le plus court entre deux stations (données par leur
+        numéro, comme pour dijkstra), ou None si la destination est inatteignable'''
+        resultat = self.recherche(depart, destination, compteurs)
+        if resultat is None:
+            return None
+        return [self._noms[s] for s in resultat[1]]
+
+
+'''CONSTRUCTION'''
+def _temoins(sortants, source, exclu, distance_max, limite=LIMITE_TEMOINS):
+    '''Recherche de Dijkstra limitée à partir de 'source', sans passer par la station 'exclu'. Retourne le
+    dictionnaire {station: distance}; elle s'arrête au-delà de 'distance_max' ou après 'limite' stations fixées.
+    Une distance manquante ou trop grande à cause de la limite ne fait qu'ajouter un raccourci inutile.'''
+    dist = {source: 0}
+    tas = [(0, source)]
+    fixes = 0
+    while tas:
+        distance, station = heapq.heappop(tas)
+        if distance > dist[station]:
+            continue
+        if distance > distance_max or fixes >= limite:
+            break
+        fixes += 1
+        for (voisin, poids) in sortants[station].items():
+            nouvelle_distance = distance + poids
+            if voisin != exclu and nouvelle_distance < dist.get(voisin, math.inf):
+                dist[voisin] = nouvelle_distance
+                heapq.heappush(tas, (nouvelle_distance, voisin))
+    return dist
+
+def _raccourcis(sortants, entrants, v, oriente):
+    '''Retourne la liste des raccourcis (u, x, poids) à ajouter si la station v est retirée maintenant'''
+    raccourcis = []
+    for (u, poids_entree) in entrants[v].items():
+        cibles = [(x, poids_entree + poids_sortie) for (x, poids_sortie) in sortants[v].items()
+                  if x != u and (oriente or x > u)]      # Non orienté: chaque paire une seule fois
+        if not cibles:
+            continue
+        dist = _temoins(sortants, u, v, max(poids for (_, poids) in cibles))
+        for (x, poids) in cibles:
+            if dist.get(x, math.inf) > poids:      # Aucun autre trajet aussi court: le raccourci est nécessaire
+                raccourcis.append((u, x, poids))
+    return raccourcis
+
+def construire(G, journal=None):
+    '''Construit la hiérarchie de contraction du graphe (Graphe ou GrapheCSR). Les stations sont retirées dans
+    l'ordre de leur priorité: le nombre de raccourcis nécessaires moins le nombre d'arêtes retirées (différence
+    d'arêtes), plus le nombre de voisins déjà retirés (pour répartir les retraits sur tout le réseau). Les
+    priorités sont mises à jour paresseusement. Retourne (hiérarchie, statistiques).'''
+    debut = time.perf_counter()
+    compact = G.grapheCompact()
+    oriente = compact.estOriente()
+    n = compact.taille()
+    sortants = [{} for _ in range(n)]           # {voisin: poids} des arêtes qui restent entre stations non retirées
+    entrants = [{} for _ in range(n)] if oriente else sortants
+    milieux = {}                                # {(u, x): station contournée} pour les raccourcis
+    for s in range(n):
+        for (voisin, poids) in compact.aretesSortantes(s):
+            if poids < math.inf and voisin != s and poids < sortants[s].get(voisin, math.inf):     # Ignore les arêtes fermées
+                sortants[s][voisin] = poids
+                entrants[voisin][s] = poids
+    aretes_graphe = sum(len(voisins) for voisins in sortants)
+
+    def priorite(v):
+        raccourcis = _raccourcis(sortants, entrants, v, oriente)
+        retirees = len(sortants[v]) + (len(entrants[v]) if oriente else 0)
+        return len(raccourcis) - retirees + contractes[v], raccourcis
+
+    contractes = [0] * n        # Nombre de voisins déjà retirés de chaque station
+    tas = [(priorite(v)[0], v) for v in range(n)]
+    heapq.heapify(tas)
+    rangs = array('q', bytes(8 * n))
+    haut = [[] for _ in range(n)]       # Arêtes montantes (voisin, poids, milieu) de chaque station
+    bas = [[] for _ in range(n)]
+    nombre_raccourcis = 0
+    rang = 0
+    while tas:
+        (_, v) = heapq.heappop(tas)
+        (valeur, raccourcis) = priorite(v)
+        if tas and valeur > tas[0][0]:
+            heapq.heappush(tas, (valeur, v))    # La priorité a augmenté: la station attend son tour
+            continue
+        rangs[v] = rang
+        rang += 1
+        # Les arêtes qui restent vont toutes vers des stations de rang plus élevé
+        for (x, poids) in sortants[v].items():
+            haut[v].append((x, poids, milieux.get((v, x), SANS_MILIEU)))
+        for (u, poids) in entrants[v].items():
+            bas[v].append((u, poids, milieux.get((u, v), SANS_MILIEU)))
+        voisins = set(sortants[v]) | set(entrants[v])
+        for x in sortants[v]:
+            del entrants[x][v]
+        if oriente:
+            for u in entrants[v]:
+                del sortants[u][v]
+        sortants[v] = entrants[v] = {}
+        for (u, x, poids) in raccourcis:
+            if poids < sortants[u].get(x, math.inf):
+                sortants[u][x] = poids
+                entrants[x][u] = poids
+                milieux[(u, x)] = v
+                if not oriente:
+                    milieux[(x, u)] = v
+                nombre_raccourcis += 1
+        for voisin in voisins:
+            contractes[voisin] += 1
+        if journal is not None and rang % 10000 == 0:
+            print('%d / %d stations retirées' % (rang, n), file=journal)
+
+    haut = _compiler(haut)
+    hierarchie = HierarchieContraction(list(compact.listeSommets(True)), rangs, haut, _compiler(bas) if oriente else haut, oriente)
+    statistiques = {'sommets': n, 'aretes': aretes_graphe if oriente else aretes_graphe // 2,
+                    'raccourcis': nombre_raccourcis, 'aretes_montantes': hierarchie.nombreAretes(),
+                    'secondes': round(time.perf_counter() - debut, 3)}
+    return hierarchie, statistiques
+
+def _compiler(listes):
+    '''Range les listes d'arêtes (voisin, poids, milieu) de chaque station dans quatre tableaux (format CSR)'''
+    debuts = array('q', [0])
+    cibles, poids, milieux = array('q'), array('q'), array('q')
+    for aretes in listes:
+        for (voisin, poids_arete, milieu) in aretes:
+            cibles.append(voisin)
+            poids.append(poids_arete)
+            milieux.append(milieu)
+        debuts.append(len(cibles))
+    return (debuts, cibles, poids, milieux)
+
+
+'''FICHIER'''
+# Format: en-tête, noms des stations (utf-8, un par ligne), puis les tableaux rangs, haut (debuts, cibles, poids,
+# milieux) et bas (debuts, cibles, poids, milieux), ce dernier seulement pour un graphe orienté
+SIGNATURE_HIERARCHIE = b'CHMETRO\0'
+FORMAT_ENTETE = '<8sIIqqqqq32s'     # signature, version du format, orienté, n, arêtes haut, arêtes bas, mtime_ns et taille de la source, sha256
+VERSION_HIERARCHIE = 1
+
+def ecrire_hierarchie(H, nom_fichier, source):
+    '''Enregistre la hiérarchie dans un fichier binaire, avec la date de modification, la taille et l'empreinte
+    du fichier du graphe pour savoir plus tard si elle est encore valide'''
+    infos = os.stat(source)
+    noms = '\n'.join(H._noms).encode('utf-8')
+    noms += b'\0' * (-len(noms) % 8)
+    entete = struct.pack(FORMAT_ENTETE, SIGNATURE_HIERARCHIE, VERSION_HIERARCHIE, H._oriente, H.taille(),
+                         len(H._haut[1]), len(H._bas[1]) if H._oriente else 0, infos.st_mtime_ns, infos.st_size, metro._empreinte(source))
+    temporaire = nom_fichier + '.tmp'
+    with open(temporaire, 'wb') as fp:
+        fp.write(entete)
+        fp.write(struct.pack('<q', len(noms)))
+        fp.write(noms)
+        for tableau in (H._rangs,) + tuple(H._haut) + (tuple(H._bas) if H._oriente else ()):
+            fp.write(array('q', tableau).tobytes())
+    os.replace(temporaire, nom_fichier)
+
+def lire_hierarchie(nom_fichier, source):
+    '''Projette en mémoire la hiérarchie enregistrée et la retourne, ou None si le fichier est absent, corrompu ou
+    périmé (même règle que metro.lire_instantane)'''
+    try:
+        with open(nom_fichier, 'rb') as fp:
+            tampon = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    taille_entete = struct.calcsize(FORMAT_ENTETE)
+    vue = None
+    try:
+        (signature, version, oriente, n, m_haut, m_bas, mtime_ns, taille, empreinte) = struct.unpack_from(FORMAT_ENTETE, tampon)
+        infos = os.stat(source)
+        if signature != SIGNATURE_HIERARCHIE or version != VERSION_HIERARCHIE:
+            raise ValueError('Hiérarchie invalide')
+        if (mtime_ns, taille) != (infos.st_mtime_ns, infos.st_size):
+            if empreinte != metro._empreinte(source):
+                raise ValueError('Hiérarchie périmée')
+            metro._dater_instantane(nom_fichier, tampon, infos, FORMAT_ENTETE)
+        (longueur_noms,) = struct.unpack_from('<q', tampon, taille_entete)
+        debut = taille_entete + 8
+        if not 0 <= longueur_noms <= len(tampon) - debut or (len(tampon) - debut - longueur_noms) % 8:
+            raise ValueError('Hiérarchie tronquée')     # Les tableaux ne tombent plus sur des entiers de 8 octets
+        noms = tampon[debut:debut + longueur_noms].rstrip(b'\0').decode('utf-8')
+        noms = noms.split('\n') if n else []
+        vue = memoryview(tampon)[debut + longueur_noms:].cast('q')
+        if len(noms) != n or len(vue) != n + (2 if oriente else 1) * (n + 1) + 3 * (m_haut + m_bas):
+            raise ValueError('Hiérarchie tronquée')
+    except (struct.error, ValueError, TypeError, OSError, UnicodeDecodeError):
+        if vue is not None:
+            vue.release()       # Le mmap ne peut pas être fermé tant qu'une vue l'utilise
+        tampon.close()
+        return None
+    tableaux = []
+    position = 0
+    for longueur in (n, n + 1, m_haut, m_haut, m_haut) + ((n + 1, m_bas, m_bas, m_bas) if oriente else ()):
+        tableaux.append(vue[position:position + longueur])
+        position += longueur
+    haut = tuple(tableaux[1:5])
+    H = HierarchieContraction(noms, tableaux[0], haut, tuple(tableaux[5:9]) or haut, bool(oriente), tampon)
+    H._empreinte = empreinte
+    return H
+
+def charger_hierarchie(nom_fichier, journal=None):
+    '''Retourne la hiérarchie du fichier de graphe et ses statistiques de construction (None si elle a été relue du
+    fichier nom_fichier + '.ch'). Elle n'est reconstruite que si le fichier du graphe a changé.'''
+    chemin = os.path.abspath(nom_fichier)
+    nom_hierarchie = chemin + '.ch'
+    H = lire_hierarchie(nom_hierarchie, chemin)
+    if H is not None:
+        return H, None
+    H, statistiques = construire(metro.compiler_fichier_graphe(chemin), journal)    # Sans les fermetures du graphe en mémoire
+    H._empreinte = metro._empreinte(chemin)
+    try:
+        ecrire_hierarchie(H, nom_hierarchie, chemin)
+    except OSError:
+        pass    # Dossier en lecture seule: la hiérarchie reste utilisable en mémoire
+    return H, statistiques
+
+
+def verifier(G, H, nombre, graine=0):
+    '''Compare les trajets de la hiérarchie (longueur annoncée et longueur du chemin déplié) à ceux de dijkstra
+    pour 'nombre' paires de stations au hasard. Retourne le nombre de différences et le temps moyen d'une requête
+    de chaque méthode.'''
+    def longueur(chemin):
+        if chemin is None:
+            return None
+        return sum(G.poids(G.sommet(a), G.sommet(b)) for (a, b) in zip(chemin, chemin[1:]))
+
+    hasard = random.Random(graine)
+    noms = G.listeSommets(True)
+    differences = 0
+    temps_hierarchie = temps_dijkstra = 0
+    for _ in range(nombre):
+        (depart, arrivee) = (hasard.choice(noms), hasard.choice(noms))
+        debut = time.perf_counter()
+        resultat = H.recherche(H.sommet(depart), H.sommet(arrivee))
+        temps_hierarchie += time.perf_counter() - debut
+        debut = time.perf_counter()
+        chemin = metro.dijkstra(G, G.sommet(depart), G.sommet(arrivee))
+        temps_dijkstra += time.perf_counter() - debut
+        attendue = longueur(chemin)
+        if resultat is None:
+            differences += attendue is not None
+        else:
+            chemin = [H.nomSommet(s) for s in resultat[1]]
+            differences += not (resultat[0] == attendue == longueur(chemin) and chemin[0] == depart and chemin[-1] == arrivee)
+    return {'paires': nombre, 'differences': differences, 'ms_hierarchie': round(1000 * temps_hierarchie / nombre, 3),
+            'ms_dijkstra': round(1000 * temps_dijkstra / nombre, 3)}
+
+def main(arguments=None):
+    parseur = argparse.ArgumentParser(description='Construit la hiérarchie de contraction d\'un fichier de graphe.')
+    parseur.add_argument('graphe', nargs='?', default=metro.FICHIER_GRAPHE, help='fichier du graphe (DEPART ARRIVEE LONGUEUR)')
+    parseur.add_argument('--reconstruire', action='store_true', help='reconstruit la hiérarchie même si le fichier .ch est à jour')
+    parseur.add_argument('--trajet', nargs=2, metavar=('DEPART', 'ARRIVEE'), help='affiche le trajet le plus court entre deux stations')
+    parseur.add_argument('--verifier', type=int, default=0, metavar='N', help='compare N trajets au hasard avec dijkstra')
+    args = parseur.parse_args(arguments)
+
+    if args.reconstruire and os.path.exists(args.graphe + '.ch'):
+        os.remove(args.graphe + '.ch')
+    H, statistiques = charger_hierarchie(args.graphe, sys.stderr)
+    if statistiques is None:
+        statistiques = {'sommets': H.taille(), 'aretes_montantes': H.nombreAretes(), 'relue': args.graphe + '.ch'}
+    print(json.dumps(statistiques), file=sys.stderr)       # Temps de construction et nombre de raccourcis
+    if args.trajet:
+        (depart, arrivee) = (H.sommet(args.trajet[0].upper()), H.sommet(args.trajet[1].upper()))
+        if depart is None or arrivee is None:
+            sys.exit('Station inconnue')
+        print(H.trajet(depart, arrivee))
+    if args.verifier:
+        print(json.dumps(verifier(metro.charger_graphe(args.graphe), H, args.verifier)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+'''Importation d'un flux GTFS (horaires de transport en commun) en fichier de réseau compilé pour metro.py.
+
+Le flux (dossier ou archive .zip) est lu en une seule passe par fichier, ligne par ligne: stops.txt donne les
+stations et leurs coordonnées (les quais sont ramenés à leur station parente), routes.txt et trips.txt donnent les
+voyages à garder, et stop_times.txt, souvent des millions de lignes, n'est jamais chargé en entier: seuls les arrêts
+du voyage en cours sont gardés en mémoire. Deux arrêts consécutifs d'un voyage deviennent une arête non orientée,
+longue de la distance à vol d'oiseau (en mètres) entre les deux stations. La mémoire dépend donc du nombre de
+stations, d'arêtes distinctes et de voyages (un identifiant par voyage, pour repérer un stop_times.txt qui n'est
+pas groupé par voyage), pas du nombre de lignes d'horaires, qui est des dizaines de fois plus grand.
+
+Le résultat est un seul fichier (voir metro.ecrire_reseau): les lignes 'STATION NOM X Y' (coordonnées en mètres
+autour du centre du réseau) suivies des arêtes 'DEPART ARRIVEE LONGUEUR'. Il se charge comme caps_metro.txt
+(metro.charger_graphe, instantané .csr compris) et metro.Routeur y lit aussi les coordonnées, sans fichier de ligne.
+
+stop_times.txt doit être groupé par voyage (trip_id), comme le produisent les exportateurs GTFS; l'ordre des arrêts
+dans un voyage est quelconque (ils sont triés par stop_sequence).
+
+Exemples:
+    python gtfs.py gtfs_exemple reseau_exemple.txt
+    python gtfs.py flux_stm.zip reseau_stm.txt --types 1         garde seulement le métro (route_type 1)
+    python metro.py ... / python routage_lot.py requetes.jsonl --graphe reseau_stm.txt
+'''
+
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import sys
+import time
+import zipfile
+
+import metro
+
+RAYON_TERRE = 6371008.8     # Rayon moyen de la Terre, en mètres
+TYPES_IGNORES = ('2', '3', '4')     # location_type des entrées, nœuds génériques et aires d'embarquement
+
+class FluxGTFS:
+    def __init__(self, source):
+        '''Ouvre un flux GTFS: un dossier qui contient les fichiers .txt, ou une archive .zip'''
+        self._archive = zipfile.ZipFile(source) if zipfile.is_zipfile(source) else None
+        self._dossier = source
+        if self._archive is not None:       # Les fichiers peuvent être dans un sous-dossier de l'archive
+            self._chemins = {os.path.basename(nom): nom for nom in self._archive.namelist()}
+
+    def lignes(self, nom):
+        '''Génère chaque ligne du fichier sous forme de dictionnaire {colonne: valeur}, sans tout lire en mémoire'''
+        if self._archive is not None:
+            fp = io.TextIOWrapper(self._archive.open(self._chemins[nom]), encoding='utf-8-sig', newline='')
+        else:
+            fp = open(os.path.join(self._dossier, nom), 'r', encoding='utf-8-sig', newline='')
+        with fp:
+            for ligne in csv.DictReader(fp):
+                yield ligne
+
+    def fermer(self):
+        if self._archive is not None:
+            self._archive.close()
+
+def distance_metres(position1, position2):
+    '''Distance à vol d'oiseau (formule de haversine) entre deux positions (latitude, longitude) en degrés'''
+    (lat1, lon1) = map(math.radians, position1)
+    (lat2, lon2) = map(math.radians, position2)
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RAYON_TERRE * math.asin(min(1.0, math.sqrt(a)))
+
+def nom_station(texte):
+    '''Met le nom d'un arrêt GTFS dans la forme des noms du métro: majuscules, sans espaces (ex: PLACE-DES-ARTS).
+    Un '#' au début est retiré: le fichier de réseau prendrait la ligne de l'arête pour un commentaire.'''
+    return '-'.join(texte.strip().lstrip('#').upper().split()) or '?'
+
+def lire_arrets(flux):
+    '''Lit stops.txt. Retourne (numéro de station de chaque stop_id, [(nom, latitude, longitude)] des stations).
+    Un quai qui a une station parente (parent_station) est ramené à cette station.'''
+    stations = []
+    numeros = {}        # {stop_id: numéro de station}
+    parents = {}        # {stop_id d'un quai: stop_id de sa station parente}
+    for ligne in flux.lignes('stops.txt'):
+        if ligne.get('location_type', '') in TYPES_IGNORES:
+            continue
+        parent = ligne.get('parent_station', '')
+        if parent:
+            parents[ligne['stop_id']] = parent
+            continue
+        numeros[ligne['stop_id']] = len(stations)
+        stations.append((ligne.get('stop_name', '') or ligne['stop_id'], float(ligne['stop_lat']), float(ligne['stop_lon'])))
+    for (arret, parent) in parents.items():     # Le fichier peut nommer un quai avant sa station parente
+        if parent in numeros:
+            numeros[arret] = numeros[parent]
+    return numeros, stations
+
+def lire_voyages(flux, types_routes=None):
+    '''Lit trips.txt (et routes.txt pour filtrer par route_type). Retourne l'ensemble des trip_id à garder, ou
+    None pour les garder tous.'''
+    if types_routes is None:
+        return None
+    routes = {ligne['route_id'] for ligne in flux.lignes('routes.txt') if ligne['route_type'] in types_routes}
+    return {ligne['trip_id'] for ligne in flux.lignes('trips.txt') if ligne['route_id'] in routes}
+
+def lire_horaires(flux, numeros, voyages=None):
+    '''Parcourt stop_times.txt une seule fois, un voyage à la fois (seuls les identifiants des voyages terminés sont
+    gardés, pour refuser un fichier qui n'est pas groupé par voyage). Retourne ({(station, station): None} des paires
+    de stations consécutives, statistiques). Les voyages qui suivent la même suite de stations qu'un voyage déjà
+    vu (la plupart, puisqu'un même parcours revient toute la journée) ne sont pas refaits.'''
+    paires = {}         # Un dictionnaire garde l'ordre d'apparition des arêtes, donc un fichier de sortie stable
+    parcours = set()    # Suites de stations déjà traitées
+    termines = set()    # Voyages déjà traités, pour repérer un fichier qui n'est pas groupé par voyage (un par voyage)
+    statistiques = {'horaires': 0, 'voyages': 0, 'parcours': 0, 'arrets_inconnus': 0}
+
+    def traiter(arrets):
+        arrets.sort()
+        suite = []
+        for (_, station) in arrets:
+            if not suite or suite[-1] != station:   # Deux quais de la même station ne font pas une arête
+                suite.append(station)
+        suite = tuple(suite)
+        if suite in parcours:
+            return
+        parcours.add(suite)
+        for (station1, station2) in zip(suite, suite[1:]):
+            paires[(station1, station2) if station1 < station2 else (station2, station1)] = None
+
+    voyage = None
+    arrets = []         # [(stop_sequence, station)] du voyage en cours
+    for ligne in flux.lignes('stop_times.txt'):
+        statistiques['horaires'] += 1
+        if ligne['trip_id'] != voyage:
+            if arrets:
+                traiter(arrets)
+            if voyage is not None:
+                termines.add(voyage)
+            voyage = ligne['trip_id']
+            arrets = []
+            if voyage in termines:
+                raise ValueError("stop_times.txt n'est pas groupé par trip_id (voyage %r en deux morceaux)" % voyage)
+            statistiques['voyages'] += voyages is None or voyage in voyages
+        if voyages is not None and voyage not in voyages:
+            continue
+        station = numeros.get(ligne['stop_id'])
+        if station is None:
+            statistiques['arrets_inconnus'] += 1
+            continue
+        arrets.append((int(ligne['stop_sequence']), station))
+    if arrets:
+        traiter(arrets)
+    statistiques['parcours'] = len(parcours)
+    return paires, statistiques
+
+def importer_gtfs(source, sortie, types_routes=None):
+    '''Compile le flux GTFS (dossier ou .zip) en fichier de réseau (voir metro.ecrire_reseau). 'types_routes' garde
+    seulement les voyages de ces route_type (ex: {'1'} pour le métro). Retourne les statistiques de l'importation.'''
+    debut = time.perf_counter()
+    flux = FluxGTFS(source)
+    try:
+        (numeros, arrets) = lire_arrets(flux)
+        voyages = lire_voyages(flux, types_routes)
+        (paires, statistiques) = lire_horaires(flux, numeros, voyages)
+    finally:
+        flux.fermer()
+
+    utilisees = sorted({station for paire in paires for station in paire})     # Stations desservies par un voyage gardé
+    if not utilisees:
+        raise ValueError('Aucun voyage dans le flux GTFS %s' % source)
+    # Projection équirectangulaire en mètres autour du centre du réseau, suffisante à l'échelle d'une ville
+    lat0 = sum(arrets[station][1] for station in utilisees) / len(utilisees)
+    lon0 = sum(arrets[station][2] for station in utilisees) / len(utilisees)
+    metres_par_degre = math.pi * RAYON_TERRE / 180
+    noms = {}
+    stations = {}
+    for station in utilisees:
+        (texte, lat, lon) = arrets[station]
+        nom = nom_station(texte)
+        if nom in stations:     # Deux stations du même nom: la seconde reçoit un suffixe
+            suffixe = 2
+            while '%s-%d' % (nom, suffixe) in stations:
+                suffixe += 1
+            nom = '%s-%d' % (nom, suffixe)
+        noms[station] = nom
+        stations[nom] = (round((lon - lon0) * metres_par_degre * math.cos(math.radians(lat0))),
+                         round((lat - lat0) * metres_par_degre))
+
+    def aretes():
+        for (station1, station2) in paires:
+            longueur = distance_metres(arrets[station1][1:], arrets[station2][1:])
+            yield (noms[station1], noms[station2], max(1, round(longueur)))
+
+    metro.ecrire_reseau(sortie, stations, aretes(), 'RÉSEAU IMPORTÉ DU FLUX GTFS %s' % os.path.basename(source.rstrip('/')))
+    statistiques.update({'stations': len(stations), 'aretes': len(paires),
+                         'secondes': round(time.perf_counter() - debut, 3)})
+    return statistiques
+
+def main(arguments=None):
+    parseur = argparse.ArgumentParser(description='Compile un flux GTFS en fichier de réseau pour le routage.')
+    parseur.add_argument('flux', help='dossier ou archive .zip du flux GTFS')
+    parseur.add_argument('sortie', help='fichier de réseau à écrire (STATION NOM X Y, puis DEPART ARRIVEE LONGUEUR)')
+    parseur.add_argument('--types', nargs='+', metavar='TYPE',
+                         help='route_type des lignes à garder (ex: 1 pour le métro, 2 pour le train); toutes par défaut')
+    args = parseur.parse_args(arguments)
+    try:
+        statistiques = importer_gtfs(args.flux, args.sortie, set(args.types) if args.types else None)
+    except (OSError, KeyError, ValueError) as erreur:
+        sys.exit('Importation impossible: %s' % erreur)
+    print(json.dumps(statistiques), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+'''Matrice origine-destination: distance et station suivante pour toutes les paires de stations.
+
+Les destinations sont réparties entre les processus d'un groupe. Chaque processus calcule l'arbre inverse des plus
+courts chemins de ses destinations (metro.arbre_plus_courts_chemins) et écrit directement ses rangées dans le
+fichier de la matrice, projeté en mémoire (mmap partagé): aucun résultat n'est renvoyé par pickle au processus
+principal. Le fichier contient deux matrices n x n rangées par destination:
+    distances[destination][depart]  longueur du trajet le plus court de depart à destination (-1: inatteignable)
+    suivants[destination][depart]   station suivante sur ce trajet (-1: aucune)
+Un trajet se lit donc en suivant les stations suivantes d'une même rangée, en O(longueur du trajet).
+
+La matrice est enregistrée à côté du fichier du graphe (nom + '.od') et recalculée seulement si ce fichier a
+changé (même règle que l'instantané .csr). Les fermetures faites en mémoire pendant l'exécution n'y sont pas.
+
+Exemples:
+    python matrice_od.py caps_metro.txt --processus 4
+    python matrice_od.py caps_metro.txt --trajet ANGRIGNON LONGUEUIL
+'''
+
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from array import array
+
+import metro
+
+SIGNATURE_MATRICE = b'ODMETRO\0'
+FORMAT_ENTETE = '<8sIIqqq32s'   # signature, version du format, poids entiers (1) ou non (0), n, mtime_ns et taille de la source, sha256
+VERSION_MATRICE = 1
+INATTEIGNABLE = -1
+
+_graphe = None      # Graphe du processus de travail courant
+_matrice = None     # Matrice (MatriceOD) en cours d'écriture, projetée en mémoire dans le processus courant
+
+class MatriceOD:
+    def __init__(self, noms, tampon, debut, entiers, nom_fichier):
+        '''Crée la matrice à partir du fichier projeté en mémoire (tampon); les deux matrices commencent à la
+        position 'debut' (en octets)'''
+        self._noms = noms
+        self._indices = {nom: i for (i, nom) in enumerate(noms)}
+        self._tampon = tampon
+        self._debut = debut
+        self._entiers = entiers
+        self._nom_fichier = nom_fichier
+        n = len(noms)
+        self._vue = memoryview(tampon)
+        self._distances = self._vue[debut:debut + 8 * n * n].cast('q' if entiers else 'd')
+        self._suivants = self._vue[debut + 8 * n * n:debut + 12 * n * n].cast('i')
+
+    def taille(self):
+        '''Retourne le nombre de stations'''
+        return len(self._noms)
+
+    def sommet(self, nom):
+        '''Retourne le numéro de la station de ce nom'''
+        return self._indices.get(nom)
+
+    def nomSommet(self, s):
+        '''Retourne le nom de la station s'''
+        return self._noms[s]
+
+    def distance(self, depart, destination):
+        '''Retourne la longueur du trajet le plus court entre deux stations (numéros), ou None si inatteignable'''
+        distance = self._distances[destination * len(self._noms) + depart]
+        return None if distance == INATTEIGNABLE else distance
+
+    def trajet(self, depart, destination):
+        '''Retourne la liste des noms des stations du trajet le plus court (lue dans la matrice des stations
+        suivantes, en O(longueur du trajet)), ou None si la destination est inatteignable'''
+        if self.distance(depart, destination) is None:
+            return None
+        rangee = destination * len(self._noms)
+        chemin = [self._noms[depart]]
+        while depart != destination:
+            depart = self._suivants[rangee + depart]
+            chemin.append(self._noms[depart])
+        return chemin
+
+    def _ecrireRangee(self, destination, dist, suivant):
+        '''Écrit la rangée d'une destination à partir des dictionnaires de l'arbre inverse des plus courts chemins'''
+        n = len(self._noms)
+        distances = array(self._distances.format, [INATTEIGNABLE]) * n
+        suivants = array('i', [INATTEIGNABLE]) * n
+        for (s, distance) in dist.items():
+            distances[s] = distance
+        for (s, station) in suivant.items():
+            if station is not None:
+                suivants[s] = station
+        self._distances[destination * n:(destination + 1) * n] = distances
+        self._suivants[destination * n:(destination + 1) * n] = suivants
+
+    def en_numpy(self):
+        '''Retourne les deux matrices (distances, suivants) sous forme de numpy.memmap de forme (n, n), indexées
+        [destination, depart], sans copie'''
+        if metro.np is None:
+            raise ImportError('numpy est nécessaire pour MatriceOD.en_numpy')
+        n = len(self._noms)
+        distances = metro.np.memmap(self._nom_fichier, '<i8' if self._entiers else '<f8', 'r', self._debut, (n, n))
+        suivants = metro.np.memmap(self._nom_fichier, '<i4', 'r', self._debut + 8 * n * n, (n, n))
+        return distances, suivants
+
+    def fermer(self):
+        '''Libère la projection en mémoire du fichier'''
+        for vue in (self._distances, self._suivants, self._vue):
+            vue.release()
+        self._tampon.close()
+
+
+def _ouvrir(nom_fichier, source, ecriture=False):
+    '''Projette en mémoire le fichier de la matrice et retourne la MatriceOD, ou None si le fichier est absent,
+    corrompu ou périmé par rapport à la source'''
+    try:
+        with open(nom_fichier, 'r+b' if ecriture else 'rb') as fp:
+            tampon = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_WRITE if ecriture else mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    taille_entete = struct.calcsize(FORMAT_ENTETE)
+    try:
+        (signature, version, entiers, n, mtime_ns, taille, empreinte) = struct.unpack_from(FORMAT_ENTETE, tampon)
+        infos = os.stat(source)
+        if signature != SIGNATURE_MATRICE or version != VERSION_MATRICE:
+            raise ValueError('Matrice invalide')
+        if not ecriture and (mtime_ns, taille) != (infos.st_mtime_ns, infos.st_size) and empreinte != metro._empreinte(source):
+            raise ValueError('Matrice périmée')
+        (longueur_noms,) = struct.unpack_from('<q', tampon, taille_entete)
+        debut = taille_entete + 8
+        noms = tampon[debut:debut + longueur_noms].rstrip(b'\0').decode('utf-8')
+        noms = noms.split('\n') if n else []
+        if len(noms) != n or len(tampon) != debut + longueur_noms + 12 * n * n:
+            raise ValueError('Matrice tronquée')
+    except (struct.error, ValueError, OSError, UnicodeDecodeError):
+        tampon.close()
+        return None
+    return MatriceOD(noms, tampon, debut + longueur_noms, bool(entiers), nom_fichier)
+
+def lire_matrice(nom_fichier, source):
+    '''Retourne la matrice enregistrée dans le fichier, ou None si elle est absente, corrompue ou périmée'''
+    return _ouvrir(nom_fichier, source)
+
+def _creer_fichier(nom_fichier, G, source):
+    '''Crée le fichier de la matrice (en-tête, noms et matrices remplies de zéros) à la bonne taille'''
+    infos = os.stat(source)
+    noms = G.listeSommets(True)
+    n = len(noms)
+    entiers = isinstance(G.grapheCompact()._poids, (array, memoryview))    # Poids entiers: voir metro.compiler_csr
+    bloc_noms = '\n'.join(noms).encode('utf-8')
+    bloc_noms += b'\0' * (-len(bloc_noms) % 8)
+    with open(nom_fichier, 'wb') as fp:
+        fp.write(struct.pack(FORMAT_ENTETE, SIGNATURE_MATRICE, VERSION_MATRICE, entiers, n,
+                             infos.st_mtime_ns, infos.st_size, metro._empreinte(source)))
+        fp.write(struct.pack('<q', len(bloc_noms)))
+        fp.write(bloc_noms)
+        fp.truncate(fp.tell() + 12 * n * n)     # Fichier creux: les pages ne sont allouées qu'à l'écriture
+
+def _graphe_du_fichier(chemin):
+    '''Retourne le graphe tel qu'il est dans le fichier, sans les fermetures faites en mémoire (chaque appel à
+    metro.charger_graphe reçoit sa propre copie). Il est relu de son instantané .csr, dont les pages sont partagées
+    entre les processus.'''
+    return metro.charger_graphe(chemin)
+
+def _initialiser(fichier_graphe, nom_fichier):
+    '''Prépare un processus de travail: relit le graphe et projette la matrice en écriture'''
+    global _graphe, _matrice
+    _graphe = _graphe_du_fichier(fichier_graphe)
+    _matrice = _ouvrir(nom_fichier, fichier_graphe, ecriture=True)
+
+def _calculer_rangees(debut, fin):
+    '''Calcule et écrit les rangées des destinations debut à fin - 1. Retourne le nombre de rangées.'''
+    for destination in range(debut, fin):
+        dist, suivant = metro.arbre_plus_courts_chemins(_graphe, destination)
+        _matrice._ecrireRangee(destination, dist, suivant)
+    return fin - debut
+
+def calculer_matrice(fichier_graphe, nom_fichier=None, processus=None, taille_paquet=16):
+    '''Calcule la matrice origine-destination du fichier de graphe avec un groupe de processus, et l'enregistre
+    dans nom_fichier (par défaut: fichier_graphe + '.od'). Retourne les statistiques {'stations', 'processus',
+    'secondes', 'rangees_par_seconde'}.'''
+    debut = time.perf_counter()
+    chemin = os.path.abspath(fichier_graphe)
+    nom_fichier = nom_fichier or chemin + '.od'
+    if processus is None:
+        processus = os.cpu_count() or 1
+    G = _graphe_du_fichier(chemin)      # Compile l'instantané binaire au besoin, avant de lancer les processus
+    n = G.taille()
+    temporaire = nom_fichier + '.tmp'
+    _creer_fichier(temporaire, G, chemin)
+    intervalles = [(i, min(i + taille_paquet, n)) for i in range(0, n, taille_paquet)]
+    if processus <= 1:
+        _initialiser(chemin, temporaire)
+        for intervalle in intervalles:
+            _calculer_rangees(*intervalle)
+    else:
+        with multiprocessing.Pool(processus, initializer=_initialiser, initargs=(chemin, temporaire)) as groupe:
+            for _ in groupe.starmap(_calculer_rangees, intervalles, chunksize=1):
+                pass
+    global _matrice
+    if _matrice is not None:
+        _matrice.fermer()
+        _matrice = None
+    os.replace(temporaire, nom_fichier)     # Les rangées sont dans le fichier: les processus ont écrit dans la même projection
+    secondes = time.perf_counter() - debut
+    return {'stations': n, 'processus': processus, 'secondes': round(secondes, 3),
+            'rangees_par_seconde': round(n / secondes, 1) if secondes > 0 else None}
+
+def charger_matrice(fichier_graphe, processus=None):
+    '''Retourne la matrice du fichier de graphe et les statistiques du calcul (None si elle a été relue du fichier
+    fichier_graphe + '.od'). Elle n'est recalculée que si le fichier du graphe a changé.'''
+    chemin = os.path.abspath(fichier_graphe)
+    matrice = lire_matrice(chemin + '.od', chemin)
+    if matrice is not None:
+        return matrice, None
+    statistiques = calculer_matrice(chemin, processus=processus)
+    return lire_matrice(chemin + '.od', chemin), statistiques
+
+def main(arguments=None):
+    parseur = argparse.ArgumentParser(description='Calcule la matrice des distances entre toutes les stations.')
+    parseur.add_argument('graphe', nargs='?', default=metro.FICHIER_GRAPHE, help='fichier du graphe (DEPART ARRIVEE LONGUEUR)')
+    parseur.add_argument('--processus', type=int, default=None, help='nombre de processus (par défaut: un par cœur)')
+    parseur.add_argument('--recalculer', action='store_true', help='recalcule la matrice même si le fichier .od est à jour')
+    parseur.add_argument('--trajet', nargs=2, metavar=('DEPART', 'ARRIVEE'), help='affiche la distance et le trajet entre deux stations')
+    args = parseur.parse_args(arguments)
+
+    if args.recalculer:
+        statistiques = calculer_matrice(args.graphe, processus=args.processus)
+        matrice = lire_matrice(os.path.abspath(args.graphe) + '.od', os.path.abspath(args.graphe))
+    else:
+        matrice, statistiques = charger_matrice(args.graphe, args.processus)
+    print(json.dumps(statistiques or {'stations': matrice.taille(), 'relue': args.graphe + '.od'}), file=sys.stderr)
+    if args.trajet:
+        (depart, arrivee) = (matrice.sommet(args.trajet[0].upper()), matrice.sommet(args.trajet[1].upper()))
+        if depart is None or arrivee is None:
+            sys.exit('Station inconnue')
+        print(json.dumps({'distance': matrice.distance(depart, arrivee), 'trajet': matrice.trajet(depart, arrivee)},
+                         ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+'''Instrumentation optionnelle du routage: durée de chaque étape et compteurs des recherches.
+
+Les valeurs sont regroupées dans des histogrammes à intervalles fixes (mémoire constante), d'où sont tirés les
+percentiles. Les mesures peuvent être exportées en JSON ou dans le format texte de Prometheus.
+
+    m = Mesures()
+    with m.etape('recherche'):
+        ...
+    m.compter({'sommets_fixes': 42})
+    print(m.en_prometheus())
+
+Lorsque l'instrumentation n'est pas activée (voir metro.activer_instrumentation), aucun objet Mesures n'existe
+et les étapes ne coûtent qu'un appel de fonction.
+'''
+
+import bisect
+import json
+import threading
+import time
+
+# Bornes supérieures des intervalles des histogrammes (la dernière classe, sans borne, est implicite)
+BORNES_SECONDES = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BORNES_COMPTES = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000,
+                  100000, 200000, 500000, 1000000)
+PERCENTILES = (50, 90, 99)
+
+class Histogramme:
+    def __init__(self, bornes):
+        '''Crée un histogramme vide avec ces bornes supérieures d'intervalles'''
+        self.bornes = bornes
+        self.effectifs = [0] * (len(bornes) + 1)
+        self.nombre = 0
+        self.somme = 0
+        self.minimum = None
+        self.maximum = None
+
+    def observer(self, valeur):
+        '''Ajoute une valeur à l'histogramme'''
+        self.effectifs[bisect.bisect_left(self.bornes, valeur)] += 1
+        self.nombre += 1
+        self.somme += valeur
+        if self.minimum is None or valeur < self.minimum:
+            self.minimum = valeur
+        if self.maximum is None or valeur > self.maximum:
+            self.maximum = valeur
+
+    def percentile(self, p):
+        '''Retourne une estimation du p-ième percentile, par interpolation linéaire dans l'intervalle qui le contient'''
+        if self.nombre == 0:
+            return None
+        rang = p / 100 * self.nombre
+        cumul = 0
+        for (i, effectif) in enumerate(self.effectifs):
+            if effectif and cumul + effectif >= rang:
+                bas = self.bornes[i - 1] if i > 0 else self.minimum
+                haut = self.bornes[i] if i < len(self.bornes) else self.maximum
+                (bas, haut) = (max(bas, self.minimum), min(haut, self.maximum))
+                return bas + (haut - bas) * (rang - cumul) / effectif
+            cumul += effectif
+        return self.maximum
+
+    def resume(self):
+        '''Retourne un dictionnaire avec le nombre, la somme, le minimum, le maximum et les percentiles'''
+        resume = {'nombre': self.nombre, 'somme': self.somme, 'min': self.minimum, 'max': self.maximum}
+        for p in PERCENTILES:
+            resume['p%d' % p] = self.percentile(p)
+        return resume
+
+class _Chronometre:
+    '''Gestionnaire de contexte qui mesure la durée d'une étape'''
+    __slots__ = ('_mesures', '_nom', '_debut')
+
+    def __init__(self, mesures, nom):
+        self._mesures = mesures
+        self._nom = nom
+
+    def __enter__(self):
+        self._debut = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        self._mesures.observer(self._nom, time.perf_counter() - self._debut)
+        return False
+
+class Mesures:
+    def __init__(self):
+        '''Crée un ensemble de mesures vide'''
+        self._etapes = {}       # {nom de l'étape: Histogramme des durées en secondes}
+        self._compteurs = {}    # {nom du compteur: Histogramme des valeurs par recherche}
+        self._crochets = []
+        self._verrou = threading.Lock()     # Les mesures peuvent venir de plusieurs fils (serveur)
+
+    def ajouter_crochet(self, crochet):
+        '''Ajoute une fonction appelée à chaque mesure avec (genre, nom, valeur), où genre vaut 'etape' ou 'compteur'.
+        Permet par exemple de journaliser chaque mesure ou de l'envoyer à un autre système.'''
+        self._crochets.append(crochet)
+
+    def etape(self, nom):
+        '''Retourne un gestionnaire de contexte qui mesure la durée du bloc 'with' sous ce nom d'étape'''
+        return _Chronometre(self, nom)
+
+    def observer(self, nom, secondes):
+        '''Ajoute la durée (en secondes) d'une étape'''
+        with self._verrou:
+            if nom not in self._etapes:
+                self._etapes[nom] = Histogramme(BORNES_SECONDES)
+            self._etapes[nom].observer(secondes)
+        for crochet in self._crochets:
+            crochet('etape', nom, secondes)
+
+    def compter(self, compteurs, prefixe=''):
+        '''Ajoute les compteurs d'une recherche (dictionnaire {nom: valeur}, comme ceux remplis par dijkstra)'''
+        with self._verrou:
+            for (nom, valeur) in compteurs.items():
+                nom = prefixe + nom
+                if nom not in self._compteurs:
+                    self._compteurs[nom] = Histogramme(BORNES_COMPTES)
+                self._compteurs[nom].observer(valeur)
+        for crochet in self._crochets:
+            for (nom, valeur) in compteurs.items():
+                crochet('compteur', prefixe + nom, valeur)
+
+    def en_dictionnaire(self):
+        '''Retourne le résumé (percentiles, etc.) de chaque étape et de chaque compteur'''
+        with self._verrou:
+            return {'etapes': {nom: h.resume() for (nom, h) in self._etapes.items()},
+                    'compteurs': {nom: h.resume() for (nom, h) in self._compteurs.items()}}
+
+    def en_json(self):
+        '''Retourne les mesures en JSON'''
+        return json.dumps(self.en_dictionnaire(), indent=2)
+
+    def en_prometheus(self):
+        '''Retourne les mesures dans le format texte d'exposition de Prometheus (histogrammes cumulatifs)'''
+        lignes = []
+        with self._verrou:
+            for (famille, etiquette, histogrammes) in (('metro_etape_secondes', 'etape', self._etapes),
+                                                       ('metro_recherche_compteur', 'compteur', self._compteurs)):
+                if not histogrammes:
+                    continue
+                lignes.append('# TYPE %s histogram' % famille)
+                for (nom, h) in sorted(histogrammes.items()):
+                    cumul = 0
+                    for (borne, effectif) in zip(h.bornes + ('+Inf',), h.effectifs):
+                        cumul += effectif
+                        lignes.append('%s_bucket{%s="%s",le="%s"} %d' % (famille, etiquette, nom, borne, cumul))
+                    lignes.append('%s_sum{%s="%s"} %s' % (famille, etiquette, nom, h.somme))
+                    lignes.append('%s_count{%s="%s"} %d' % (famille, etiquette, nom, h.nombre))
+        return '\n'.join(lignes) + '\n'
+
+    def ecrire(self, nom_fichier):
+        '''Écrit les mesures dans un fichier: format Prometheus si le nom finit par '.prom', sinon JSON'''
+        with open(nom_fichier, 'w', encoding='utf-8') as fp:
+            fp.write(self.en_prometheus() if nom_fichier.endswith('.prom') else self.en_json() + '\n')
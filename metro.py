@@ -1,139 +1,524 @@
 # NOMS : Kenny Ly, Théo Houlachi, Léonard Shi, Eva Delarue
 
-import turtle
-import tkinter
+import argparse
 import math
 import random
-
-'''CLASS PILE'''
-class Pile:
-    def __init__(self):
-        self._data = []
-
-    def taille(self):
-        return len(self._data)
-
-    def estvide(self):
-        return self.taille() == 0
-
-    def empile(self, s):
-        self._data.append(s)
-
-    def depile(self):
-        if self.estvide():
-            raise LookupError('La pile est vide')
-        return self._data.pop()
-
-    def sommet(self):
-        if self.estvide():
-            raise LookupError('La pile est vide')
-        return self._data[-1]
-
-    def change_sommet(self, s):
-        if self.estvide():
-            raise LookupError('La pile est vide')
-        self._data[-1] = s
-
-    def __str__(self):
-        return 'Pile: ' + ', '.join([str(item) for item in self._data])
+import heapq
+import os
+import mmap
+import struct
+import sys
+import hashlib
+import json
+import contextlib
+import bisect
+import collections
+import itertools
+import unicodedata
+from array import array
+try:
+    import numpy as np
+except ImportError:     # NumPy est optionnel: sans lui, les requêtes en lot sont traitées une à une
+    np = None
+
+import mesures
 
 '''CLASS GRAPHE'''
-# Classes pour représenter les graphes
-# On définit deux classes: Sommet et Graphe
+# Classe pour représenter les graphes
 
-# Un sommet connaît son nom (une chaîne) et ses voisins (un
-# dictionnaire qui associe des sommets à des poids d'arêtes)
+# Pour prendre peu de mémoire, chaque sommet est un entier de 0 à n-1: son nom
+# n'est gardé qu'une fois, et les arêtes sont rangées dans des tableaux d'entiers
+# (array) plutôt que dans un dictionnaire de voisins par sommet.
 
-# version 2: supporte les graphes orientés et non orientés
+# version 3: sommets numérotés et arêtes en tableaux; supporte les graphes orientés et non orientés
 
-class Sommet:
-    def __init__(self, nom):
-        '''Crée un sommet relié à aucune arête'''
-        self._nom = nom
-        self._voisins = {}
+# Pour le code écrit avec la version 2, Graphe.sommet, Graphe.listeSommets et Graphe.listeAretes retournent des
+# Sommet: un Sommet est le numéro du sommet (un int, utilisable partout où un numéro est attendu) qui connaît aussi
+# son graphe, pour offrir les méthodes de l'ancienne classe. Il n'est créé qu'à la demande: le graphe ne garde que des numéros.
+class Sommet(int):
+    def __new__(cls, graphe, numero):
+        sommet = int.__new__(cls, numero)
+        sommet._graphe = graphe
+        return sommet
+
+    def __reduce__(self):
+        return (int, (int(self),))      # Envoyé à un autre processus comme un simple numéro
 
     def ajouteVoisin(self, v, poids=1):
-        '''Ajoute ou modifie une arête entre moi et v'''
-        self._voisins[v] = poids
+        '''Ajoute ou modifie une arête entre moi et v (dans les deux sens si le graphe n'est pas orienté)'''
+        self._graphe.ajouteArete(str(self), self._graphe.nomSommet(v), poids)
 
     def listeVoisins(self):
         '''Liste tous les voisins'''
-        return self._voisins.keys()
+        return [Sommet(self._graphe, v) for (v, _) in self._graphe.aretesSortantes(self)]
 
     def estVoisin(self, v):
         '''Retourne un booléen: True si je suis voisin de v, False sinon'''
-        return v in self._voisins
+        return self._graphe.poids(self, v) is not None
 
     def poids(self, v):
         '''Retourne le poids de l'arête qui me connecte à v'''
-        if v in self._voisins:
-            return self._voisins[v]
-        return None
+        return self._graphe.poids(self, v)
 
     def __str__(self):
         '''Retourne mon nom'''
-        return str(self._nom)
+        return str(self._graphe.nomSommet(self))
 
-# Un graphe connaît ses sommets
-# C'est un dictionnaire qui associe des noms avec des sommets
+# Un graphe connaît le nom de ses sommets et la liste des arêtes ajoutées.
+# Les parcours utilisent la version compilée des arêtes (un GrapheCSR), qui est
+# reconstruite au besoin après l'ajout d'un sommet ou d'une arête. Les fermetures
+# et les changements de poids sont faits directement dans la version compilée.
 class Graphe:
     def __init__(self, oriente=True):
         '''Crée un graphe vide'''
-        self._sommets = {}
+        self._noms = []             # Nom de chaque sommet, dans l'ordre d'ajout
+        self._indices = {}          # {nom: numéro du sommet}
+        self._origines = array('i')         # Les arêtes, dans l'ordre d'ajout: origine, destination et poids
+        self._destinations = array('i')
+        self._poids = array('q')            # Devient une liste si un poids non entier est ajouté
         self._oriente = oriente
+        self._compact = None        # GrapheCSR des arêtes, compilé au besoin
+        self._version = 0           # Augmente à chaque modification pour invalider les calculs mis en cache
+        self._aretes_fermees = set()        # {(origine, destination)}, à refermer dans chaque nouvelle version compilée
+        self._sommets_fermes = set()
+        self._version_compilee = (0, 0)     # (version du graphe, version du GrapheCSR) à la dernière compilation
 
     def estOriente(self):
         return self._oriente
 
+    def version(self):
+        '''Retourne le numéro de version du graphe, qui change à chaque modification'''
+        return self._version
+
+    def taille(self):
+        '''Retourne le nombre de sommets'''
+        return len(self._noms)
+
     def sommet(self, nom):
-        '''Retourne le sommet de ce nom'''
-        if nom in self._sommets:
-            return self._sommets[nom]
-        return None
+        '''Retourne le sommet de ce nom (son numéro, sous forme de Sommet), ou None'''
+        i = self._indices.get(nom)
+        return None if i is None else Sommet(self, i)
 
     def listeSommets(self, noms=False):
-        '''Liste tous les sommets'''
+        '''Liste tous les sommets (leurs noms, ou les Sommet)'''
         if noms:
-            return list(self._sommets.keys())
+            return list(self._noms)
         else:
-            return list(self._sommets.values())
+            return [Sommet(self, i) for i in range(len(self._noms))]
 
     def ajouteSommet(self, nom):
         '''Ajoute un nouveau sommet'''
-        if nom in self._sommets:
+        if nom in self._indices:
             return None  # sommet déjà présent
-        nouveauSommet = Sommet(nom)
-        self._sommets[nom] = nouveauSommet
+        self._indices[nom] = len(self._noms)
+        self._noms.append(nom)
+        self._compact = None
+        self._version += 1
 
     def ajouteArete(self, origine, destination, poids=1):
-        '''Relie les deux sommets par une arête.
+        '''Relie les deux sommets par une arête (ou change le poids de l'arête si elle existe déjà).
            Crée les sommets s'ils n'existent pas déjà'''
         self.ajouteSommet(origine)  # ne fait rien si les
         self.ajouteSommet(destination)  # sommets existent déjà
-        s1 = self.sommet(origine)
-        s2 = self.sommet(destination)
-        s1.ajouteVoisin(s2, poids)
-        if not self._oriente and origine != destination:
-            s2.ajouteVoisin(s1, poids)
+        self._noteArete(self._indices[origine], self._indices[destination], poids)
+        self._compact = None    # les arêtes devront être recompilées
+        self._version += 1
+
+    def _noteArete(self, i, j, poids):
+        '''Ajoute l'arête (i, j) à la fin des tableaux d'arêtes'''
+        if isinstance(self._poids, array) and not isinstance(poids, int):
+            self._poids = list(self._poids)
+        self._origines.append(i)
+        self._destinations.append(j)
+        self._poids.append(poids)
+
+    def _cle(self, i, j):
+        '''Retourne la clé de l'arête (i, j): dans un graphe non orienté, (i, j) et (j, i) sont la même arête'''
+        return (i, j) if self._oriente or i <= j else (j, i)
+
+    def fermeArete(self, origine, destination):
+        '''Ferme l'arête entre les deux sommets (par exemple un segment en travaux): plus aucun trajet ne l'emprunte'''
+        self.grapheCompact().fermeArete(origine, destination)
+        self._aretes_fermees.add(self._cle(self._indices[origine], self._indices[destination]))
+        self._version += 1
+
+    def ouvreArete(self, origine, destination):
+        '''Rouvre une arête fermée par fermeArete'''
+        self.grapheCompact().ouvreArete(origine, destination)
+        self._aretes_fermees.discard(self._cle(self._indices[origine], self._indices[destination]))
+        self._version += 1
+
+    def fermeSommet(self, nom):
+        '''Ferme le sommet: plus aucun trajet ne passe par lui, ni n'en part, ni n'y arrive'''
+        self.grapheCompact().fermeSommet(nom)
+        self._sommets_fermes.add(self._indices[nom])
+        self._version += 1
+
+    def ouvreSommet(self, nom):
+        '''Rouvre un sommet fermé par fermeSommet'''
+        self.grapheCompact().ouvreSommet(nom)
+        self._sommets_fermes.discard(self._indices[nom])
+        self._version += 1
+
+    def changePoids(self, origine, destination, poids):
+        '''Change le poids d'une arête existante sans recompiler le graphe'''
+        self.grapheCompact().changePoids(origine, destination, poids)
+        self._noteArete(self._indices[origine], self._indices[destination], poids)    # Gardé lors de la prochaine compilation
+        self._version += 1
+
+    def fermetures(self):
+        '''Retourne la liste des arêtes fermées (paires de noms) et la liste des sommets fermés'''
+        return self.grapheCompact().fermetures()
+
+    def modificationsDepuis(self, version):
+        '''Retourne la liste des arêtes (origine, destination) dont le poids a changé depuis cette version du graphe
+        (fermetures, réouvertures, changements de poids), ou None si le graphe a changé de forme depuis.'''
+        (version_graphe, version_compact) = self._version_compilee
+        if self._compact is None or version < version_graphe:
+            return None
+        return self._compact.modificationsDepuis(version_compact + version - version_graphe)
+
+    def grapheCompact(self):
+        '''Retourne le GrapheCSR (non modifiable) des arêtes, compilé de nouveau si le graphe a changé.
+        Une arête ajoutée plusieurs fois garde sa première position et son dernier poids. Le GrapheCSR partage
+        les noms du graphe: il ne doit plus être utilisé après une modification du graphe.'''
+        if self._compact is None:
+            n = len(self._noms)
+            positions = {}      # {origine * n + destination: position de l'arête dans les tableaux compactés}
+            origines, destinations = array('i'), array('i')
+            poids_aretes = array('q') if isinstance(self._poids, array) else []
+            for (i, j, poids) in zip(self._origines, self._destinations, self._poids):
+                if not self._oriente and j * n + i in positions:
+                    (i, j) = (j, i)     # Dans un graphe non orienté, (j, i) est la même arête que (i, j)
+                cle = i * n + j
+                if cle in positions:
+                    poids_aretes[positions[cle]] = poids
+                else:
+                    positions[cle] = len(origines)
+                    origines.append(i)
+                    destinations.append(j)
+                    poids_aretes.append(poids)
+            # Les arêtes répétées sont retirées une fois pour toutes
+            (self._origines, self._destinations, self._poids) = (origines, destinations, poids_aretes)
+            self._compact = compiler_csr(self._noms, list(zip(origines, destinations, poids_aretes)),
+                                         self._oriente, self._indices)
+            for (i, j) in self._aretes_fermees:
+                self._compact.fermeArete(self._noms[i], self._noms[j])
+            for i in self._sommets_fermes:
+                self._compact.fermeSommet(self._noms[i])
+            self._version_compilee = (self._version, self._compact.version())
+        return self._compact
+
+    def listeAretes(self, noms=False):
+        '''Liste toutes les arêtes (origine, destination, poids), avec les noms ou les Sommet'''
+        aretes = self.grapheCompact().listeAretes(noms)
+        if noms:
+            return aretes
+        return [(Sommet(self, origine), Sommet(self, dest), poids) for (origine, dest, poids) in aretes]
+
+    def aretesSortantes(self, s):
+        '''Retourne les paires (voisin, poids) des arêtes qui partent du sommet s'''
+        return self.grapheCompact().aretesSortantes(s)
+
+    def aretesEntrantes(self, s):
+        '''Retourne les paires (prédécesseur, poids) des arêtes qui arrivent au sommet s'''
+        return self.grapheCompact().aretesEntrantes(s)
+
+    def poids(self, s, v):
+        '''Retourne le poids de l'arête qui va du sommet s au sommet v (infini si elle est fermée), ou None s'il n'y en a pas'''
+        return self.grapheCompact().poids(s, v)
+
+    def nomSommet(self, s):
+        '''Retourne le nom du sommet s'''
+        return self._noms[s]
+
+    def __str__(self):
+        '''Représente le graphe comme une chaîne'''
+        return ', '.join(a + ' / ' + b + ':' + str(c) for (a, b, c) in self.listeAretes(True))
+
+# Un graphe compact (format CSR: compressed sparse row) ne peut pas changer de forme.
+# Chaque station est un entier de 0 à n-1; les voisins de la station i sont
+# cibles[debuts[i]:debuts[i+1]], avec les poids correspondants dans poids[...].
+# Il offre les mêmes méthodes de parcours que Graphe, donc fonctionne avec dijkstra, astar, etc.
+
+# Seuls les poids peuvent changer: une arête fermée (ou qui touche une station fermée)
+# prend un poids infini, donc aucune recherche ne l'emprunte, et son vrai poids est mis
+# de côté jusqu'à sa réouverture. Les tableaux ne sont jamais modifiés (ils peuvent être
+# projetés en mémoire ou partagés entre copies): les poids changés sont gardés à part,
+# par position, et ne coûtent rien aux stations dont aucune arête n'a changé. Chaque changement est noté dans un journal pour que les
+# arbres des plus courts chemins puissent être réparés au lieu d'être recalculés.
+LIMITE_JOURNAL = 100000     # Nombre maximal de changements gardés dans le journal d'un graphe
+class GrapheCSR:
+    def __init__(self, noms, debuts, cibles, poids, oriente=False, tampon=None, indices=None):
+        '''Crée un graphe compact à partir de la liste des noms et des trois tableaux d'adjacence.
+        Le dictionnaire {nom: numéro} est construit à partir des noms s'il n'est pas fourni.'''
+        self._noms = noms
+        self._indices = indices if indices is not None else {nom: i for (i, nom) in enumerate(noms)}
+        self._debuts = debuts
+        self._cibles = cibles
+        self._poids = poids                 # Poids d'origine, jamais modifiés: voir _poids_changes
+        self._oriente = oriente
+        self._tampon = tampon       # Projection mémoire (mmap) du fichier instantané, gardée ouverte tant que le graphe existe
+        self._empreinte = None      # sha256 du fichier source, si le graphe vient d'un fichier (voir charger_graphe)
+        self._inverse = None        # Graphe des arêtes entrantes, construit au besoin pour un graphe orienté
+        self._aretes_fermees = set()        # {(origine, destination)}
+        self._sommets_fermes = set()
+        self._poids_caches = {}             # {position d'une arête fermée: son vrai poids}
+        self._poids_changes = {}            # {position: poids actuel}, pour les arêtes dont le poids diffère de l'origine
+        self._origines_changees = {}        # {station: nombre de ses arêtes sortantes dans _poids_changes}
+        self._version = 0
+        self._journal = []                  # [(version, origine, destination)] des arêtes dont le poids a changé
+        self._version_oubliee = 0           # Le journal ne remonte pas avant cette version
+
+    def copie(self):
+        '''Retourne un nouveau graphe, sans fermetures, qui partage les noms et les tableaux d'adjacence de celui-ci.
+        Ses fermetures et changements de poids ne touchent que lui.'''
+        G = GrapheCSR(self._noms, self._debuts, self._cibles, self._poids, self._oriente, self._tampon, self._indices)
+        G._empreinte = self._empreinte
+        return G
+
+    def empreinte(self):
+        '''Retourne le sha256 du fichier source du graphe, ou None s'il n'a pas été chargé d'un fichier'''
+        return self._empreinte
+
+    def estIntact(self):
+        '''Vrai si chaque arête a son poids d'origine: aucune fermeture en cours, aucun poids changé (une arête fermée
+        puis rouverte compte comme intacte). Les poids changés sont gardés à part, donc il suffit qu'il n'y en ait aucun.'''
+        return not self._poids_changes
+
+    def estOriente(self):
+        return self._oriente
+
+    def version(self):
+        '''Retourne le numéro de version du graphe, qui change à chaque fermeture ou changement de poids'''
+        return self._version
+
+    def taille(self):
+        '''Retourne le nombre de stations'''
+        return len(self._noms)
+
+    def grapheCompact(self):
+        '''Un graphe compact est déjà compilé'''
+        return self
+
+    def sommet(self, nom):
+        '''Retourne le numéro de la station de ce nom'''
+        return self._indices.get(nom)
+
+    def listeSommets(self, noms=False):
+        '''Liste toutes les stations (leurs noms, ou leurs numéros)'''
+        if noms:
+            return list(self._noms)
+        return list(range(len(self._noms)))
 
     def listeAretes(self, noms=False):
-        '''Liste toutes les arêtes'''
+        '''Liste toutes les arêtes ouvertes'''
         aretes = []
-        for origine in self.listeSommets():
-            for dest in origine.listeVoisins():
-                if not self.estOriente() and str(origine) > str(dest):
+        for origine in range(len(self._noms)):
+            for dest, poids in self.aretesSortantes(origine):
+                if not self._oriente and self._noms[origine] > self._noms[dest]:
                     continue  # compter chaque arête une seule fois si non oriente
+                if poids == math.inf:
+                    continue  # arête fermée
                 if noms:
-                    aretes.append((str(origine), str(dest), origine.poids(dest)))
+                    aretes.append((self._noms[origine], self._noms[dest], poids))
                 else:
-                    aretes.append((origine, dest, origine.poids(dest)))
+                    aretes.append((origine, dest, poids))
+        return aretes
+
+    def aretesSortantes(self, s):
+        '''Retourne les paires (voisin, poids) des arêtes qui partent de la station s'''
+        debut, fin = self._debuts[s], self._debuts[s+1]
+        return zip(self._cibles[debut:fin], self._poids[debut:fin])
+
+    def _aretesSortantesChangees(self, s):
+        '''Remplace aretesSortantes tant qu'un poids diffère de celui d'origine (voir _changePosition): les poids
+        changés des arêtes de la station s sont pris dans _poids_changes'''
+        debut, fin = self._debuts[s], self._debuts[s+1]
+        if s not in self._origines_changees:
+            return zip(self._cibles[debut:fin], self._poids[debut:fin])
+        changes = self._poids_changes
+        return zip(self._cibles[debut:fin], [changes.get(k, self._poids[k]) for k in range(debut, fin)])
+
+    def aretesEntrantes(self, s):
+        '''Retourne les paires (prédécesseur, poids) des arêtes qui arrivent à la station s'''
+        if not self._oriente:
+            return self.aretesSortantes(s)
+        if self._inverse is None:
+            aretes = [(dest, origine, poids) for origine in range(len(self._noms))
+                      for (dest, poids) in self.aretesSortantes(origine)]
+            self._inverse = compiler_csr(self._noms, aretes, True, self._indices)
+        return self._inverse.aretesSortantes(s)
+
+    def poids(self, s, v):
+        '''Retourne le poids de l'arête qui va de la station s à la station v (infini si elle est fermée), ou None'''
+        for voisin, poids in self.aretesSortantes(s):
+            if voisin == v:
+                return poids
+        return None
+
+    def nomSommet(self, s):
+        '''Retourne le nom de la station s'''
+        return self._noms[s]
+
+    def _numero(self, nom):
+        '''Retourne le numéro de la station de ce nom, ou lance LookupError si elle n'existe pas'''
+        s = self._indices.get(nom)
+        if s is None:
+            raise LookupError('Station inconnue: ' + str(nom))
+        return s
+
+    def _positions(self, s, v):
+        '''Retourne les positions (dans les tableaux cibles et poids) des arêtes qui vont de s à v'''
+        return [k for k in range(self._debuts[s], self._debuts[s+1]) if self._cibles[k] == v]
+
+    def _arete(self, origine, destination):
+        '''Retourne les numéros (s, v) des stations d'une arête existante, ou lance LookupError'''
+        (s, v) = (self._numero(origine), self._numero(destination))
+        if not self._positions(s, v):
+            raise LookupError('Arête inconnue: %s / %s' % (origine, destination))
+        return (s, v)
+
+    def _cle(self, s, v):
+        '''Retourne la clé de l'arête (s, v): dans un graphe non orienté, (s, v) et (v, s) sont la même arête'''
+        return (s, v) if self._oriente or s <= v else (v, s)
+
+    def _poidsActuel(self, k):
+        '''Retourne le poids actuel de l'arête à la position k'''
+        return self._poids_changes.get(k, self._poids[k])
+
+    def _changePosition(self, s, k, poids):
+        '''Donne ce poids à l'arête de la station s à la position k, sans toucher aux tableaux: un instantané projeté
+        en mémoire est en lecture seule, et les poids d'origine sont partagés avec les autres copies (voir copie)'''
+        if poids == self._poids[k]:
+            if self._poids_changes.pop(k, None) is not None:
+                self._origines_changees[s] -= 1
+                if not self._origines_changees[s]:
+                    del self._origines_changees[s]
+                if not self._poids_changes:
+                    del self.aretesSortantes        # Retour à la méthode rapide, qui lit seulement les tableaux
+        else:
+            if not self._poids_changes:
+                self.aretesSortantes = self._aretesSortantesChangees
+            if k not in self._poids_changes:
+                self._origines_changees[s] = self._origines_changees.get(s, 0) + 1
+            self._poids_changes[k] = poids
+
+    def _fixePoids(self, s, v, poids):
+        '''Donne ce poids aux arêtes de s vers v'''
+        for k in self._positions(s, v):
+            self._changePosition(s, k, poids)
+
+    def _actualise(self, s, v, poids=None):
+        '''Recalcule le poids des arêtes entre s et v (dans les deux sens si le graphe n'est pas orienté), selon les
+        fermetures et le nouveau poids s'il est donné, et note le changement au journal'''
+        fermee = s in self._sommets_fermes or v in self._sommets_fermes or self._cle(s, v) in self._aretes_fermees
+        for (a, b) in ([(s, v)] if self._oriente or s == v else [(s, v), (v, s)]):
+            for k in self._positions(a, b):
+                vrai_poids = self._poids_caches.pop(k, self._poidsActuel(k))
+                if poids is not None:
+                    vrai_poids = poids
+                if fermee:
+                    self._poids_caches[k] = vrai_poids
+                self._changePosition(a, k, math.inf if fermee else vrai_poids)
+                if self._inverse is not None:
+                    self._inverse._fixePoids(b, a, self._poidsActuel(k))
+            self._journal.append((self._version, a, b))
+        if len(self._journal) > LIMITE_JOURNAL:     # Oublie la plus vieille moitié du journal
+            moitie = len(self._journal) // 2
+            self._version_oubliee = self._journal[moitie - 1][0]
+            del self._journal[:moitie]
+
+    def fermeArete(self, origine, destination):
+        '''Ferme l'arête entre les deux stations (par exemple un segment en travaux): plus aucun trajet ne l'emprunte'''
+        (s, v) = self._arete(origine, destination)
+        self._version += 1
+        self._aretes_fermees.add(self._cle(s, v))
+        self._actualise(s, v)
+
+    def ouvreArete(self, origine, destination):
+        '''Rouvre une arête fermée par fermeArete'''
+        (s, v) = self._arete(origine, destination)
+        self._version += 1
+        self._aretes_fermees.discard(self._cle(s, v))
+        self._actualise(s, v)
+
+    def _aretesDuSommet(self, s):
+        '''Retourne les arêtes (origine, destination) qui touchent la station s'''
+        aretes = [(s, v) for (v, _) in self.aretesSortantes(s)]
+        if self._oriente:
+            aretes += [(u, s) for (u, _) in self.aretesEntrantes(s) if u != s]
         return aretes
 
+    def fermeSommet(self, nom):
+        '''Ferme la station: plus aucun trajet ne passe par elle, ni n'en part, ni n'y arrive'''
+        s = self._numero(nom)
+        self._version += 1
+        self._sommets_fermes.add(s)
+        for (a, b) in self._aretesDuSommet(s):
+            self._actualise(a, b)
+
+    def ouvreSommet(self, nom):
+        '''Rouvre une station fermée par fermeSommet'''
+        s = self._numero(nom)
+        self._version += 1
+        self._sommets_fermes.discard(s)
+        for (a, b) in self._aretesDuSommet(s):
+            self._actualise(a, b)
+
+    def changePoids(self, origine, destination, poids):
+        '''Change le poids d'une arête existante (si elle est fermée, le nouveau poids servira à sa réouverture)'''
+        (s, v) = self._arete(origine, destination)
+        self._version += 1
+        self._actualise(s, v, poids)
+
+    def fermetures(self):
+        '''Retourne la liste des arêtes fermées (paires de noms) et la liste des stations fermées'''
+        return ([(self._noms[s], self._noms[v]) for (s, v) in sorted(self._aretes_fermees)],
+                [self._noms[s] for s in sorted(self._sommets_fermes)])
+
+    def modificationsDepuis(self, version):
+        '''Retourne la liste des arêtes (origine, destination) dont le poids a changé depuis cette version,
+        ou None si le journal ne remonte pas aussi loin'''
+        if version < self._version_oubliee:
+            return None
+        modifications = []
+        for (version_changement, s, v) in reversed(self._journal):
+            if version_changement <= version:
+                break
+            modifications.append((s, v))
+        return modifications
+
     def __str__(self):
         '''Représente le graphe comme une chaîne'''
         return ', '.join(a + ' / ' + b + ':' + str(c) for (a, b, c) in self.listeAretes(True))
 
 
+'''INSTRUMENTATION (OPTIONNELLE)'''
+# Lorsqu'elle est activée, chaque étape du routage (chargement du graphe, station la plus proche, recherche,
+# dessin) est chronométrée et les compteurs des recherches sont gardés dans un objet mesures.Mesures.
+instrumentation = None
+_SANS_MESURE = contextlib.nullcontext()     # Gestionnaire de contexte qui ne fait rien, utilisé quand rien n'est mesuré
+
+def activer_instrumentation(m=None):
+    '''Active l'instrumentation (avec un nouvel objet Mesures si aucun n'est donné) et retourne l'objet Mesures'''
+    global instrumentation
+    instrumentation = m if m is not None else mesures.Mesures()
+    return instrumentation
+
+def desactiver_instrumentation():
+    '''Désactive l'instrumentation'''
+    global instrumentation
+    instrumentation = None
+
+def etape(nom):
+    '''Retourne le gestionnaire de contexte qui chronomètre l'étape de ce nom, ou un gestionnaire qui ne fait rien
+    si l'instrumentation est désactivée:  with etape('recherche'): ...'''
+    if instrumentation is None:
+        return _SANS_MESURE
+    return instrumentation.etape(nom)
+
+
 '''ÉTAPE 1: ALGORITHME POUR TROUVER LA STATION LA PLUS PROCHE DES COORDONNÉES DONNÉES'''
 def depart_metro(dico, coord): # distance euclidienne
     '''Prend en argument un dictionnaire {station: coordonnées} ainsi que les coordonnées de départ de l'utilisateur,
@@ -147,102 +532,1242 @@ def depart_metro(dico, coord): # distance euclidienne
     i = distance.index(min(distance))     # Trouve l'index de la distance la plus petite dans la liste
     return noms_stations[i]        # Retourne le nom de la station associé à l'index trouvé précédemment
 
+# Un index spatial découpe la carte en une grille de cellules carrées (environ une station par cellule).
+# Une recherche n'examine que les cellules autour du point, en anneaux de plus en plus grands,
+# et s'arrête dès qu'aucune cellule non visitée ne peut contenir une station plus proche.
+class IndexSpatial:
+    def __init__(self, dico):
+        '''Construit l'index à partir d'un dictionnaire {station: coordonnées}'''
+        if not dico:
+            raise ValueError("Impossible d'indexer un dictionnaire de stations vide")
+        self._noms = list(dico.keys())
+        self._xs = [float(x) for (x, y) in dico.values()]
+        self._ys = [float(y) for (x, y) in dico.values()]
+        self._x_min, self._y_min = min(self._xs), min(self._ys)
+        largeur = max(self._xs) - self._x_min
+        hauteur = max(self._ys) - self._y_min
+        self._cote = math.sqrt(largeur * hauteur / len(self._noms)) or max(largeur, hauteur) or 1.0   # côté d'une cellule
+        self._nx = int(largeur / self._cote) + 1
+        self._ny = int(hauteur / self._cote) + 1
+        self._cellules = {}      # {(colonne, rangée): [numéros des stations de la cellule]}
+        for i in range(len(self._noms)):
+            self._cellules.setdefault(self._cellule(self._xs[i], self._ys[i]), []).append(i)
+        self._tableau = None     # Coordonnées des stations en tableau NumPy, construit à la première requête en lot
+
+    def _cellule(self, x, y):
+        '''Retourne la (colonne, rangée) de la cellule qui contient le point (x, y)'''
+        return (math.floor((x - self._x_min) / self._cote), math.floor((y - self._y_min) / self._cote))
+
+    def _anneau(self, cx, cy, r):
+        '''Génère les numéros des stations des cellules situées à exactement r cellules de (cx, cy)'''
+        if r == 0:
+            yield from self._cellules.get((cx, cy), ())
+            return
+        for colonne in range(max(cx - r, 0), min(cx + r, self._nx - 1) + 1):
+            for rangee in (cy - r, cy + r):
+                yield from self._cellules.get((colonne, rangee), ())
+        for rangee in range(max(cy - r + 1, 0), min(cy + r - 1, self._ny - 1) + 1):
+            for colonne in (cx - r, cx + r):
+                yield from self._cellules.get((colonne, rangee), ())
+
+    def k_plus_proches(self, coord, k=1):
+        '''Retourne la liste des k stations les plus proches des coordonnées, sous forme de paires (station, distance),
+        de la plus proche à la plus éloignée. À distance égale, la station ajoutée en premier à l'index l'emporte.
+        Retourne une liste vide si k <= 0.'''
+        (x, y) = coord
+        k = min(k, len(self._noms))
+        if k <= 0:
+            return []
+        (cx, cy) = self._cellule(x, y)
+        r_min = max(0, -cx, cx - (self._nx - 1), -cy, cy - (self._ny - 1))    # En deçà, les anneaux sont hors de la grille
+        r_max = max(cx, self._nx - 1 - cx, cy, self._ny - 1 - cy)             # Au-delà, aussi
+        candidats = []      # (distance au carré, numéro de la station)
+        meilleurs = []
+        for r in range(r_min, r_max + 1):
+            for i in self._anneau(cx, cy, r):
+                candidats.append(((self._xs[i] - x)**2 + (self._ys[i] - y)**2, i))
+            if len(candidats) >= k:
+                meilleurs = heapq.nsmallest(k, candidats)
+                # Toute station d'une cellule non visitée est à plus de r cellules du point
+                if math.sqrt(meilleurs[-1][0]) <= r * self._cote:
+                    break
+        return [(self._noms[i], math.sqrt(d2)) for (d2, i) in meilleurs]
+
+    def plus_proche(self, coord):
+        '''Retourne le nom de la station la plus proche des coordonnées (même résultat que depart_metro)'''
+        return self.k_plus_proches(coord, 1)[0][0]
+
+    def _distances_lot(self, coords, taille_bloc):
+        '''Génère, pour chaque bloc de points, le numéro du premier point du bloc et la matrice NumPy
+        des distances au carré entre les points du bloc et toutes les stations'''
+        if self._tableau is None:
+            self._tableau = np.array([self._xs, self._ys])
+        points = np.asarray(coords, dtype=float).reshape(-1, 2)
+        for debut in range(0, len(points), taille_bloc):
+            bloc = points[debut:debut + taille_bloc]
+            yield debut, (bloc[:, 0:1] - self._tableau[0])**2 + (bloc[:, 1:2] - self._tableau[1])**2
+
+    def plus_proches_lot(self, coords, taille_bloc=None):
+        '''Prend en argument une liste (ou un tableau NumPy n x 2) de coordonnées, et retourne la liste des noms des
+        stations les plus proches de chacune. Avec NumPy, toutes les distances d'un bloc de points sont calculées
+        en une seule opération vectorisée; sans NumPy, chaque point est cherché dans la grille.'''
+        if np is None:
+            return [self.plus_proche(coord) for coord in coords]
+        if taille_bloc is None:
+            taille_bloc = max(1, 2**22 // len(self._noms))   # Limite chaque matrice de distances à environ 4 millions de valeurs
+        resultat = []
+        for _, distances in self._distances_lot(coords, taille_bloc):
+            resultat.extend(self._noms[i] for i in distances.argmin(axis=1).tolist())   # argmin garde la première station en cas d'égalité
+        return resultat
+
+    def k_plus_proches_lot(self, coords, k, taille_bloc=None):
+        '''Comme k_plus_proches, mais pour toute une liste de coordonnées à la fois. Retourne une liste de listes
+        de paires (station, distance), avec le même ordre qu'elle à distance égale.'''
+        if np is None:
+            return [self.k_plus_proches(coord, k) for coord in coords]
+        k = min(k, len(self._noms))
+        if k <= 0:
+            return [[] for _ in coords]
+        if taille_bloc is None:
+            taille_bloc = max(1, 2**22 // len(self._noms))
+        resultat = []
+        for _, distances in self._distances_lot(coords, taille_bloc):
+            seuils = np.partition(distances, k - 1, axis=1)[:, k - 1:k]     # k-ième plus petite distance de chaque point
+            # Les candidats (au moins k par point, plus en cas d'égalité au seuil) sortent par point, puis par numéro
+            (rangees, candidats) = np.nonzero(distances <= seuils)
+            bornes = np.cumsum(np.bincount(rangees, minlength=len(distances)))[:-1]
+            for (rangee, indices) in enumerate(np.split(candidats, bornes)):
+                d2 = distances[rangee, indices]
+                ordre = np.argsort(d2, kind='stable')[:k]      # Stable: à distance égale, le plus petit numéro d'abord
+                resultat.append([(self._noms[i], d) for (i, d) in zip(indices[ordre].tolist(), np.sqrt(d2[ordre]).tolist())])
+        return resultat
+
 
 '''ÉTAPE 2: ALGORITHME POUR TROUVER LE TRAJET DE METRO LE PLUS COURT'''
 def lire_fichier_graphe(nom_fichier):
     '''Fabrique un graphe non orienté à partir du fichier. Retourne le graphe.'''
+    return lire_reseau(nom_fichier)[0]
+
+# Un fichier de réseau compilé (par exemple par gtfs.py) est un fichier de graphe qui commence par les coordonnées
+# de ses stations, une par ligne 'STATION NOM X Y', suivies des arêtes 'DEPART ARRIVEE LONGUEUR' habituelles.
+def lire_reseau(nom_fichier):
+    '''Lit en une seule passe un fichier de graphe ou de réseau compilé. Retourne (graphe non orienté, dictionnaire
+    {station: coordonnées}), ce dernier vide s'il n'y a aucune ligne STATION (comme dans caps_metro.txt).'''
     G = Graphe(oriente= False)
+    stations = {}
     with open(nom_fichier, 'r', encoding='utf-8') as fp:
         for ligne in fp:
             if ligne == '' or ligne[0] == '#' or ligne == '\n':   # Saute la ligne si c'est un commentaire ou une ligne vide
                 continue
-            (depart, arrivee, poids) = ligne.strip().split()      # Crée une arête
+            morceaux = ligne.split()
+            if len(morceaux) == 4 and morceaux[0] == 'STATION':    # Coordonnées d'une station (elle peut n'avoir aucune arête)
+                stations[morceaux[1]] = (int(morceaux[2]), int(morceaux[3]))
+                G.ajouteSommet(morceaux[1])
+                continue
+            (depart, arrivee, poids) = morceaux      # Crée une arête
             G.ajouteArete(depart, arrivee, int(poids))
-    return G
-
-def dijkstra(G, depart, destination):
-    '''Trouve le chemin le plus court entre le point de départ et d'arrivée,
-    et retourne la distance entre le point de départ et d'arrivée ainsi que
-    chaque sommet parcouru pour se rendre du point de départ au point d'arrivée.'''
-    if depart == destination:   # Si la station d'arrivée est la même que la station de départ, le nom de la station est retourné
-        return [str(depart)]
-
-    stations = set(G.listeSommets())
-    precedent = {station: None for station in stations}   # Dictionnaire {station: station précédente pour le trajet le plus court à emprunter}
-    dist = {station: math.inf for station in stations}    # Commence avec toutes les stations à une distance infinie du point de départ
-    dist[depart] = 0
-
-    while len(stations) > 0:
-        distance_min = math.inf
-        for station in stations:
-            distance = dist[station]
-            if distance < distance_min:
-                (station_actuelle, distance_min) = (station, dist[station])
-        stations.remove(station_actuelle)
-
-        for voisin in station_actuelle.listeVoisins():
-            if voisin in stations:
-                nouvelle_distance = dist[station_actuelle] + station_actuelle.poids(voisin)  # Vérifie si la nouvelle distance est plus efficace
-                if nouvelle_distance < dist[voisin]:
-                    dist[voisin] = nouvelle_distance
-                    precedent[voisin] = station_actuelle    # On change la valeur du dictionnaire : pour se rendre à la station 'voisin', le plus rapide moyen serait à partir de la station 'station_actuelle'
-
-                    if voisin == destination:        # Si la prochaine station est le point d'arrivée, le chemin le plus court a été trouvé
-                        chemin = [str(destination)]
-                        while precedent[destination] is not None:        # Retrace l'entièreté du chemin à l'envers à l'aide du dictionnaire 'precedent'
-                            destination = precedent[destination]
-                            chemin.append(str(destination))               # Ajoute à la liste 'chemin' une version lisible des stations parcourues
-                        chemin.reverse()
-                        return chemin    # Retourne la liste de toutes les stations du trajet le plus court.
-
-
-'''ÉTAPE 3: DEMANDER LE INPUT DE L'UTILISATEUR'''
-# Le point de départ est choisit en cliquant sur l'interface graphique!
-destination = input("Entrez le nom de la station de métro pour votre destination (Si il y a des espaces, utilisez plutôt des '-'): ").upper()
+    return G, stations
 
+def lire_stations_reseau(nom_fichier):
+    '''Retourne le dictionnaire {station: coordonnées} des lignes STATION d'un fichier de réseau compilé, sans lire
+    les arêtes (le graphe vient de l'instantané): la lecture s'arrête à la première arête.'''
+    stations = {}
+    with open(nom_fichier, 'r', encoding='utf-8') as fp:
+        for ligne in fp:
+            if ligne == '' or ligne[0] == '#' or ligne == '\n':
+                continue
+            morceaux = ligne.split()
+            if len(morceaux) != 4 or morceaux[0] != 'STATION':
+                break
+            stations[morceaux[1]] = (int(morceaux[2]), int(morceaux[3]))
+    return stations
+
+def ecrire_reseau(nom_fichier, stations, aretes, commentaire=None):
+    '''Écrit un fichier de réseau compilé: les coordonnées {station: (x, y)} puis les arêtes (depart, arrivee, longueur).
+    Les noms ne doivent pas contenir d'espaces. Le fichier est remplacé d'un coup, comme un instantané.'''
+    temporaire = nom_fichier + '.tmp'
+    with open(temporaire, 'w', encoding='utf-8') as fp:
+        if commentaire:
+            fp.write(''.join('# %s\n' % ligne for ligne in commentaire.splitlines()))
+        fp.write('# FORMAT: STATION NOM X Y, puis (DEPART, ARRIVEE, LONGUEUR)\n')
+        for (nom, (x, y)) in stations.items():
+            fp.write('STATION %s %d %d\n' % (nom, x, y))
+        for (depart, arrivee, longueur) in aretes:
+            fp.write('%s %s %d\n' % (depart, arrivee, longueur))
+    os.replace(temporaire, nom_fichier)
+
+def compiler_csr(noms, aretes, oriente=False, indices=None):
+    '''Prend en argument la liste des noms des stations et une liste d'arêtes (numéro de départ, numéro d'arrivée, poids),
+    et retourne le GrapheCSR correspondant. Dans un graphe non orienté, chaque arête est ajoutée dans les deux sens.
+    Les poids sont gardés dans un tableau d'entiers, ou dans une liste si l'un d'eux n'est pas entier.'''
+    n = len(noms)
+    degres = array('q', bytes(8 * (n + 1)))
+    for (origine, dest, poids) in aretes:
+        degres[origine + 1] += 1
+        if not oriente and origine != dest:
+            degres[dest + 1] += 1
+    for i in range(n):                      # Somme cumulative: debuts[i] est la position de la première arête de i
+        degres[i + 1] += degres[i]
+    debuts = degres
+    position = array('q', debuts[:n])
+    cibles = array('q', bytes(8 * debuts[n]))
+    if all(isinstance(poids, int) for (_, _, poids) in aretes):
+        poids_aretes = array('q', bytes(8 * debuts[n]))
+    else:
+        poids_aretes = [0] * debuts[n]
+    for (origine, dest, poids) in aretes:
+        cibles[position[origine]] = dest
+        poids_aretes[position[origine]] = poids
+        position[origine] += 1
+        if not oriente and origine != dest:
+            cibles[position[dest]] = origine
+            poids_aretes[position[dest]] = poids
+            position[dest] += 1
+    return GrapheCSR(noms, debuts, cibles, poids_aretes, oriente, indices=indices)
+
+def compiler_fichier_graphe(nom_fichier):
+    '''Lit le fichier du graphe et retourne le GrapheCSR non orienté correspondant'''
+    return lire_fichier_graphe(nom_fichier).grapheCompact()
+
+# Format de l'instantané binaire: en-tête, noms des stations (utf-8, un par ligne), puis les tableaux debuts, cibles et poids
+SIGNATURE_INSTANTANE = b'CSRMETRO'
+FORMAT_ENTETE = '<8sIIqqqq32s'      # signature, version du format, orienté, n, m, mtime_ns et taille de la source, sha256 de la source
+VERSION_INSTANTANE = 1
+
+def _empreinte(nom_fichier):
+    '''Retourne le sha256 du contenu du fichier'''
+    with open(nom_fichier, 'rb') as fp:
+        return hashlib.sha256(fp.read()).digest()
+
+def ecrire_instantane(G, nom_instantane, source):
+    '''Enregistre le GrapheCSR dans un fichier binaire, avec la date de modification, la taille et
+    l'empreinte du fichier source pour savoir plus tard si l'instantané est encore valide.'''
+    infos = os.stat(source)
+    noms = '\n'.join(G._noms).encode('utf-8')
+    noms += b'\0' * (-len(noms) % 8)      # Aligne les tableaux sur 8 octets
+    entete = struct.pack(FORMAT_ENTETE, SIGNATURE_INSTANTANE, VERSION_INSTANTANE, G.estOriente(), G.taille(),
+                         len(G._cibles), infos.st_mtime_ns, infos.st_size, _empreinte(source))
+    temporaire = nom_instantane + '.tmp'
+    with open(temporaire, 'wb') as fp:
+        fp.write(entete)
+        fp.write(struct.pack('<q', len(noms)))
+        fp.write(noms)
+        for tableau in (G._debuts, G._cibles, G._poids):
+            fp.write(array('q', tableau).tobytes())
+    os.replace(temporaire, nom_instantane)    # Remplacement atomique: un lecteur ne voit jamais un fichier à moitié écrit
+
+def lire_instantane(nom_instantane, source):
+    '''Projette en mémoire (mmap) l'instantané binaire et retourne le GrapheCSR, ou None si l'instantané
+    est absent, corrompu ou périmé. Il est périmé si la date de modification ou la taille du fichier source ont
+    changé, à moins que le contenu de la source (vérifié par son empreinte) soit resté le même: l'en-tête reçoit
+    alors la nouvelle date de modification, pour que les démarrages suivants n'aient pas à recalculer l'empreinte.'''
+    try:
+        with open(nom_instantane, 'rb') as fp:
+            tampon = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    taille_entete = struct.calcsize(FORMAT_ENTETE)
+    vue = None
+    try:
+        (signature, version, oriente, n, m, mtime_ns, taille, empreinte) = struct.unpack_from(FORMAT_ENTETE, tampon)
+        infos = os.stat(source)
+        if signature != SIGNATURE_INSTANTANE or version != VERSION_INSTANTANE:
+            raise ValueError('Instantané invalide')
+        if (mtime_ns, taille) != (infos.st_mtime_ns, infos.st_size):
+            if empreinte != _empreinte(source):
+                raise ValueError('Instantané périmé')
+            _dater_instantane(nom_instantane, tampon, infos)
+        (longueur_noms,) = struct.unpack_from('<q', tampon, taille_entete)
+        debut = taille_entete + 8
+        if not 0 <= longueur_noms <= len(tampon) - debut or (len(tampon) - debut - longueur_noms) % 8:
+            raise ValueError('Instantané tronqué')      # Les tableaux ne tombent plus sur des entiers de 8 octets
+        noms = tampon[debut:debut + longueur_noms].rstrip(b'\0').decode('utf-8')
+        noms = noms.split('\n') if n else []
+        vue = memoryview(tampon)[debut + longueur_noms:].cast('q')
+        if len(noms) != n or len(vue) != (n + 1) + 2 * m:
+            raise ValueError('Instantané tronqué')
+    except (struct.error, ValueError, TypeError, OSError, UnicodeDecodeError):
+        if vue is not None:
+            vue.release()       # Le mmap ne peut pas être fermé tant qu'une vue l'utilise
+        tampon.close()
+        return None
+    G = GrapheCSR(noms, vue[:n + 1], vue[n + 1:n + 1 + m], vue[n + 1 + m:], bool(oriente), tampon)
+    G._empreinte = empreinte
+    return G
 
-'''ÉTAPE 4: INITIALISATION DE TURTLE'''
-# Fonctions nécessaires pour faciliter le tracé turtle
-def read_coords(nom_fichier):
-    '''Prend en argument un fichier txt et retourne une pile contenant chaque coordonnée à suivre.'''
-    coords_pile = Pile()
+def _dater_instantane(nom_instantane, tampon, infos, format_entete=FORMAT_ENTETE):
+    '''Réécrit dans l'en-tête de l'instantané la date de modification et la taille actuelles du fichier source,
+    dont le contenu n'a pas changé (par exemple après un 'touch' ou une copie). L'en-tête finit par la date de
+    modification, la taille et l'empreinte de la source (même chose pour le fichier .ch du module contraction).'''
+    entete = bytearray(tampon[:struct.calcsize(format_entete)])
+    champs = list(struct.unpack_from(format_entete, entete))
+    champs[-3:-1] = [infos.st_mtime_ns, infos.st_size]
+    struct.pack_into(format_entete, entete, 0, *champs)
+    try:
+        with open(nom_instantane, 'r+b') as fp:
+            fp.write(entete)
+    except OSError:
+        pass    # Dossier en lecture seule: l'empreinte sera vérifiée de nouveau au prochain démarrage
+
+_graphes_charges = {}   # {chemin du fichier: (date de modification, taille, graphe)}, pour ne lire chaque fichier qu'une fois
+
+def charger_graphe(nom_fichier):
+    '''Retourne un GrapheCSR du fichier de graphe. Le graphe compilé est gardé en mémoire; au démarrage suivant,
+    il est relu directement de l'instantané binaire (nom_fichier + '.csr') enregistré à côté du fichier texte,
+    qui n'est recompilé que si le fichier texte a changé. Chaque appel reçoit sa propre copie (voir
+    GrapheCSR.copie), qui partage les tableaux mais pas les fermetures ni les changements de poids.'''
+    chemin = os.path.abspath(nom_fichier)
+    infos = os.stat(chemin)
+    if chemin in _graphes_charges:
+        (mtime_ns, taille, G) = _graphes_charges[chemin]
+        if (mtime_ns, taille) == (infos.st_mtime_ns, infos.st_size):
+            return G.copie()
+    nom_instantane = chemin + '.csr'
+    with etape('chargement_graphe'):
+        G = lire_instantane(nom_instantane, chemin)
+        if G is None:
+            G = compiler_fichier_graphe(chemin)
+            G._empreinte = _empreinte(chemin)
+            try:
+                ecrire_instantane(G, nom_instantane, chemin)
+            except OSError:
+                pass    # Dossier en lecture seule: le graphe compilé reste utilisable en mémoire
+    _graphes_charges[chemin] = (infos.st_mtime_ns, infos.st_size, G)
+    return G.copie()
+
+def reconstruire_chemin(G, precedent, destination):
+    '''Retrace le chemin à l'envers à l'aide du dictionnaire {sommet: sommet précédent}
+    et retourne la liste des noms des stations, du départ jusqu'à la destination.'''
+    chemin = []
+    sommet = destination
+    while sommet is not None:
+        chemin.append(G.nomSommet(sommet))   # Ajoute une version lisible des stations parcourues
+        sommet = precedent[sommet]
+    chemin.reverse()
+    return chemin
+
+def recherche_dijkstra(G, depart, destination, compteurs=None):
+    '''Fait la recherche de Dijkstra à l'aide d'une file de priorité (tas binaire avec suppression paresseuse),
+    et retourne le dictionnaire {station: station précédente} dès que la destination est fixée (retirée du tas),
+    ou None si la destination est inatteignable. Le chemin se retrouve ensuite avec reconstruire_chemin.
+    Si un dictionnaire 'compteurs' est fourni, il reçoit le nombre de sommets fixés ('sommets_fixes'),
+    d'arêtes relâchées ('aretes_relachees') et d'insertions dans le tas ('insertions_tas').'''
+    resultat = recherche_multi_sources(G, {depart: 0}, destination, compteurs)
+    return None if resultat is None else resultat[1]
+
+def recherche_multi_sources(G, departs, destination, compteurs=None):
+    '''Recherche de Dijkstra à partir de plusieurs stations de départ à la fois: 'departs' est le dictionnaire
+    {station: coût initial} (par exemple le coût de la marche jusqu'à la station), et toutes ces stations forment
+    la frontière initiale. Retourne (coût total, {station: station précédente}) dès que la destination est fixée,
+    ou None si elle est inatteignable. Le chemin reconstruit commence à la station de départ qui l'a emporté.'''
+    dist = dict(departs)            # Les stations absentes du dictionnaire sont à une distance infinie du point de départ
+    precedent = dict.fromkeys(departs)      # Dictionnaire {station: station précédente pour le trajet le plus court à emprunter}
+    tas = [(cout, i, station) for (i, (station, cout)) in enumerate(departs.items())]    # (distance, ordre d'insertion, station): l'ordre départage les égalités sans comparer les stations
+    heapq.heapify(tas)
+    insertions = len(tas)
+    sommets_fixes = 0
+    aretes_relachees = 0
+    trouve = False
+    aretes = G.grapheCompact().aretesSortantes     # Les parcours se font directement sur les tableaux compilés
+
+    while tas:
+        distance, _, station_actuelle = heapq.heappop(tas)
+        if distance > dist[station_actuelle]:   # Entrée périmée: la station a déjà été fixée avec une distance plus courte
+            continue
+        sommets_fixes += 1
+        if station_actuelle == destination:     # La destination est fixée, le chemin le plus court a été trouvé
+            trouve = True
+            break
+
+        for voisin, poids in aretes(station_actuelle):
+            aretes_relachees += 1
+            nouvelle_distance = distance + poids    # Vérifie si la nouvelle distance est plus efficace
+            if nouvelle_distance < dist.get(voisin, math.inf):
+                dist[voisin] = nouvelle_distance
+                precedent[voisin] = station_actuelle    # Pour se rendre à 'voisin', le plus rapide est de passer par 'station_actuelle'
+                heapq.heappush(tas, (nouvelle_distance, insertions, voisin))
+                insertions += 1
+
+    if compteurs is not None:
+        compteurs.update(sommets_fixes=sommets_fixes, aretes_relachees=aretes_relachees, insertions_tas=insertions)
+    return (dist[destination], precedent) if trouve else None
+
+def dijkstra(G, depart, destination, compteurs=None):
+    '''Trouve le chemin le plus court entre le point de départ et d'arrivée, et retourne la liste des stations
+    parcourues pour se rendre du point de départ au point d'arrivée, ou None si la destination est inatteignable.
+    La recherche (voir recherche_dijkstra) s'arrête seulement lorsque la destination est fixée, ce qui garantit
+    que le trajet retourné est optimal. 'compteurs' reçoit les compteurs de la recherche.'''
+    precedent = recherche_dijkstra(G, depart, destination, compteurs)
+    if precedent is None:
+        return None
+    return reconstruire_chemin(G, precedent, destination)    # Retourne la liste de toutes les stations du trajet le plus court
+
+def calibrer_heuristique(G, coords):
+    '''Prend en argument un graphe dont les poids sont en mètres et un dictionnaire {station: coordonnées sur la carte},
+    et retourne le plus grand facteur (mètres par unité de carte) qui ne surestime la longueur d'aucune arête.
+    Multipliée par ce facteur, la distance à vol d'oiseau sur la carte est une heuristique admissible pour A*.'''
+    facteur = math.inf
+    for (depart, arrivee, poids) in G.listeAretes(True):
+        if depart not in coords or arrivee not in coords:
+            continue
+        (a, b), (c, d) = coords[depart], coords[arrivee]
+        distance_carte = math.sqrt((c-a)**2 + (d-b)**2)
+        if distance_carte > 0:
+            facteur = min(facteur, poids / distance_carte)
+    return 0 if facteur == math.inf else facteur   # Sans arête mesurable, A* se comporte comme Dijkstra
+
+PENALITE_MARCHE = 8     # Un mètre de marche coûte autant que 8 mètres de métro (environ 5 km/h contre 40 km/h)
+
+def echelle_carte(G, coords):
+    '''Retourne l'échelle typique de la carte (mètres par unité de carte): la médiane, sur les arêtes du graphe,
+    du rapport entre la longueur de l'arête et la distance à vol d'oiseau entre ses deux stations. Contrairement au
+    facteur de calibrer_heuristique (le plus petit rapport), elle sert à estimer une vraie distance de marche.'''
+    rapports = []
+    for (depart, arrivee, poids) in G.listeAretes(True):
+        if depart in coords and arrivee in coords:
+            distance_carte = math.dist(coords[depart], coords[arrivee])
+            if distance_carte > 0:
+                rapports.append(poids / distance_carte)
+    if not rapports:
+        return 0
+    rapports.sort()
+    return rapports[len(rapports) // 2]
+
+def astar(G, depart, destination, coords, facteur=None, compteurs=None):
+    '''Trouve le chemin le plus court entre le point de départ et d'arrivée avec l'algorithme A*, guidé par la
+    distance à vol d'oiseau entre les coordonnées des stations (dictionnaire {station: coordonnées}).
+    Le 'facteur' de conversion des unités de carte en mètres est calculé par calibrer_heuristique s'il n'est pas
+    fourni; il vaut mieux le calculer une seule fois et le réutiliser d'une requête à l'autre.
+    Retourne la liste des stations parcourues (ou None), et remplit 'compteurs' comme dijkstra.'''
+    if facteur is None:
+        facteur = calibrer_heuristique(G, coords)
+    if depart == destination:
+        if compteurs is not None:
+            compteurs.update(sommets_fixes=1, aretes_relachees=0, insertions_tas=0)
+        return [G.nomSommet(depart)]
+
+    nom_destination = G.nomSommet(destination) if destination is not None else None
+    if nom_destination not in coords:
+        facteur = 0     # Sans coordonnées pour la destination, aucune estimation n'est possible
+    else:
+        (x_arrivee, y_arrivee) = coords[nom_destination]
+
+    def heuristique(station):
+        '''Estimation (jamais trop grande) de la distance restante jusqu'à la destination'''
+        position = coords.get(G.nomSommet(station)) if facteur else None
+        if position is None:
+            return 0
+        return facteur * math.sqrt((x_arrivee-position[0])**2 + (y_arrivee-position[1])**2)
+
+    dist = {depart: 0}
+    precedent = {depart: None}
+    estimation = {}                 # Mémorise l'heuristique de chaque station pour ne la calculer qu'une fois
+    tas = [(heuristique(depart), 0, 0, depart)]    # (distance + estimation, ordre d'insertion, distance, station)
+    insertions = 1
+    sommets_fixes = 0
+    aretes_relachees = 0
+    chemin = None
+    aretes = G.grapheCompact().aretesSortantes
+
+    while tas:
+        _, _, distance, station_actuelle = heapq.heappop(tas)
+        if distance > dist[station_actuelle]:   # Entrée périmée (suppression paresseuse)
+            continue
+        sommets_fixes += 1
+        if station_actuelle == destination:
+            chemin = reconstruire_chemin(G, precedent, destination)
+            break
+
+        for voisin, poids in aretes(station_actuelle):
+            aretes_relachees += 1
+            nouvelle_distance = distance + poids
+            if nouvelle_distance < dist.get(voisin, math.inf):
+                dist[voisin] = nouvelle_distance
+                precedent[voisin] = station_actuelle
+                if voisin not in estimation:
+                    estimation[voisin] = heuristique(voisin)
+                heapq.heappush(tas, (nouvelle_distance + estimation[voisin], insertions, nouvelle_distance, voisin))
+                insertions += 1
+
+    if compteurs is not None:
+        compteurs.update(sommets_fixes=sommets_fixes, aretes_relachees=aretes_relachees, insertions_tas=insertions)
+    return chemin
+
+def bidirectional_dijkstra(G, depart, destination, compteurs=None):
+    '''Trouve le chemin le plus court en faisant avancer deux recherches de Dijkstra à la fois: une à partir du
+    départ (arêtes sortantes) et une à partir de la destination (arêtes entrantes). La recherche s'arrête lorsque
+    la somme des deux fronts atteint la longueur du meilleur trajet connu passant par une station de rencontre.
+    Retourne la liste des stations parcourues (ou None), et remplit 'compteurs' comme dijkstra.'''
+    if depart == destination:
+        if compteurs is not None:
+            compteurs.update(sommets_fixes=1, aretes_relachees=0, insertions_tas=0)
+        return [G.nomSommet(depart)]
+
+    # Indice 0: recherche avant à partir du départ, indice 1: recherche arrière à partir de la destination
+    dist = ({depart: 0}, {destination: 0})
+    precedent = ({depart: None}, {destination: None})
+    tas = ([(0, 0, depart)], [(0, 0, destination)])
+    compact = G.grapheCompact()
+    aretes = (compact.aretesSortantes, compact.aretesEntrantes)
+    insertions = 2
+    sommets_fixes = 0
+    aretes_relachees = 0
+    meilleure_longueur = math.inf
+    rencontre = None
+
+    while tas[0] and tas[1]:
+        if tas[0][0][0] + tas[1][0][0] >= meilleure_longueur:   # Aucun trajet plus court ne peut encore être trouvé
+            break
+        cote = 0 if tas[0][0][0] <= tas[1][0][0] else 1          # Avance le front le moins éloigné
+        autre = 1 - cote
+        distance, _, station_actuelle = heapq.heappop(tas[cote])
+        if distance > dist[cote][station_actuelle]:
+            continue
+        sommets_fixes += 1
+
+        for voisin, poids in aretes[cote](station_actuelle):
+            aretes_relachees += 1
+            nouvelle_distance = distance + poids
+            if nouvelle_distance < dist[cote].get(voisin, math.inf):
+                dist[cote][voisin] = nouvelle_distance
+                precedent[cote][voisin] = station_actuelle
+                heapq.heappush(tas[cote], (nouvelle_distance, insertions, voisin))
+                insertions += 1
+                if voisin in dist[autre] and nouvelle_distance + dist[autre][voisin] < meilleure_longueur:
+                    meilleure_longueur = nouvelle_distance + dist[autre][voisin]
+                    rencontre = voisin
+
+    if compteurs is not None:
+        compteurs.update(sommets_fixes=sommets_fixes, aretes_relachees=aretes_relachees, insertions_tas=insertions)
+    if rencontre is None:
+        return None
+    chemin = reconstruire_chemin(G, precedent[0], rencontre)     # Du départ jusqu'à la station de rencontre
+    station = precedent[1][rencontre]
+    while station is not None:                                   # Puis de la station de rencontre jusqu'à la destination
+        chemin.append(G.nomSommet(station))
+        station = precedent[1][station]
+    return chemin
+
+# Modes de recherche offerts par trouver_trajet
+MODES_RECHERCHE = ('dijkstra', 'astar', 'bidirectionnel')
+
+def trouver_trajet(G, depart, destination, mode='dijkstra', coords=None, facteur=None, compteurs=None):
+    '''Trouve le chemin le plus court avec le mode de recherche choisi ('dijkstra', 'astar' ou 'bidirectionnel').
+    Le mode 'astar' a besoin du dictionnaire {station: coordonnées}. Les compteurs permettent de comparer
+    la taille de l'espace de recherche des différents modes.'''
+    if mode == 'dijkstra':
+        return dijkstra(G, depart, destination, compteurs)
+    if mode == 'astar':
+        if coords is None:
+            raise ValueError("Le mode 'astar' a besoin des coordonnées des stations")
+        return astar(G, depart, destination, coords, facteur, compteurs)
+    if mode == 'bidirectionnel':
+        return bidirectional_dijkstra(G, depart, destination, compteurs)
+    raise ValueError('Mode de recherche inconnu: ' + str(mode))
+
+def arbre_plus_courts_chemins(G, racine, compteurs=None):
+    '''Calcule avec Dijkstra l'arbre inverse des plus courts chemins enraciné à la station 'racine', c'est-à-dire
+    les plus courts chemins de toutes les stations VERS la racine (en suivant les arêtes entrantes).
+    Retourne deux dictionnaires: {station: distance jusqu'à la racine} et {station: station suivante vers la racine}.
+    'compteurs' reçoit les mêmes compteurs que pour dijkstra.'''
+    dist = {racine: 0}
+    suivant = {racine: None}
+    tas = [(0, 0, racine)]
+    insertions = 1
+    sommets_fixes = 0
+    aretes_relachees = 0
+    aretes = G.grapheCompact().aretesEntrantes
+    while tas:
+        distance, _, station_actuelle = heapq.heappop(tas)
+        if distance > dist[station_actuelle]:
+            continue
+        sommets_fixes += 1
+        for voisin, poids in aretes(station_actuelle):
+            aretes_relachees += 1
+            nouvelle_distance = distance + poids
+            if nouvelle_distance < dist.get(voisin, math.inf):
+                dist[voisin] = nouvelle_distance
+                suivant[voisin] = station_actuelle    # À partir de 'voisin', le plus rapide est d'aller à 'station_actuelle'
+                heapq.heappush(tas, (nouvelle_distance, insertions, voisin))
+                insertions += 1
+    if compteurs is not None:
+        compteurs.update(sommets_fixes=sommets_fixes, aretes_relachees=aretes_relachees, insertions_tas=insertions)
+    return dist, suivant
+
+def reparer_arbre(G, dist, suivant, modifications, compteurs=None):
+    '''Répare l'arbre inverse des plus courts chemins (les dictionnaires 'dist' et 'suivant' calculés par
+    arbre_plus_courts_chemins) après un changement du poids de quelques arêtes, données par la liste
+    'modifications' de paires (origine, destination). Seules les stations touchées sont recalculées:
+      1. Si une arête de l'arbre est devenue plus longue (ou fermée), toutes les stations dont le trajet l'emprunte
+         (le sous-arbre en amont de l'arête) perdent leur distance.
+      2. Ces stations repartent de leurs voisins hors du sous-arbre, et les arêtes devenues plus courtes offrent
+         de nouveaux raccourcis.
+      3. Les distances améliorées se propagent comme dans Dijkstra, seulement là où elles diminuent.
+    'compteurs' reçoit les compteurs de dijkstra et le nombre de stations invalidées ('sommets_invalides').'''
+    compact = G.grapheCompact()
+    # 1. Sous-arbres à invalider
+    pile = [origine for (origine, dest) in modifications
+            if suivant.get(origine) == dest and dest in dist and compact.poids(origine, dest) + dist[dest] > dist[origine]]
+    invalides = set()
+    while pile:
+        station = pile.pop()
+        if station in invalides:
+            continue
+        invalides.add(station)
+        for (amont, _) in compact.aretesEntrantes(station):    # Les stations dont le trajet passe ensuite par 'station'
+            if suivant.get(amont) == station and amont not in invalides:
+                pile.append(amont)
+    for station in invalides:
+        del dist[station]
+        del suivant[station]
+
+    # 2. Nouveaux points de départ de la propagation
+    tas = []
+    insertions = 0
+    aretes_relachees = 0
+    candidats = [(station, voisin, poids) for station in invalides for (voisin, poids) in compact.aretesSortantes(station)]
+    candidats += [(origine, dest, compact.poids(origine, dest)) for (origine, dest) in modifications]
+    for (station, voisin, poids) in candidats:
+        aretes_relachees += 1
+        if voisin in dist and poids + dist[voisin] < dist.get(station, math.inf):
+            dist[station] = poids + dist[voisin]
+            suivant[station] = voisin
+            heapq.heappush(tas, (dist[station], insertions, station))
+            insertions += 1
+
+    # 3. Propagation des distances améliorées
+    sommets_fixes = 0
+    while tas:
+        distance, _, station_actuelle = heapq.heappop(tas)
+        if distance > dist[station_actuelle]:
+            continue
+        sommets_fixes += 1
+        for voisin, poids in compact.aretesEntrantes(station_actuelle):
+            aretes_relachees += 1
+            nouvelle_distance = distance + poids
+            if nouvelle_distance < dist.get(voisin, math.inf):
+                dist[voisin] = nouvelle_distance
+                suivant[voisin] = station_actuelle
+                heapq.heappush(tas, (nouvelle_distance, insertions, voisin))
+                insertions += 1
+    if compteurs is not None:
+        compteurs.update(sommets_fixes=sommets_fixes, aretes_relachees=aretes_relachees, insertions_tas=insertions,
+                         sommets_invalides=len(invalides))
+
+class ArbreDestination:
+    '''Arbre inverse des plus courts chemins vers une destination fixe. Il est calculé une seule fois,
+    puis chaque trajet vers la destination se retrouve en suivant les pointeurs, en O(longueur du trajet).
+    Après une fermeture ou un changement de poids, il est réparé (voir reparer_arbre) plutôt que recalculé.'''
+    def __init__(self, G, destination, compteurs=None):
+        self._graphe = G
+        self._destination = destination
+        self._version = G.version()
+        self._dist, self._suivant = arbre_plus_courts_chemins(G, destination, compteurs)
+
+    def estAJour(self, G, destination):
+        '''Retourne True si l'arbre correspond encore à ce graphe (non modifié) et à cette destination'''
+        return self._graphe is G and self._destination == destination and self._version == G.version()
+
+    def mettreAJour(self, compteurs=None):
+        '''Répare l'arbre après les fermetures et changements de poids faits depuis son calcul. Retourne False si
+        c'est impossible (le graphe a changé de forme, ou le journal des changements ne remonte pas assez loin):
+        l'arbre doit alors être recalculé.'''
+        modifications = self._graphe.modificationsDepuis(self._version)
+        if modifications is None:
+            return False
+        reparer_arbre(self._graphe, self._dist, self._suivant, modifications, compteurs)
+        self._version = self._graphe.version()
+        return True
+
+    def distance(self, depart):
+        '''Retourne la longueur du trajet le plus court du départ jusqu'à la destination (infinie si inatteignable)'''
+        return self._dist.get(depart, math.inf)
+
+    def stationSuivante(self, station):
+        '''Retourne la station qui suit 'station' sur son trajet le plus court vers la destination (None pour la
+        destination elle-même ou une station d'où la destination est inatteignable)'''
+        return self._suivant.get(station)
+
+    def chemin(self, depart):
+        '''Retourne la liste des stations du trajet le plus court du départ jusqu'à la destination, ou None'''
+        if depart not in self._suivant:
+            return None
+        chemin = []
+        station = depart
+        while station is not None:
+            chemin.append(self._graphe.nomSommet(station))
+            station = self._suivant[station]
+        return chemin
+
+_arbre_courant = None   # Dernier arbre calculé, conservé en mémoire entre les clics
+
+def arbre_vers_destination(G, destination):
+    '''Retourne l'arbre des plus courts chemins vers la destination. L'arbre conservé en mémoire est réutilisé tant
+    que le graphe et la destination ne changent pas, et réparé après des fermetures ou des changements de poids;
+    sinon, il est recalculé automatiquement.'''
+    global _arbre_courant
+    if _arbre_courant is None or not _arbre_courant.estAJour(G, destination):
+        m = instrumentation
+        compteurs = {} if m is not None else None
+        if _arbre_courant is not None and _arbre_courant._graphe is G and _arbre_courant._destination == destination:
+            with etape('reparation_arbre'):
+                repare = _arbre_courant.mettreAJour(compteurs)      # Après des fermetures: seulement les stations touchées
+            if repare:
+                if m is not None:
+                    m.compter(compteurs, 'reparation_')
+                return _arbre_courant
+        with etape('construction_arbre'):
+            _arbre_courant = ArbreDestination(G, destination, compteurs)
+        if m is not None:
+            m.compter(compteurs, 'arbre_')
+    return _arbre_courant
+
+
+def _chemin_deviation(G, arbre, depart, destination, interdits, suivants_interdits, compteurs):
+    '''Cherche le trajet le plus court du départ jusqu'à la destination sans passer par les stations 'interdits'
+    et sans emprunter, à partir du départ, les arêtes vers les stations 'suivants_interdits'. C'est A*, guidé par
+    la distance exacte de chaque station à la destination dans l'arbre (jamais trop grande, puisque les
+    interdictions ne font qu'allonger les trajets). Dès qu'une station fixée peut rejoindre la destination en
+    suivant l'arbre sans toucher d'interdit, ce trajet est le plus court et la recherche s'arrête.
+    Retourne (longueur, liste des stations) ou None.'''
+    libre = {depart: False}     # {station: True si le trajet de l'arbre à partir d'elle évite les interdits}
+                                # (repasser par le départ ferait une boucle)
+
+    def trajet_libre(station):
+        '''Retourne True si le trajet de l'arbre de la station jusqu'à la destination évite les interdits'''
+        parcourus = []
+        while station not in libre:
+            if station in interdits or arbre.distance(station) == math.inf:
+                libre[station] = False
+                break
+            if station == destination:
+                libre[station] = True
+                break
+            parcourus.append(station)
+            station = arbre.stationSuivante(station)
+        for s in parcourus:
+            libre[s] = libre[station]
+        return libre[station]
+
+    dist = {depart: 0}
+    precedent = {depart: None}
+    tas = [(arbre.distance(depart), 0, 0, depart)]      # (distance + estimation, ordre d'insertion, distance, station)
+    insertions = 1
+    while tas:
+        _, _, distance, station_actuelle = heapq.heappop(tas)
+        if distance > dist[station_actuelle]:
+            continue
+        compteurs['sommets_fixes'] += 1
+        if station_actuelle == depart:
+            suivante = arbre.stationSuivante(depart)
+            raccourci = suivante is not None and suivante not in suivants_interdits and trajet_libre(suivante)
+        else:
+            raccourci = trajet_libre(station_actuelle)
+        if raccourci:
+            # Raccourci: la fin du trajet suit l'arbre (optimal, puisque l'estimation de cette station est exacte)
+            chemin = []
+            station = station_actuelle
+            while station is not None:
+                chemin.append(station)
+                station = precedent[station]
+            chemin.reverse()
+            station = arbre.stationSuivante(station_actuelle)
+            while station is not None:
+                chemin.append(station)
+                station = arbre.stationSuivante(station)
+            return (distance + arbre.distance(station_actuelle), chemin)
+        for voisin, poids in G.aretesSortantes(station_actuelle):
+            compteurs['aretes_relachees'] += 1
+            if voisin in interdits or (station_actuelle == depart and voisin in suivants_interdits):
+                continue
+            estimation = arbre.distance(voisin)
+            nouvelle_distance = distance + poids
+            if estimation < math.inf and nouvelle_distance < dist.get(voisin, math.inf):
+                dist[voisin] = nouvelle_distance
+                precedent[voisin] = station_actuelle
+                heapq.heappush(tas, (nouvelle_distance + estimation, insertions, nouvelle_distance, voisin))
+                insertions += 1
+    return None
+
+def k_plus_courts_chemins(G, depart, destination, k=5, compteurs=None):
+    '''Trouve les k trajets les plus courts sans boucle du départ jusqu'à la destination (algorithme de Yen),
+    et retourne la liste de paires (longueur, liste des noms des stations), du plus court au plus long.
+    Chaque nouveau trajet dévie d'un trajet déjà trouvé: il en garde le début (la racine) jusqu'à une station de
+    déviation, puis rejoint la destination sans réutiliser les stations de la racine ni les arêtes déjà
+    empruntées à partir de cette station. Pour éviter de refaire le même travail:
+      - seules les stations à partir du point de déviation du dernier trajet sont essayées (Lawler), car les
+        déviations plus tôt ont déjà été calculées pour le trajet dont il dévie;
+      - l'arbre des plus courts chemins vers la destination (gardé par arbre_vers_destination d'une requête à
+        l'autre) guide chaque recherche et donne souvent la fin du trajet sans aucune recherche.
+    'compteurs' reçoit les compteurs de dijkstra, le nombre de recherches de déviation ('deviations') et le
+    nombre de trajets candidats ('candidats').'''
+    arbre = arbre_vers_destination(G, destination)
+    compact = G.grapheCompact()
+    totaux = {'sommets_fixes': 0, 'aretes_relachees': 0, 'deviations': 0, 'candidats': 0}
+    trajets = []
+    if arbre.distance(depart) < math.inf:
+        premier = [depart]
+        while premier[-1] != destination:
+            premier.append(arbre.stationSuivante(premier[-1]))
+        trajets.append((arbre.distance(depart), premier, 0))    # (longueur, stations, indice de la déviation)
+    candidats = []      # Tas de (longueur, ordre, stations, indice de la déviation)
+    vus = {tuple(premier)} if trajets else set()
+    while trajets and len(trajets) < k:
+        (_, dernier, debut) = trajets[-1]
+        longueur_racine = 0
+        for i in range(len(dernier) - 1):
+            if i >= debut:
+                racine = dernier[:i + 1]
+                suivants_interdits = {stations[i + 1] for (_, stations, _) in trajets if stations[:i + 1] == racine}
+                totaux['deviations'] += 1
+                deviation = _chemin_deviation(compact, arbre, dernier[i], destination, set(racine[:-1]),
+                                              suivants_interdits, totaux)
+                if deviation is not None:
+                    stations = racine[:-1] + deviation[1]
+                    if tuple(stations) not in vus:
+                        vus.add(tuple(stations))
+                        heapq.heappush(candidats, (longueur_racine + deviation[0], totaux['candidats'], stations, i))
+                        totaux['candidats'] += 1
+            longueur_racine += compact.poids(dernier[i], dernier[i + 1])
+        if not candidats:
+            break
+        (longueur, _, stations, indice) = heapq.heappop(candidats)
+        trajets.append((longueur, stations, indice))
+    if compteurs is not None:
+        compteurs.update(totaux)
+    return [(longueur, [G.nomSommet(station) for station in stations]) for (longueur, stations, _) in trajets]
+
+
+'''ÉTAPE 3: DONNÉES DES STATIONS ET MOTEUR DE ROUTAGE SANS INTERFACE'''
+# Les fichiers de données sont cherchés à côté de ce fichier, peu importe le dossier d'où le programme est lancé
+REPERTOIRE = os.path.dirname(os.path.abspath(__file__))
+FICHIER_GRAPHE = os.path.join(REPERTOIRE, 'caps_metro.txt')
+COULEURS_LIGNES = ('orange', 'blue', 'green', 'yellow')     # Chaque ligne a son fichier de coordonnées, ex: 'orange.txt'
+
+def fichier_ligne(couleur):
+    '''Retourne le chemin du fichier de coordonnées de la ligne de cette couleur'''
+    return os.path.join(REPERTOIRE, couleur + '.txt')
+
+def lire_fichier_ligne(nom_fichier):
+    '''Lit un fichier de ligne (une station par ligne: NOM X Y, dans l'ordre de la ligne) et retourne la liste des
+    paires (station, coordonnées)'''
+    stations = []
     with open(nom_fichier, 'r', encoding='utf-8') as fp:
         for ligne in fp:
-            coord = tuple(ligne.strip().split()[1:3])    # Trouve les coordonnées du fichier txt et les transforme en tuple
-            coords_pile.empile(coord)       # Met les coordonnées dans une pile
-        return coords_pile
+            if not ligne.strip():
+                continue
+            (nom, coord_x, coord_y) = ligne.split()    # Le nom de la station et ses coordonnées x et y
+            stations.append((nom, (int(coord_x), int(coord_y))))
+    return stations
 
 def dictionnaire_stations(nom_fichier):
     '''Prend en argument un fichier txt et retourne le dictionnaire de chaque station présente et ses coordonnées.'''
-    dictionnaire = {}
-    with open(nom_fichier, 'r', encoding='utf-8') as fp:
-        for ligne in fp:
-            (nom, coord_x, coord_y) =  ligne.strip().split()    # Crée un tuple avec le nom de la station et ses coordonnées x et y
-            dictionnaire[nom] = (int(coord_x), int(coord_y))    # Ajoute au dictionnaire les clés et valeurs du tuple
-    return dictionnaire
+    return dict(lire_fichier_ligne(nom_fichier))
+
+def charger_lignes(fichiers=None):
+    '''Lit une seule fois chaque fichier de ligne et retourne le dictionnaire {ligne: [(station, coordonnées)]}, les
+    stations dans l'ordre de la ligne. Le nom de la ligne est celui du fichier sans extension (ex: 'orange').
+    Les coordonnées (charger_stations), le graphe des lignes et le dessin des lignes en sont tous tirés.'''
+    if fichiers is None:
+        fichiers = [fichier_ligne(couleur) for couleur in COULEURS_LIGNES]
+    return {os.path.splitext(os.path.basename(nom_fichier))[0]: lire_fichier_ligne(nom_fichier) for nom_fichier in fichiers}
+
+def charger_stations(fichiers=None, lignes=None):
+    '''Retourne le dictionnaire final qui contient chaque station de toutes les lignes et ses coordonnées, à partir
+    des lignes déjà lues par charger_lignes (ou des fichiers de lignes).'''
+    if lignes is None:
+        lignes = charger_lignes(fichiers)
+    dictio_final = {}
+    for stations in lignes.values():
+        dictio_final.update(stations)
+    return dictio_final
+
+def replier_nom(texte):
+    '''Retourne la forme repliée d'un nom de station, pour le comparer sans tenir compte des accents, de la casse
+    ni de la ponctuation: "Côte des neiges" et "CÔTE-DES-NEIGES" donnent tous deux 'COTE-DES-NEIGES'.'''
+    lettres = unicodedata.normalize('NFKD', texte)
+    lettres = ''.join(c for c in lettres if not unicodedata.combining(c)).upper()
+    return '-'.join(''.join(c if c.isalnum() else ' ' for c in lettres).split())
+
+def trigrammes(cle):
+    '''Retourne l'ensemble des trigrammes d'un nom replié, bordé d'espaces pour donner du poids au début et à la fin'''
+    cle = '  ' + cle.replace('-', ' ') + ' '
+    return {cle[i:i+3] for i in range(len(cle) - 2)}
+
+# L'index des noms répond aux recherches exactes, par préfixe (autocomplétion) et approchées (fautes de frappe),
+# sur les noms repliés par replier_nom. Les préfixes se cherchent par bisection dans le tableau trié des noms
+# repliés (un arbre de préfixes implicite, beaucoup plus compact qu'un dictionnaire par lettre), et les recherches
+# approchées dans un index inversé {trigramme: numéros des noms qui le contiennent}.
+class IndexNoms:
+    def __init__(self, noms):
+        '''Construit l'index une seule fois pour la liste des noms de stations'''
+        self._exacts = {}       # {nom replié: [noms]}; plusieurs noms peuvent avoir la même forme repliée
+        for nom in noms:
+            self._exacts.setdefault(replier_nom(nom), []).append(nom)
+        self._cles = sorted(self._exacts)       # Noms repliés triés, pour les recherches par préfixe
+        self._trigrammes = {}   # {trigramme: tableau des numéros (dans self._cles) des noms qui le contiennent}
+        self._tailles = array('q')      # Nombre de trigrammes de chaque nom
+        for (i, cle) in enumerate(self._cles):
+            morceaux = trigrammes(cle)
+            self._tailles.append(len(morceaux))
+            for morceau in morceaux:
+                if morceau not in self._trigrammes:
+                    self._trigrammes[morceau] = array('q')
+                self._trigrammes[morceau].append(i)
+
+    def __len__(self):
+        return len(self._cles)
+
+    def exact(self, texte):
+        '''Retourne le nom de la station qui correspond au texte (accents, casse et ponctuation ignorés), ou None.
+        Si plusieurs noms ont la même forme repliée, celui écrit exactement comme le texte (en majuscules) l'emporte.'''
+        noms = self._exacts.get(replier_nom(texte))
+        if not noms:
+            return None
+        return texte.upper() if texte.upper() in noms else noms[0]
+
+    def completer(self, prefixe, limite=10):
+        '''Retourne au plus 'limite' noms, en ordre alphabétique des noms repliés, qui commencent par le préfixe'''
+        cle = replier_nom(prefixe)
+        if prefixe[-1:] in (' ', '-', "'"):     # Le séparateur tapé à la fin fait partie du préfixe
+            cle += '-'
+        resultat = []
+        for i in range(bisect.bisect_left(self._cles, cle), len(self._cles)):
+            if not self._cles[i].startswith(cle) or len(resultat) >= limite:
+                break
+            resultat.extend(self._exacts[self._cles[i]][:limite - len(resultat)])
+        return resultat
+
+    def approcher(self, texte, limite=5, seuil=0.3):
+        '''Retourne au plus 'limite' paires (nom, score) des noms les plus proches du texte, du plus proche au moins
+        proche. Le score (coefficient de Dice, entre 0 et 1) compte les trigrammes communs; ceux sous le seuil sont omis.
+        Seules les listes des trigrammes les plus rares de la requête sont parcourues (les trigrammes fréquents comme
+        ceux de 'SAINT' touchent une bonne partie du catalogue); le score exact des meilleurs candidats est ensuite calculé.'''
+        morceaux = trigrammes(replier_nom(texte))
+        listes = sorted((self._trigrammes.get(morceau, ()) for morceau in morceaux), key=len)
+        communs = collections.Counter(itertools.chain.from_iterable(listes[:(len(listes) + 1) // 2]))
+        scores = []
+        for (i, _) in communs.most_common(4 * limite + 20):
+            score = 2 * len(morceaux & trigrammes(self._cles[i])) / (len(morceaux) + self._tailles[i])
+            if score >= seuil:
+                scores.append((-score, i))
+        resultat = []
+        for (score, i) in sorted(scores):
+            resultat.extend((nom, round(-score, 3)) for nom in self._exacts[self._cles[i]])
+        return resultat[:limite]
+
+    def suggestions(self, texte, limite=5):
+        '''Retourne au plus 'limite' noms à proposer pour un texte qui ne correspond à aucune station: les noms qui
+        commencent par le texte, puis les plus proches'''
+        resultat = self.completer(texte, limite) if texte.strip() else []
+        for (nom, _) in self.approcher(texte, limite):
+            if len(resultat) < limite and nom not in resultat:
+                resultat.append(nom)
+        return resultat
+
+PENALITE_CORRESPONDANCE = 2000      # Coût d'un changement de ligne, en mètres de métro (environ 3 minutes de marche et d'attente)
+
+# Le graphe des lignes a un sommet par paire (station, ligne): deux stations voisines sur une ligne sont reliées
+# dans les deux sens avec la longueur de l'arête du graphe du métro, et les sommets d'une même station sur deux
+# lignes sont reliés par une correspondance, qui coûte la pénalité. Chaque station a aussi un sommet d'arrivée,
+# atteint sans coût de chacune de ses lignes; au départ, toutes les lignes de la station forment la frontière
+# initiale d'une recherche à plusieurs sources. Une station ne peut donc jamais servir de correspondance gratuite.
+class GrapheLignes:
+    def __init__(self, G, lignes, penalite=PENALITE_CORRESPONDANCE, penalites=None):
+        '''Construit le graphe des lignes à partir du graphe du métro et du dictionnaire {ligne: [(station,
+        coordonnées)]} (voir charger_lignes). 'penalites' donne au besoin la pénalité de correspondance propre à
+        certaines stations.
+        Les arêtes fermées du graphe du métro ne sont pas reprises.'''
+        penalites = penalites or {}
+        compact = G.grapheCompact()
+        noms = []
+        self._stations = []         # Station de chaque sommet
+        self._lignes = []           # Ligne de chaque sommet (None pour un sommet d'arrivée)
+        self._departs = {}          # {station: [sommets (station, ligne)]}: l'index qui évite de chercher les sommets d'une station
+        self._arrivees = {}         # {station: sommet d'arrivée}
+        aretes = []
 
+        def ajoute(station, ligne):
+            noms.append(station if ligne is None else station + '@' + ligne)
+            self._stations.append(station)
+            self._lignes.append(ligne)
+            return len(noms) - 1
+
+        for (ligne, stations) in lignes.items():
+            precedent = None
+            for (station, _) in stations:
+                if compact.sommet(station) is None:
+                    raise ValueError("La station %s de la ligne %s n'est pas dans le graphe" % (station, ligne))
+                sommet = ajoute(station, ligne)
+                self._departs.setdefault(station, []).append(sommet)
+                if precedent is not None:
+                    poids = compact.poids(compact.sommet(self._stations[precedent]), compact.sommet(station))
+                    if poids is None:
+                        raise ValueError('Les stations %s et %s de la ligne %s ne sont pas reliées dans le graphe'
+                                         % (self._stations[precedent], station, ligne))
+                    if poids < math.inf:
+                        aretes.append((precedent, sommet, poids))
+                        aretes.append((sommet, precedent, poids))
+                precedent = sommet
+        for (station, sommets) in self._departs.items():
+            arrivee = ajoute(station, None)
+            self._arrivees[station] = arrivee
+            for sommet in sommets:
+                aretes.append((sommet, arrivee, 0))
+                for autre in sommets:
+                    if autre != sommet:
+                        aretes.append((sommet, autre, penalites.get(station, penalite)))
+        self.graphe = compiler_csr(noms, aretes, oriente=True)
+
+    def trajet(self, depart, destination, compteurs=None):
+        '''Retourne (coût, segments) du trajet le plus court entre deux stations (noms), correspondances comprises,
+        où segments est la liste des paires (ligne, stations parcourues sur cette ligne); None si inatteignable.
+        La station d'une correspondance termine un segment et commence le suivant.'''
+        if depart not in self._departs or destination not in self._arrivees:
+            raise LookupError('Station hors des lignes: ' + str(depart if depart not in self._departs else destination))
+        destination_sommet = self._arrivees[destination]
+        resultat = recherche_multi_sources(self.graphe, dict.fromkeys(self._departs[depart], 0), destination_sommet, compteurs)
+        if resultat is None:
+            return None
+        (cout, precedent) = resultat
+        sommets = []
+        sommet = precedent[destination_sommet]      # Le sommet d'arrivée n'est pas une étape du trajet
+        while sommet is not None:
+            sommets.append(sommet)
+            sommet = precedent[sommet]
+        sommets.reverse()
+        segments = []
+        for sommet in sommets:
+            (station, ligne) = (self._stations[sommet], self._lignes[sommet])
+            if segments and segments[-1][0] == ligne:
+                segments[-1][1].append(station)
+            else:
+                segments.append((ligne, [station]))    # Départ, ou correspondance: la station commence un nouveau segment
+        return cout, segments
+
+
+# Le routeur regroupe tout ce qu'il faut pour calculer un trajet sans ouvrir de fenêtre: le graphe compact,
+# les coordonnées des stations et leur index spatial. Il peut être importé par un serveur ou un traitement en lot.
+class Routeur:
+    def __init__(self, fichier_graphe=FICHIER_GRAPHE, fichiers_stations=None):
+        '''Charge le graphe et les stations une seule fois'''
+        self.graphe = charger_graphe(fichier_graphe)
+        self.lignes = {}        # {ligne: [(station, coordonnées)]}, vide pour un réseau compilé (voir lire_reseau)
+        self.stations = None if fichiers_stations else lire_stations_reseau(fichier_graphe)
+        if not self.stations:   # Pas de coordonnées dans le fichier du graphe: elles viennent des fichiers de lignes
+            self.lignes = charger_lignes(fichiers_stations)
+            self.stations = charger_stations(lignes=self.lignes)
+        self.index = IndexSpatial(self.stations)
+        self._fichier_graphe = fichier_graphe
+        self._hierarchie = None     # Hiérarchie de contraction (module contraction), chargée à la première recherche 'hierarchie'
+        self._facteur = None    # Facteur de l'heuristique d'A*, calibré à la première recherche 'astar'
+        self._echelle = None    # Mètres par unité de carte, pour le coût de la marche (voir echelle_carte)
+        self._graphe_lignes = None      # (clé: version du graphe et pénalités, GrapheLignes), construit au premier trajet par lignes
+        self._index_noms = None     # IndexNoms des stations du graphe, construit à la première recherche de nom
+        self._version_facteur = None    # Version du graphe pour laquelle le facteur a été calibré
 
-# Paramètres de l'écran
-carte = turtle.Screen()
-carte.title("Carte STM")     # Nom de la fenêtre Turtle
-carte.bgcolor("black")
+    def sommet(self, nom):
+        '''Retourne le sommet du graphe qui correspond à ce nom de station'''
+        sommet = self.graphe.sommet(nom)
+        if sommet is None:
+            raise LookupError('Station inconnue: ' + str(nom))
+        return sommet
+
+    def hierarchie(self):
+        '''Retourne la hiérarchie de contraction du graphe, relue de son fichier (ou construite) la première fois, ou
+        None si elle ne correspond pas au graphe en mémoire (le fichier du graphe a changé depuis son chargement)'''
+        if self._hierarchie is None or self._hierarchie.empreinte() != self.graphe.empreinte():
+            import contraction      # Import tardif: le module contraction importe metro
+            self._hierarchie = contraction.charger_hierarchie(self._fichier_graphe)[0]
+        if self._hierarchie.empreinte() != self.graphe.empreinte():
+            return None
+        return self._hierarchie
+
+    def index_noms(self):
+        '''Retourne l'index des noms des stations (IndexNoms), construit une seule fois'''
+        if self._index_noms is None:
+            self._index_noms = IndexNoms(self.graphe.listeSommets(True))
+        return self._index_noms
+
+    def resoudre(self, texte):
+        '''Retourne le nom exact de la station écrite dans le texte, sans tenir compte des accents, de la casse ni de la
+        ponctuation (ex: 'cote des neiges'). Lève LookupError, avec des suggestions, si aucune station ne correspond.'''
+        index = self.index_noms()
+        nom = index.exact(texte)
+        if nom is None:
+            suggestions = index.suggestions(texte)
+            raise LookupError('Station inconnue: ' + str(texte) + (' (vouliez-vous dire: %s ?)' % ', '.join(suggestions) if suggestions else ''))
+        return nom
+
+    def station_proche(self, coord):
+        '''Retourne le nom de la station la plus proche des coordonnées'''
+        with etape('station_proche'):
+            return self.index.plus_proche(coord)
+
+    def trajet(self, depart, destination, mode=None, compteurs=None):
+        '''Retourne la liste des stations du trajet le plus court entre deux stations (données par leur nom), ou None.
+        Sans mode, le trajet est lu dans l'arbre des plus courts chemins vers la destination, gardé en mémoire;
+        sinon, la recherche se fait avec le mode demandé ('dijkstra', 'astar', 'bidirectionnel' ou 'hierarchie').
+        La hiérarchie de contraction est construite sur le graphe du fichier: tant qu'une arête ou une station est
+        fermée ou qu'un poids diffère de celui du fichier, le mode 'hierarchie' fait plutôt une recherche
+        bidirectionnelle.'''
+        depart_sommet = self.sommet(depart)
+        destination_sommet = self.sommet(destination)
+        if mode is None:
+            with etape('recherche_arbre'):
+                return arbre_vers_destination(self.graphe, destination_sommet).chemin(depart_sommet)
+        if mode == 'hierarchie':
+            hierarchie = self.hierarchie() if self.graphe.estIntact() else None
+            if hierarchie is None:
+                mode = 'bidirectionnel'
+        if mode == 'astar' and self._version_facteur != self.graphe.version():   # Un poids a pu diminuer
+            self._facteur = calibrer_heuristique(self.graphe, self.stations)
+            self._version_facteur = self.graphe.version()
+        m = instrumentation
+        if m is not None and compteurs is None:
+            compteurs = {}
+        with etape('recherche_' + mode):
+            if mode == 'hierarchie':    # Mêmes numéros de stations: la hiérarchie est construite à partir du même fichier
+                chemin = hierarchie.trajet(depart_sommet, destination_sommet, compteurs)
+            else:
+                chemin = trouver_trajet(self.graphe, depart_sommet, destination_sommet, mode, self.stations, self._facteur, compteurs)
+        if m is not None:
+            m.compter(compteurs, mode + '_')
+        return chemin
+
+    def alternatives(self, depart, destination, k=5, compteurs=None):
+        '''Retourne les k trajets les plus courts sans boucle entre les deux stations (voir k_plus_courts_chemins),
+        sous forme de paires (longueur, liste des stations)'''
+        depart_sommet = self.sommet(depart)
+        destination_sommet = self.sommet(destination)
+        m = instrumentation
+        if m is not None and compteurs is None:
+            compteurs = {}
+        with etape('alternatives'):
+            trajets = k_plus_courts_chemins(self.graphe, depart_sommet, destination_sommet, k, compteurs)
+        if m is not None:
+            m.compter(compteurs, 'alternatives_')
+        return trajets
+
+    def trajet_depuis(self, coord, destination, mode=None, compteurs=None):
+        '''Retourne la station la plus proche des coordonnées et le trajet le plus court de cette station à la destination'''
+        station_proche = self.station_proche(coord)
+        return station_proche, self.trajet(station_proche, destination, mode, compteurs)
+
+    def graphe_lignes(self, penalite=PENALITE_CORRESPONDANCE, penalites=None):
+        '''Retourne le graphe des lignes (GrapheLignes), construit une seule fois puis reconstruit seulement si le
+        graphe du métro a changé (fermetures, poids) ou si les pénalités de correspondance sont différentes'''
+        cle = (self.graphe.version(), penalite, tuple(sorted((penalites or {}).items())))
+        if self._graphe_lignes is None or self._graphe_lignes[0] != cle:
+            with etape('construction_graphe_lignes'):
+                self._graphe_lignes = (cle, GrapheLignes(self.graphe, self.lignes, penalite, penalites))
+        return self._graphe_lignes[1]
+
+    def trajet_lignes(self, depart, destination, penalite=PENALITE_CORRESPONDANCE, penalites=None, compteurs=None):
+        '''Retourne (coût, segments) du trajet le plus court en tenant compte des correspondances (voir
+        GrapheLignes.trajet): chaque segment est une paire (ligne, stations parcourues sur cette ligne)'''
+        lignes = self.graphe_lignes(penalite, penalites)
+        m = instrumentation
+        if m is not None and compteurs is None:
+            compteurs = {}
+        with etape('recherche_lignes'):
+            resultat = lignes.trajet(depart, destination, compteurs)
+        if m is not None:
+            m.compter(compteurs, 'lignes_')
+        return resultat
+
+    def acces_marche(self, coord, k=3):
+        '''Retourne les k stations les plus proches des coordonnées avec le coût de la marche jusqu'à chacune
+        (distance sur la carte convertie en mètres, multipliée par PENALITE_MARCHE), sous forme de paires (station, coût)'''
+        if self._echelle is None:
+            self._echelle = echelle_carte(self.graphe, self.stations)
+        with etape('station_proche'):
+            proches = self.index.k_plus_proches(coord, k)
+        return [(station, round(distance * self._echelle * PENALITE_MARCHE)) for (station, distance) in proches]
+
+    def trajet_multi_acces(self, coord, destination, k=3, compteurs=None):
+        '''Cherche le meilleur trajet depuis les coordonnées en considérant les k stations les plus proches comme
+        entrées possibles, chacune avec son coût de marche, en une seule recherche (recherche_multi_sources).
+        Retourne (station d'entrée retenue, liste des stations du trajet, coût total marche comprise), ou
+        (None, None, None) si la destination est inatteignable.'''
+        destination_sommet = self.sommet(destination)
+        departs = {}
+        for (station, cout) in self.acces_marche(coord, k):
+            departs[self.sommet(station)] = cout
+        m = instrumentation
+        if m is not None and compteurs is None:
+            compteurs = {}
+        with etape('recherche_multi_acces'):
+            resultat = recherche_multi_sources(self.graphe, departs, destination_sommet, compteurs)
+        if m is not None:
+            m.compter(compteurs, 'multi_acces_')
+        if resultat is None:
+            return None, None, None
+        (cout, precedent) = resultat
+        chemin = reconstruire_chemin(self.graphe, precedent, destination_sommet)
+        return chemin[0], chemin, cout
+
+
+'''ÉTAPE 4: DEMANDER LE INPUT DE L'UTILISATEUR'''
+# Le point de départ est choisit en cliquant sur l'interface graphique!
+def demander_destination(index):
+    '''Demande à l'utilisateur le nom de la station de destination jusqu'à ce qu'il corresponde à une station de
+    l'index (IndexNoms); les accents, la casse et les espaces à la place des '-' sont acceptés, ainsi que le début
+    d'un seul nom. Un nom seulement approchant (faute de frappe) doit être confirmé.'''
+    while True:
+        texte = input("Entrez le nom de la station de métro pour votre destination: ")
+        nom = index.exact(texte)
+        if nom is not None:
+            return nom
+        completions = index.completer(texte, 2) if texte.strip() else []
+        if len(completions) == 1:   # Le texte est le début d'une seule station: pas besoin de redemander
+            print('Destination: ' + completions[0])
+            return completions[0]
+        suggestions = index.suggestions(texte)
+        if len(suggestions) == 1:   # Une seule station approchante: elle peut être une erreur, on demande
+            reponse = input('Vouliez-vous dire ' + suggestions[0] + ' ? (o/n) ')
+            if reponse.strip().lower() in ('o', 'oui'):
+                return suggestions[0]
+            continue
+        print('Station inconnue.' + (' Vouliez-vous dire: ' + ', '.join(suggestions) + ' ?' if suggestions else ''))
+
+
+'''ÉTAPE 5: INITIALISATION DE TURTLE'''
+# turtle (et donc tkinter) n'est importé que lorsque la carte est demandée
+turtle = None
+carte = None
+pointeur = None
+curseur = None
 WIDTH = 1000
 HEIGHT = 1000
-carte.setup(width=WIDTH, height=HEIGHT, startx=300, starty=0)
-
-# Paramètres de la tortue initiale
-pointeur = turtle.Turtle()
-pointeur.shape("blank")      # Le Turtle qui dessine est invisible
-pointeur.pensize(15)
-pointeur.speed(0)
-pointeur.penup()
-
-curseur = turtle.Turtle()
-curseur.shape("blank")
-curseur.color("DarkBlue")
-curseur.pensize(2)
-curseur.speed(0)
-curseur.penup()
+GRAINE_CARTE = 407      # Graine fixe du hasard des arbres et des villes
+VERSION_FOND = 1        # À augmenter lorsque le dessin du fond de carte change, pour invalider le fond gardé en cache
+FICHIER_FOND = os.path.join(REPERTOIRE, 'fond_carte.json')
+
+def initialiser_carte():
+    '''Importe turtle, ouvre la fenêtre de la carte et prépare les deux tortues qui dessinent'''
+    global turtle, carte, pointeur, curseur
+    import turtle
+
+    # Paramètres de l'écran
+    carte = turtle.Screen()
+    carte.title("Carte STM")     # Nom de la fenêtre Turtle
+    carte.bgcolor("black")
+    carte.setup(width=WIDTH, height=HEIGHT, startx=300, starty=0)
+
+    # Paramètres de la tortue initiale
+    pointeur = turtle.Turtle()
+    pointeur.shape("blank")      # Le Turtle qui dessine est invisible
+    pointeur.pensize(15)
+    pointeur.speed(0)
+    pointeur.penup()
+
+    curseur = turtle.Turtle()
+    curseur.shape("blank")
+    curseur.color("DarkBlue")
+    curseur.pensize(2)
+    curseur.speed(0)
+    curseur.penup()
 
 # Dessin de la rivière
 def parcours_riviere(liste):
@@ -253,26 +1778,25 @@ def parcours_riviere(liste):
     curseur.penup()
 
 liste_riviere1 = [(-400,50), (-350,80), (-300,120), (-260,140), (-220,140), (-195,180), (-165,240), (-150,300), (-120,350), (-100,390), (-80,420), (0,500)]
-curseur.pensize(25)
-curseur.goto(-500,-100)
-curseur.color("DarkBlue")
-parcours_riviere(liste_riviere1)
-
 liste_riviere2 = [(440,200), (400,140), (360,100), (320,60), (300,0), (300,-60), (320,-100), (340,-150), (400,-180), (380,-100), (350, -10), (340, 80)]
-curseur.goto(500,350)
-parcours_riviere(liste_riviere2)
-
 liste_riviere3 = [(400,-180), (500,-220), (500,-500), (200,-500), (300, -300), (340,-150)]
-curseur.goto(340,-150)
-curseur.fillcolor("DarkBlue")
-curseur.begin_fill()
-parcours_riviere(liste_riviere3)
-curseur.end_fill()
 
+def dessiner_rivieres():
+    '''Trace les trois rivières'''
+    curseur.pensize(25)
+    curseur.goto(-500,-100)
+    curseur.color("DarkBlue")
+    parcours_riviere(liste_riviere1)
+
+    curseur.goto(500,350)
+    parcours_riviere(liste_riviere2)
+
+    curseur.goto(340,-150)
+    curseur.fillcolor("DarkBlue")
+    curseur.begin_fill()
+    parcours_riviere(liste_riviere3)
+    curseur.end_fill()
 
-curseur.pensize(2)
-turtle.tracer(0) # Accélère la vitesse de turtle pour les dessins décoratifs
-curseur.pencolor("gray")
 def arbre_triangulaire(x, y):
     '''Fonction qui dessine un arbre triangulaire situé à des coordonnées x et y'''
     curseur.penup()
@@ -354,53 +1878,42 @@ def aziz(x, y):
     curseur.write("Aziz")
 
 
-# Dessin des arbres
-for i in range(40):
-    x = random.randint(40, 250)
-    y = random.randint(220, 490)
-    arbre_triangulaire(x, y)
+def dessiner_decor():
+    '''Dessine les arbres et les villes'''
+    curseur.pensize(2)
+    turtle.tracer(0) # Accélère la vitesse de turtle pour les dessins décoratifs
+    curseur.pencolor("gray")
+    random.seed(GRAINE_CARTE)   # Toujours les mêmes arbres et les mêmes villes, pour que le fond puisse être gardé en cache
+
+    # Dessin des arbres
+    for i in range(40):
+        x = random.randint(40, 250)
+        y = random.randint(220, 490)
+        arbre_triangulaire(x, y)
 
-for i in range(20):
-    x = random.randint(410, 500)
-    y = random.randint(-170, 130)
-    arbre_triangulaire(x, y)
+    for i in range(20):
+        x = random.randint(410, 500)
+        y = random.randint(-170, 130)
+        arbre_triangulaire(x, y)
 
-# Dessin des villes
-skyline(-420, 270)
-skyline(-275, -25)
-skyline(-450, -250)
-skyline(-250, -400)
+    # Dessin des villes
+    skyline(-420, 270)
+    skyline(-275, -25)
+    skyline(-450, -250)
+    skyline(-250, -400)
 
 
 # Dessin des lignes du metro
-def dessin_ligne(couleur):
-    '''Fonction qui dessine chacune des lignes du réseau individuellement en faisant appel à des fichiers txt'''
+def dessin_ligne(couleur, stations_ligne):
+    '''Fonction qui dessine une ligne du réseau à partir de ses stations déjà lues (voir charger_lignes)'''
     pointeur.pencolor(couleur)
-    fichier = couleur + ".txt"       # crée une variable du nom du fichier txt en prenant en compte l'argument de la fonction
-    ligne = read_coords(fichier)
-    depile = ligne.depile()
-    pointeur.setpos(int(depile[0]), int(depile[1]))
+    (_, (x, y)) = stations_ligne[0]
+    pointeur.setpos(x, y)
     pointeur.pendown()              # commence le traçage des lignes du réseau
-    while not ligne.estvide():      # continue de dépiler les stations de la pile tant qu'elle n'est pas vide
-        depile = ligne.depile()
-        pointeur.goto(int(depile[0]), int(depile[1]))     # trace la ligne entre deux stations distinctes
+    for (_, (x, y)) in stations_ligne[1:]:
+        pointeur.goto(x, y)         # trace la ligne entre deux stations distinctes
     pointeur.penup()               # arrête le traçage
 
-dessin_ligne("orange")
-dessin_ligne("blue")
-dessin_ligne("green")
-dessin_ligne("yellow")
-
-# Le dictionnaire final contient chaque station et ses coordonnées
-dictio_orange = dictionnaire_stations('orange.txt')
-dictio_bleu = dictionnaire_stations('blue.txt')
-dictio_vert = dictionnaire_stations('green.txt')
-dictio_jaune = dictionnaire_stations('yellow.txt')
-liste_dictio = [dictio_orange, dictio_bleu, dictio_vert, dictio_jaune]
-dictio_final = {}
-for i in liste_dictio:
-    dictio_final.update(i)
-
 '''Affichage des points correspondant aux stations'''
 
 # Liste des stations ayant un point blanc de plus grande taille (terminus et intersections)
@@ -428,87 +1941,207 @@ exceptions_droite = ["CHAMP-DE-MARS", "PLACE-D'ARMES", "SQUARE-VICTORIA-OACI", "
 exceptions_droite_extreme = ["VERDUN", "MONK", "ANGRIGNON"]
 exceptions_bas_droite = ["JOLICOEUR"]
 
-pointeur.color("white")     # pour écrire les noms des stations en blanc
-for dictio_key in dictio_final.keys():
-    coord_dictio = dictio_final[dictio_key]              # prend le tuple des coordonnées de chaque station
-    pointeur.setpos(coord_dictio[0], coord_dictio[1])    # place le Turtle sur la coordonnée de chaque station
-    if dictio_key in intersections_terminus:             # si la station est dans la liste de terminus ou d'intersections, on dessine un plus gros point
-        pointeur.dot(15, "white")
-    else:
-        pointeur.dot(10, "white")
-
-    # Exceptions de chaque type de placement des noms sur la carte
-    # Beaucoup de code mais le résultat est vraiment beau!
-    if dictio_key in exceptions_gauche:
-        pointeur.setheading(20)
-        pointeur.backward(20)
-        pointeur.write(dictio_key, align='right')
-    elif dictio_key in exceptions_gauche_extreme:
-        pointeur.setheading(20)
-        pointeur.backward(25)
-        pointeur.write(dictio_key, align='right')
-    elif dictio_key in exceptions_haut_gauche:
-        pointeur.setheading(0)
-        pointeur.backward(10)
-        pointeur.write(dictio_key, align='right')
-    elif dictio_key in exceptions_bas_gauche:
-        pointeur.setheading(70)
-        pointeur.backward(25)
-        pointeur.write(dictio_key, align='right')
-    elif dictio_key in exceptions_bas:
-        pointeur.setheading(270)
-        pointeur.forward(30)
-        pointeur.write(dictio_key)
-    elif dictio_key in exceptions_bas_centre:
-        pointeur.setheading(270)
-        pointeur.forward(35)
-        pointeur.write(dictio_key, align= 'center')
-    elif dictio_key in exceptions_droite:
-        pointeur.setheading(340)
-        pointeur.forward(20)
-        pointeur.write(dictio_key)
-    elif dictio_key in exceptions_bas_droite:
-        pointeur.setheading(320)
-        pointeur.forward(25)
-        pointeur.write(dictio_key)
-    elif dictio_key in exceptions_droite_extreme:
-        pointeur.setheading(340)
-        pointeur.forward(25)
-        pointeur.write(dictio_key)
-    else:
-        pointeur.setheading(0)
-        pointeur.forward(20)
-        pointeur.write(dictio_key)
-
-
-'''ÉTAPE 5: TURTLE DU TRAJET LE PLUS COURT'''
-# Étape 1: Départ à la première station de métro, la ligne rouge est l'itinéraire à emprunter
-turtle.tracer(1)        # Ralentit la vitesse de turtle pour voir le trajet dessiné
+def afficher_stations(stations):
+    '''Dessine le point et le nom de chaque station du dictionnaire {station: coordonnées}'''
+    pointeur.color("white")     # pour écrire les noms des stations en blanc
+    for dictio_key in stations.keys():
+        coord_dictio = stations[dictio_key]              # prend le tuple des coordonnées de chaque station
+        pointeur.setpos(coord_dictio[0], coord_dictio[1])    # place le Turtle sur la coordonnée de chaque station
+        if dictio_key in intersections_terminus:             # si la station est dans la liste de terminus ou d'intersections, on dessine un plus gros point
+            pointeur.dot(15, "white")
+        else:
+            pointeur.dot(10, "white")
+
+        # Exceptions de chaque type de placement des noms sur la carte
+        # Beaucoup de code mais le résultat est vraiment beau!
+        if dictio_key in exceptions_gauche:
+            pointeur.setheading(20)
+            pointeur.backward(20)
+            pointeur.write(dictio_key, align='right')
+        elif dictio_key in exceptions_gauche_extreme:
+            pointeur.setheading(20)
+            pointeur.backward(25)
+            pointeur.write(dictio_key, align='right')
+        elif dictio_key in exceptions_haut_gauche:
+            pointeur.setheading(0)
+            pointeur.backward(10)
+            pointeur.write(dictio_key, align='right')
+        elif dictio_key in exceptions_bas_gauche:
+            pointeur.setheading(70)
+            pointeur.backward(25)
+            pointeur.write(dictio_key, align='right')
+        elif dictio_key in exceptions_bas:
+            pointeur.setheading(270)
+            pointeur.forward(30)
+            pointeur.write(dictio_key)
+        elif dictio_key in exceptions_bas_centre:
+            pointeur.setheading(270)
+            pointeur.forward(35)
+            pointeur.write(dictio_key, align= 'center')
+        elif dictio_key in exceptions_droite:
+            pointeur.setheading(340)
+            pointeur.forward(20)
+            pointeur.write(dictio_key)
+        elif dictio_key in exceptions_bas_droite:
+            pointeur.setheading(320)
+            pointeur.forward(25)
+            pointeur.write(dictio_key)
+        elif dictio_key in exceptions_droite_extreme:
+            pointeur.setheading(340)
+            pointeur.forward(25)
+            pointeur.write(dictio_key)
+        else:
+            pointeur.setheading(0)
+            pointeur.forward(20)
+            pointeur.write(dictio_key)
+
+
+'''Fond de carte pré-rendu'''
+# Tout ce qui ne change pas d'un clic à l'autre (rivières, arbres, villes, lignes et stations) forme le fond de carte.
+# Après le premier dessin, les éléments du canevas tkinter sont enregistrés dans FICHIER_FOND; aux démarrages suivants,
+# ils sont recréés directement sur le canevas en une seule passe, sans refaire chaque mouvement de tortue.
+
+def cle_fond():
+    '''Retourne l'empreinte qui identifie le fond de carte: fichiers des lignes, graine du hasard, version du dessin
+    et taille de la fenêtre. Si l'un d'eux change, le fond gardé en cache n'est plus valide.'''
+    empreinte = hashlib.sha256(('%d %d %d %d' % (VERSION_FOND, GRAINE_CARTE, WIDTH, HEIGHT)).encode('utf-8'))
+    for couleur in COULEURS_LIGNES:
+        with open(fichier_ligne(couleur), 'rb') as fp:
+            empreinte.update(fp.read())
+    return empreinte.hexdigest()
+
+def capturer_fond():
+    '''Retourne la liste des éléments visibles du canevas, sous forme de [type, coordonnées, options]'''
+    canevas = carte.getcanvas()
+    elements = []
+    for item in canevas.find_all():
+        genre = canevas.type(item)
+        coords = canevas.coords(item)
+        if genre not in ('line', 'polygon', 'text') or len(coords) < (2 if genre == 'text' else 4):
+            continue    # Image de fond ou élément vide laissé par une tortue
+        options = {}
+        for (nom, _, _, defaut, valeur) in canevas.itemconfigure(item).values():
+            if nom != 'tags' and valeur != defaut:
+                options[nom] = valeur
+        if genre != 'text' and not options.get('fill') and not options.get('outline'):
+            continue    # Élément invisible (forme 'blank' des tortues, ligne pas encore tracée)
+        elements.append([genre, coords, options])
+    return elements
+
+def restaurer_fond(elements):
+    '''Recrée sur le canevas les éléments capturés par capturer_fond. Retourne False (et retire les éléments déjà
+    recréés) si le cache est abîmé ou vient d'une autre version de tkinter: le fond doit alors être redessiné.'''
+    canevas = carte.getcanvas()
+    recrees = []
+    try:
+        for (genre, coords, options) in elements:
+            if genre not in ('line', 'polygon', 'text'):
+                raise ValueError('Élément de fond inconnu: %r' % (genre,))
+            recrees.append(getattr(canevas, 'create_' + genre)(*coords, **options))
+    except (turtle.TK.TclError, KeyError, TypeError, ValueError):
+        for item in recrees:
+            canevas.delete(item)
+        return False
+    return True
+
+def lire_fond(cle):
+    '''Retourne les éléments du fond de carte gardé en cache, ou None s'il est absent ou ne correspond pas à la clé'''
+    try:
+        with open(FICHIER_FOND, 'r', encoding='utf-8') as fp:
+            fond = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(fond, dict) or fond.get('cle') != cle:
+        return None
+    return fond.get('elements')
+
+def dessiner_fond(stations, lignes):
+    '''Dessine le fond de carte: à partir du cache s'il est valide, sinon avec les tortues (et l'enregistre)'''
+    turtle.tracer(0)
+    cle = cle_fond()
+    elements = lire_fond(cle)
+    if elements is None or not restaurer_fond(elements):
+        dessiner_rivieres()
+        dessiner_decor()
+        for couleur in COULEURS_LIGNES:
+            dessin_ligne(couleur, lignes[couleur])
+        afficher_stations(stations)
+        carte.update()
+        try:
+            with open(FICHIER_FOND, 'w', encoding='utf-8') as fp:
+                json.dump({'cle': cle, 'elements': capturer_fond()}, fp, ensure_ascii=False)
+        except OSError:
+            pass    # Dossier en lecture seule: le fond sera simplement redessiné au prochain démarrage
+    carte.update()
+
+
+'''ÉTAPE 6: TURTLE DU TRAJET LE PLUS COURT'''
+destination = None      # Station de destination choisie au démarrage
+routeur = None          # Moteur de routage partagé par tous les clics
+acces = 1               # Nombre de stations d'entrée considérées autour du clic (1: la plus proche seulement)
 
 def fonction_principale(x, y):
     '''Fonction principale qui tracera le trajet optimal selon les coordonnées où l'utilisateur clique'''
+    # Étape 1: Départ à la première station de métro, la ligne rouge est l'itinéraire à emprunter
     coord_depart = (x,y)
-    station_proche = depart_metro(dictio_final, coord_depart)
-    pointeur.penup()
-    pointeur.setpos(coord_depart[0], coord_depart[1])
-    pointeur.color('red')
-    pointeur.speed(5)
-    pointeur.pendown()
-
-    aziz(coord_depart[0], coord_depart[1])  # Dessin de Aziz
-
-    pointeur.goto(int(dictio_final[station_proche][0]), int(dictio_final[station_proche][1]))
-
-    # Étape 2: Trajet de métro jusqu'à la destination
-    graphe = lire_fichier_graphe('caps_metro.txt')
-    depart_sommet = graphe.sommet(station_proche)
-    destination_sommet = graphe.sommet(destination)
-    trajet_metro = dijkstra(graphe, depart_sommet, destination_sommet)
-    for current_station in trajet_metro:
-        pointeur.goto(int(dictio_final[current_station][0]), int(dictio_final[current_station][1]))
-    pointeur.penup()
-
-carte.onscreenclick(fonction_principale)       # Permet le choix de la position de départ à l'aide d'un click de la souris
-
-'''FIN DU TURTLE'''
-carte.mainloop()
+    trajet_metro = None
+    if acces > 1:   # L'entrée est choisie parmi les stations les plus proches, marche comprise
+        station_proche, trajet_metro, _ = routeur.trajet_multi_acces(coord_depart, destination, acces)
+    if trajet_metro is None:
+        station_proche = routeur.station_proche(coord_depart)
+    stations = routeur.stations
+    with etape('dessin_depart'):
+        pointeur.penup()
+        pointeur.setpos(coord_depart[0], coord_depart[1])
+        pointeur.color('red')
+        pointeur.speed(5)
+        pointeur.pendown()
+
+        aziz(coord_depart[0], coord_depart[1])  # Dessin de Aziz
+
+        pointeur.goto(int(stations[station_proche][0]), int(stations[station_proche][1]))
+
+    # Étape 2: Trajet de métro jusqu'à la destination, retrouvé dans l'arbre des plus courts chemins vers la destination
+    if trajet_metro is None:
+        trajet_metro = routeur.trajet(station_proche, destination)
+    if trajet_metro is None:    # Des fermetures séparent la station de départ de la destination
+        pointeur.penup()
+        print('Aucun trajet de ' + station_proche + ' à ' + destination + ' (stations ou segments fermés).')
+        return
+    with etape('dessin_trajet'):
+        for current_station in trajet_metro:
+            pointeur.goto(int(stations[current_station][0]), int(stations[current_station][1]))
+        pointeur.penup()
+
+def main(arguments=None):
+    '''Lance l'application interactive: demande la destination, dessine la carte puis trace un trajet à chaque clic'''
+    global destination, routeur, acces
+    parseur = argparse.ArgumentParser(description='Navigation dans le métro de Montréal.')
+    parseur.add_argument('--mesures', help="active l'instrumentation et écrit les mesures dans ce fichier "
+                                            "(JSON, ou format Prometheus si le nom finit par '.prom') à la fermeture")
+    parseur.add_argument('--acces', type=int, default=1, metavar='K',
+                         help="choisit la station d'entrée parmi les K plus proches du clic, selon le trajet total marche comprise")
+    args = parseur.parse_args(arguments)
+    if args.mesures:
+        activer_instrumentation()
+    acces = args.acces
+
+    routeur = Routeur()     # Le graphe est chargé une seule fois (instantané compact), puis partagé par tous les clics
+    if not routeur.lignes:
+        sys.exit("La carte interactive ne dessine que le métro de Montréal (fichiers de lignes %s); un réseau compilé "
+                 "(gtfs.py) se consulte avec Routeur, routage_lot.py ou contraction.py" % ', '.join(COULEURS_LIGNES))
+    destination = demander_destination(routeur.index_noms())
+
+    initialiser_carte()
+    dessiner_fond(routeur.stations, routeur.lignes)     # Rivières, décor, lignes et stations: dessinés une fois, puis relus du cache
+
+    turtle.tracer(1)        # Ralentit la vitesse de turtle pour voir le trajet dessiné
+    carte.onscreenclick(fonction_principale)       # Permet le choix de la position de départ à l'aide d'un click de la souris
+
+    '''FIN DU TURTLE'''
+    carte.mainloop()
+    if instrumentation is not None:
+        instrumentation.ecrire(args.mesures)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+'''Routage en lot: calcule hors ligne le trajet de chaque requête (x, y, destination) d'un fichier JSONL ou CSV.
+
+Les requêtes sont lues une ligne à la fois et envoyées par paquets à un groupe de processus. Au plus quelques
+paquets sont en cours à la fois, donc la mémoire utilisée ne dépend pas de la taille du fichier. Les résultats
+sont écrits dans l'ordre des requêtes.
+
+Exemple:  python routage_lot.py requetes.jsonl -o trajets.jsonl --processus 4
+'''
+
+import argparse
+import collections
+import csv
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+import metro
+
+_routeur = None     # Routeur du processus courant (hérité du processus principal ou créé par _initialiser)
+_mode = None        # Mode de recherche ('arbre' utilise l'arbre des plus courts chemins vers la destination)
+
+def _initialiser(fichier_graphe, mode):
+    '''Prépare un processus de travail. Avec fork, le routeur du processus principal est déjà là; sinon le graphe
+    est relu de son instantané binaire projeté en mémoire, dont les pages sont partagées entre les processus.'''
+    global _routeur, _mode
+    if _routeur is None:
+        _routeur = metro.Routeur(fichier_graphe)
+    if mode == 'hierarchie':
+        _routeur.hierarchie()   # Relue (ou construite) une seule fois avant de lancer les processus
+    _mode = mode
+
+def _requete(valeurs, numero):
+    '''Retourne le tuple (x, y, destination) d'une requête lue à la ligne 'numero', ou (None, None, message d'erreur)'''
+    if not isinstance(valeurs, dict):
+        return (None, None, 'Ligne %d: objet JSON attendu' % numero)
+    destination = valeurs.get('destination') or valeurs.get('to')
+    if not destination:
+        return (None, None, 'Ligne %d: colonne ou valeur de destination (destination ou to) manquante' % numero)
+    try:
+        (x, y) = (float(valeurs['x']), float(valeurs['y']))
+    except KeyError as erreur:
+        return (None, None, 'Ligne %d: colonne %s manquante' % (numero, erreur))
+    except (TypeError, ValueError, OverflowError):
+        return (None, None, 'Ligne %d: x et y doivent être des nombres' % numero)
+    if not (math.isfinite(x) and math.isfinite(y)):     # float() accepte 'nan' et 'inf', json.loads NaN et 1e400
+        return (None, None, 'Ligne %d: x et y doivent être des nombres finis' % numero)
+    return (x, y, destination)
+
+def lire_requetes(fp, format_entree):
+    '''Génère les requêtes du fichier une à une, sous forme de tuples (x, y, destination).
+    Une ligne invalide donne le tuple (None, None, message d'erreur) pour garder l'ordre des résultats.'''
+    if format_entree == 'csv':
+        lecteur = csv.DictReader(fp)
+        for rangee in lecteur:
+            yield _requete(rangee, lecteur.line_num)
+        return
+    for (numero, ligne) in enumerate(fp, 1):
+        if not ligne.strip():
+            continue
+        try:
+            requete = json.loads(ligne)
+        except ValueError:
+            yield (None, None, 'Ligne %d: JSON invalide' % numero)
+            continue
+        yield _requete(requete, numero)
+
+def router(requete, station=None):
+    '''Calcule le résultat d'une requête (x, y, destination) avec le routeur du processus courant, à partir de la
+    station la plus proche si elle est déjà connue'''
+    (x, y, destination) = requete
+    if x is None:
+        return {'erreur': destination}
+    resultat = {'x': x, 'y': y, 'destination': destination}
+    try:
+        mode = None if _mode == 'arbre' else _mode
+        if station is None:
+            station = _routeur.station_proche((x, y))
+        resultat['station'], resultat['trajet'] = station, _routeur.trajet(station, _routeur.resoudre(destination), mode)
+    except LookupError as erreur:
+        resultat['erreur'] = str(erreur)
+    return resultat
+
+def router_paquet(paquet):
+    '''Calcule tous les résultats d'un paquet de requêtes. Les stations les plus proches de toutes les requêtes
+    valides du paquet sont cherchées en un seul appel (IndexSpatial.plus_proches_lot, vectorisé avec NumPy).'''
+    coords = [(x, y) for (x, y, _) in paquet if x is not None]
+    with metro.etape('station_proche_lot'):
+        stations = iter(_routeur.index.plus_proches_lot(coords) if coords else ())
+    return [router(requete, next(stations) if requete[0] is not None else None) for requete in paquet]
+
+def ecrire_resultat(sortie, resultat, format_sortie):
+    '''Écrit un résultat dans le fichier de sortie (une ligne JSON, ou une rangée CSV si 'sortie' est un csv.writer)'''
+    if format_sortie == 'csv':
+        trajet = resultat.get('trajet')
+        sortie.writerow([resultat.get('x', ''), resultat.get('y', ''), resultat.get('destination', ''),
+                         resultat.get('station', ''), ' '.join(trajet) if trajet else '', resultat.get('erreur', '')])
+    else:
+        sortie.write(json.dumps(resultat, ensure_ascii=False) + '\n')
+
+def paquets(requetes, taille):
+    '''Regroupe les requêtes en listes d'au plus 'taille' éléments'''
+    requetes = iter(requetes)
+    while True:
+        paquet = list(itertools.islice(requetes, taille))
+        if not paquet:
+            return
+        yield paquet
+
+def routage_lot(requetes, ecrire, processus=None, taille_paquet=500, fichier_graphe=metro.FICHIER_GRAPHE, mode='dijkstra'):
+    '''Route toutes les requêtes et appelle ecrire(resultat) dans l'ordre des requêtes.
+    Retourne les statistiques {'requetes', 'erreurs', 'secondes', 'requetes_par_seconde'}.'''
+    global _routeur
+    debut = time.perf_counter()
+    _routeur = metro.Routeur(fichier_graphe)    # Compile l'instantané binaire au besoin, avant de lancer les processus
+    _initialiser(fichier_graphe, mode)
+    total = erreurs = 0
+    if processus is None:
+        processus = os.cpu_count() or 1
+
+    def compter(resultats):
+        nonlocal total, erreurs
+        for resultat in resultats:
+            total += 1
+            erreurs += 'erreur' in resultat
+            ecrire(resultat)
+
+    if processus <= 1:
+        for paquet in paquets(requetes, taille_paquet):
+            compter(router_paquet(paquet))
+    else:
+        with multiprocessing.Pool(processus, initializer=_initialiser, initargs=(fichier_graphe, mode)) as groupe:
+            en_cours = collections.deque()      # Résultats attendus, dans l'ordre des paquets
+            for paquet in paquets(requetes, taille_paquet):
+                en_cours.append(groupe.apply_async(router_paquet, (paquet,)))
+                if len(en_cours) >= 2 * processus:      # Limite le nombre de paquets en mémoire
+                    compter(en_cours.popleft().get())
+            while en_cours:
+                compter(en_cours.popleft().get())
+
+    secondes = time.perf_counter() - debut
+    return {'requetes': total, 'erreurs': erreurs, 'secondes': round(secondes, 3),
+            'requetes_par_seconde': round(total / secondes, 1) if secondes > 0 else None}
+
+def _format(nom_fichier, format_demande):
+    '''Devine le format ('jsonl' ou 'csv') à partir de l'extension du fichier, sauf s'il est donné'''
+    if format_demande:
+        return format_demande
+    return 'csv' if nom_fichier.lower().endswith('.csv') else 'jsonl'
+
+def main(arguments=None):
+    parseur = argparse.ArgumentParser(description="Calcule en lot les trajets de requêtes (x, y, destination).")
+    parseur.add_argument('entree', help="fichier JSONL ou CSV des requêtes ('-' pour l'entrée standard)")
+    parseur.add_argument('-o', '--sortie', default='-', help="fichier des résultats ('-' pour la sortie standard)")
+    parseur.add_argument('--format-entree', choices=('jsonl', 'csv'))
+    parseur.add_argument('--format-sortie', choices=('jsonl', 'csv'))
+    parseur.add_argument('--processus', type=int, default=None, help='nombre de processus (par défaut: un par cœur)')
+    parseur.add_argument('--taille-paquet', type=int, default=500, help='nombre de requêtes envoyées à la fois à un processus')
+    parseur.add_argument('--graphe', default=metro.FICHIER_GRAPHE, help='fichier du graphe du métro')
+    parseur.add_argument('--mode', choices=('arbre', 'hierarchie') + metro.MODES_RECHERCHE, default='dijkstra')
+    args = parseur.parse_args(arguments)
+
+    format_entree = _format(args.entree, args.format_entree)
+    format_sortie = _format(args.sortie, args.format_sortie)
+    entree = sys.stdin if args.entree == '-' else open(args.entree, 'r', encoding='utf-8', newline='')
+    sortie = sys.stdout if args.sortie == '-' else open(args.sortie, 'w', encoding='utf-8', newline='')
+    try:
+        if format_sortie == 'csv':
+            ecrivain = csv.writer(sortie)
+            ecrivain.writerow(['x', 'y', 'destination', 'station', 'trajet', 'erreur'])
+        else:
+            ecrivain = sortie
+        statistiques = routage_lot(lire_requetes(entree, format_entree),
+                                   lambda resultat: ecrire_resultat(ecrivain, resultat, format_sortie),
+                                   args.processus, args.taille_paquet, args.graphe, args.mode)
+    finally:
+        if entree is not sys.stdin:
+            entree.close()
+        if sortie is not sys.stdout:
+            sortie.close()
+    print(json.dumps(statistiques), file=sys.stderr)    # Débit et nombre d'erreurs
+
+if __name__ == '__main__':
+    main()
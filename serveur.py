@@ -0,0 +1,318 @@
+'''Serveur HTTP (asyncio) qui garde un routeur chargé en mémoire pour les bornes des stations.
+
+Points d'accès (GET, réponses en JSON):
+    /route?x=&y=&to=    station la plus proche de (x, y) et trajet le plus court jusqu'à la station 'to'
+                        (paramètre optionnel k pour les k trajets les plus courts sans boucle, ou acces pour
+                        choisir la station d'entrée parmi les 'acces' plus proches, marche comprise; lignes=1
+                        pour un trajet qui compte les correspondances, regroupé par segment de ligne)
+    /nearest?x=&y=      station la plus proche de (x, y) (paramètre optionnel k pour les k plus proches)
+    /stations?q=        station de ce nom, noms qui commencent par q et noms approchants (autocomplétion);
+                        'to' et 'q' ignorent les accents, la casse et la ponctuation
+    /metrics            compteurs du cache des trajets et des requêtes (et mesures des étapes avec --mesures);
+                        format=prometheus pour le format texte de Prometheus
+
+Les recherches de trajets se font hors de la boucle d'événements (fils ou processus), pour que les autres
+requêtes continuent d'être servies pendant une longue recherche.
+
+Exemple:  python serveur.py --port 8000
+'''
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import math
+import urllib.parse
+
+import metro
+import routage_lot
+
+ABSENT = object()       # Valeur par défaut de CacheLRU.obtenir: un trajet gardé en cache peut valoir None (inatteignable)
+
+# Un cache LRU garde les trajets les plus récemment demandés. Lorsqu'il est plein,
+# le trajet utilisé il y a le plus longtemps est retiré (éviction).
+class CacheLRU:
+    def __init__(self, capacite):
+        '''Crée un cache vide qui contiendra au plus 'capacite' éléments'''
+        self._capacite = capacite
+        self._donnees = collections.OrderedDict()
+        self.succes = 0
+        self.echecs = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._donnees)
+
+    def __contains__(self, cle):
+        return cle in self._donnees
+
+    def obtenir(self, cle, defaut=None):
+        '''Retourne la valeur associée à la clé (et la marque comme récente), ou 'defaut' si elle est absente'''
+        if cle in self._donnees:
+            self._donnees.move_to_end(cle)
+            self.succes += 1
+            return self._donnees[cle]
+        self.echecs += 1
+        return defaut
+
+    def ajouter(self, cle, valeur):
+        '''Ajoute ou remplace une valeur, en retirant la plus ancienne si le cache est plein'''
+        self._donnees[cle] = valeur
+        self._donnees.move_to_end(cle)
+        while len(self._donnees) > self._capacite:
+            self._donnees.popitem(last=False)
+            self.evictions += 1
+
+    def statistiques(self):
+        '''Retourne les compteurs du cache'''
+        return {'taille': len(self._donnees), 'capacite': self._capacite, 'succes': self.succes,
+                'echecs': self.echecs, 'evictions': self.evictions}
+
+class ErreurRequete(Exception):
+    '''Erreur à renvoyer au client avec un code HTTP'''
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+DELAI_LECTURE = 10      # Secondes accordées à un client pour envoyer la ligne de requête et les en-têtes
+K_MAXIMAL = 20      # Nombre maximal de trajets (/route?k=) ou de stations d'entrée (/route?acces=) demandés
+
+MESSAGES_HTTP = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 408: 'Request Timeout',
+                 500: 'Internal Server Error'}
+
+def _chercher_trajet(station, destination, mode):
+    '''Calcule un trajet dans un processus de travail (avec le routeur préparé par routage_lot._initialiser)'''
+    return routage_lot._routeur.trajet(station, destination, mode)
+
+def _chercher_alternatives(station, destination, k):
+    '''Calcule les k trajets les plus courts dans un processus de travail'''
+    return routage_lot._routeur.alternatives(station, destination, k)
+
+def _chercher_lignes(station, destination, penalite):
+    '''Calcule le trajet qui tient compte des correspondances dans un processus de travail'''
+    return routage_lot._routeur.trajet_lignes(station, destination, penalite)
+
+def _chercher_multi_acces(coord, destination, k):
+    '''Calcule le meilleur trajet parmi k stations d'entrée dans un processus de travail'''
+    return routage_lot._routeur.trajet_multi_acces(coord, destination, k)
+
+class ServeurMetro:
+    def __init__(self, routeur, taille_cache=10000, processus=0, mode='dijkstra', penalite=metro.PENALITE_CORRESPONDANCE):
+        '''Prépare le serveur autour d'un routeur déjà chargé. Avec processus > 0, les recherches se font dans un
+        groupe de processus (vrai parallélisme); sinon, dans un fil d'exécution à part.'''
+        self.routeur = routeur
+        self.cache = CacheLRU(taille_cache)
+        self.mode = None if mode == 'arbre' else mode     # Routeur.trajet utilise l'arbre vers la destination sans mode
+        self.penalite = penalite    # Pénalité de correspondance des trajets par lignes (lignes=1)
+        self.processus = processus
+        self.requetes = collections.Counter()
+        self._en_cours = {}     # {(station, destination): future} pour ne pas lancer deux fois la même recherche
+        if mode == 'hierarchie':
+            routeur.hierarchie()    # Construite au besoin avant de lancer les processus, qui la relisent de son fichier
+        if processus > 0:
+            self._executeur = concurrent.futures.ProcessPoolExecutor(
+                processus, initializer=routage_lot._initialiser, initargs=(metro.FICHIER_GRAPHE, mode))
+        else:
+            self._executeur = concurrent.futures.ThreadPoolExecutor(1)
+
+    def fermer(self):
+        self._executeur.shutdown(wait=False)
+
+    async def trajet(self, station, destination, k=1, lignes=False):
+        '''Retourne le trajet de la station à la destination (ou, avec k > 1, la liste des k trajets les plus courts
+        avec leur longueur; avec lignes, le coût et les segments de ligne), à partir du cache ou calculé hors de la boucle'''
+        cle = (station, destination, 'lignes') if lignes else (station, destination) if k <= 1 else (station, destination, k)
+        trajet = self.cache.obtenir(cle, ABSENT)
+        if trajet is not ABSENT:        # Un trajet inatteignable (None) est aussi servi du cache
+            return trajet
+        if cle in self._en_cours:       # La même recherche est déjà en cours: on attend son résultat
+            return await asyncio.shield(self._en_cours[cle])
+        boucle = asyncio.get_running_loop()
+        if lignes:
+            (fonction, argument) = (_chercher_lignes if self.processus > 0 else self.routeur.trajet_lignes, self.penalite)
+        elif k > 1:
+            (fonction, argument) = (_chercher_alternatives if self.processus > 0 else self.routeur.alternatives, k)
+        else:
+            (fonction, argument) = (_chercher_trajet if self.processus > 0 else self.routeur.trajet, self.mode)
+        future = boucle.run_in_executor(self._executeur, fonction, station, destination, argument)
+        self._en_cours[cle] = future
+        try:
+            trajet = await future
+        finally:
+            del self._en_cours[cle]
+        self.cache.ajouter(cle, trajet)
+        return trajet
+
+    async def trajet_multi_acces(self, coord, destination, k):
+        '''Retourne (station d'entrée, trajet, coût total) du meilleur trajet depuis les coordonnées parmi les k
+        stations les plus proches, calculé hors de la boucle (sans cache: le résultat dépend du point exact)'''
+        fonction = _chercher_multi_acces if self.processus > 0 else self.routeur.trajet_multi_acces
+        return await asyncio.get_running_loop().run_in_executor(self._executeur, fonction, coord, destination, k)
+
+    def _coordonnees(self, parametres):
+        '''Lit les paramètres x et y de la requête'''
+        try:
+            coord = (float(parametres['x'][0]), float(parametres['y'][0]))
+        except (KeyError, ValueError):
+            raise ErreurRequete(400, 'Les paramètres x et y (nombres) sont obligatoires')
+        if not all(map(math.isfinite, coord)):     # float() accepte 'nan', 'inf' et 1e400
+            raise ErreurRequete(400, 'Les paramètres x et y doivent être des nombres finis')
+        return coord
+
+    def _entier(self, parametres, nom, defaut):
+        '''Lit un paramètre entier optionnel de la requête'''
+        try:
+            return int(parametres.get(nom, [defaut])[0])
+        except ValueError:
+            raise ErreurRequete(400, 'Le paramètre %s doit être un entier' % nom)
+
+    async def repondre(self, chemin):
+        '''Retourne la réponse (dictionnaire JSON) à une requête GET'''
+        url = urllib.parse.urlsplit(chemin)
+        parametres = urllib.parse.parse_qs(url.query)
+        if url.path == '/route':
+            coord = self._coordonnees(parametres)
+            if 'to' not in parametres:
+                raise ErreurRequete(400, 'Le paramètre to (station de destination) est obligatoire')
+            try:
+                destination = self.routeur.resoudre(parametres['to'][0])     # Accents, casse et tirets facultatifs
+            except LookupError as erreur:
+                raise ErreurRequete(404, str(erreur))
+            k = self._entier(parametres, 'k', 1)
+            acces = self._entier(parametres, 'acces', 1)
+            if acces > 1:
+                acces = min(acces, K_MAXIMAL)
+                (station, trajet, cout) = await self.trajet_multi_acces(coord, destination, acces)
+                return {'station': station, 'destination': destination, 'trajet': trajet, 'cout': cout,
+                        'entrees': [{'station': nom, 'marche': marche} for (nom, marche) in self.routeur.acces_marche(coord, acces)]}
+            station = self.routeur.station_proche(coord)
+            if self._entier(parametres, 'lignes', 0):
+                try:
+                    resultat = await self.trajet(station, destination, lignes=True)
+                except LookupError as erreur:
+                    raise ErreurRequete(404, str(erreur))
+                if resultat is None:
+                    return {'station': station, 'destination': destination, 'trajet': None}
+                (cout, segments) = resultat
+                return {'station': station, 'destination': destination, 'cout': cout, 'correspondances': len(segments) - 1,
+                        'segments': [{'ligne': ligne, 'stations': stations} for (ligne, stations) in segments]}
+            if k > 1:
+                trajets = await self.trajet(station, destination, min(k, K_MAXIMAL))
+                return {'station': station, 'destination': destination,
+                        'trajets': [{'longueur': longueur, 'trajet': trajet} for (longueur, trajet) in trajets]}
+            trajet = await self.trajet(station, destination)
+            return {'station': station, 'destination': destination, 'trajet': trajet}
+        if url.path == '/nearest':
+            coord = self._coordonnees(parametres)
+            k = self._entier(parametres, 'k', 1)
+            if k <= 1:
+                station = self.routeur.station_proche(coord)
+                return {'station': station, 'coord': self.routeur.stations[station]}
+            return {'stations': [{'station': nom, 'distance': distance}
+                                 for (nom, distance) in self.routeur.index.k_plus_proches(coord, k)]}
+        if url.path == '/stations':
+            if 'q' not in parametres:
+                raise ErreurRequete(400, 'Le paramètre q (nom ou début de nom) est obligatoire')
+            (texte, k) = (parametres['q'][0], max(1, min(self._entier(parametres, 'k', 10), 100)))
+            index = self.routeur.index_noms()
+            return {'exact': index.exact(texte), 'completions': index.completer(texte, k),
+                    'approchants': [{'station': nom, 'score': score} for (nom, score) in index.approcher(texte, k)]}
+        if url.path == '/metrics':
+            if parametres.get('format', [''])[0] == 'prometheus':
+                return self.metriques_prometheus()
+            metriques = {'cache': self.cache.statistiques(), 'requetes': dict(self.requetes),
+                         'recherches_en_cours': len(self._en_cours)}
+            if metro.instrumentation is not None:
+                metriques['mesures'] = metro.instrumentation.en_dictionnaire()
+            return metriques
+        raise ErreurRequete(404, 'Chemin inconnu: ' + url.path)
+
+    def metriques_prometheus(self):
+        '''Retourne les compteurs du serveur (et les mesures des étapes) dans le format texte de Prometheus'''
+        lignes = ['# TYPE metro_cache_trajets gauge']
+        for (nom, valeur) in self.cache.statistiques().items():
+            lignes.append('metro_cache_trajets{statistique="%s"} %d' % (nom, valeur))
+        lignes.append('# TYPE metro_requetes_total counter')
+        for (chemin, nombre) in sorted(self.requetes.items()):
+            lignes.append('metro_requetes_total{chemin="%s"} %d' % (chemin.replace('\\', '\\\\').replace('"', '\\"'), nombre))
+        texte = '\n'.join(lignes) + '\n'
+        if metro.instrumentation is not None:
+            texte += metro.instrumentation.en_prometheus()
+        return texte
+
+    async def _lire_entete(self, lecteur):
+        '''Lit la ligne de requête et ignore les en-têtes. Retourne la ligne de requête.'''
+        ligne = await lecteur.readline()
+        while (await lecteur.readline()) not in (b'\r\n', b'\n', b''):    # Ignore les en-têtes
+            pass
+        return ligne
+
+    async def gerer_connexion(self, lecteur, ecrivain):
+        '''Lit une requête HTTP, écrit la réponse JSON puis ferme la connexion. Un client qui n'a pas envoyé sa
+        requête après DELAI_LECTURE secondes reçoit une erreur 408, pour qu'il ne garde pas la connexion ouverte.'''
+        try:
+            try:
+                ligne = await asyncio.wait_for(self._lire_entete(lecteur), DELAI_LECTURE)
+            except asyncio.TimeoutError:
+                ligne = None
+            try:
+                if ligne is None:
+                    raise ErreurRequete(408, 'Requête non reçue après %d secondes' % DELAI_LECTURE)
+                (methode, chemin, _) = ligne.decode('latin-1').split()
+                if methode != 'GET':
+                    raise ErreurRequete(405, 'Seule la méthode GET est acceptée')
+                self.requetes[urllib.parse.urlsplit(chemin).path] += 1
+                (code, corps) = (200, await self.repondre(chemin))
+            except ErreurRequete as erreur:
+                (code, corps) = (erreur.code, {'erreur': str(erreur)})
+            except ValueError:
+                (code, corps) = (400, {'erreur': 'Requête HTTP invalide'})
+            except Exception as erreur:     # Une erreur imprévue ne doit pas arrêter le serveur
+                (code, corps) = (500, {'erreur': repr(erreur)})
+            if isinstance(corps, str):      # Texte brut (métriques au format Prometheus)
+                (donnees, type_contenu) = (corps.encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8')
+            else:
+                (donnees, type_contenu) = (json.dumps(corps, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8')
+            ecrivain.write(('HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n'
+                            % (code, MESSAGES_HTTP[code], type_contenu, len(donnees))).encode('latin-1'))
+            ecrivain.write(donnees)
+            await ecrivain.drain()
+        except ConnectionError:
+            pass
+        finally:
+            ecrivain.close()
+
+async def servir(hote='127.0.0.1', port=8000, taille_cache=10000, processus=0, mode='dijkstra',
+                 penalite=metro.PENALITE_CORRESPONDANCE):
+    '''Charge le routeur et sert les requêtes jusqu'à l'interruption du programme'''
+    serveur_metro = ServeurMetro(metro.Routeur(), taille_cache, processus, mode, penalite)
+    serveur = await asyncio.start_server(serveur_metro.gerer_connexion, hote, port)
+    print('Serveur prêt sur http://%s:%d' % (hote, port))
+    try:
+        async with serveur:
+            await serveur.serve_forever()
+    finally:
+        serveur_metro.fermer()
+
+def main(arguments=None):
+    parseur = argparse.ArgumentParser(description='Serveur HTTP de routage dans le métro de Montréal.')
+    parseur.add_argument('--hote', default='127.0.0.1')
+    parseur.add_argument('--port', type=int, default=8000)
+    parseur.add_argument('--taille-cache', type=int, default=10000, help='nombre maximal de trajets gardés en cache')
+    parseur.add_argument('--processus', type=int, default=0, help='nombre de processus de recherche (0: un fil à part)')
+    parseur.add_argument('--mode', choices=('arbre', 'hierarchie') + metro.MODES_RECHERCHE, default='dijkstra')
+    parseur.add_argument('--correspondance', type=int, default=metro.PENALITE_CORRESPONDANCE,
+                         help='pénalité d\'un changement de ligne pour /route?lignes=1 (en mètres de métro)')
+    parseur.add_argument('--mesures', action='store_true',
+                         help='chronomètre les étapes du routage et les ajoute à /metrics (recherches mesurées sans --processus)')
+    args = parseur.parse_args(arguments)
+    if args.mesures:
+        metro.activer_instrumentation()
+    try:
+        asyncio.run(servir(args.hote, args.port, args.taille_cache, args.processus, args.mode, args.correspondance))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
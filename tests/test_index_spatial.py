@@ -0,0 +1,24 @@
+'''IndexSpatial: k plus proches stations, avec et sans NumPy.'''
+
+import pytest
+
+import metro
+
+STATIONS = {'A': (0, 0), 'B': (2, 0), 'C': (0, 2), 'D': (-2, 0), 'E': (5, 5)}
+
+@pytest.mark.parametrize('k', [0, -1])
+def test_k_nul(k):
+    index = metro.IndexSpatial(STATIONS)
+    assert index.k_plus_proches((1, 1), k) == []
+    assert index.k_plus_proches_lot([(1, 1), (3, 3)], k) == [[], []]
+
+def test_egalite_premiere_station_ajoutee():
+    index = metro.IndexSpatial(STATIONS)
+    # B, C et D sont toutes à distance 2 de A: l'ordre d'ajout départage
+    assert [nom for (nom, _) in index.k_plus_proches((0, 0), 3)] == ['A', 'B', 'C']
+    assert [[nom for (nom, _) in proches] for proches in index.k_plus_proches_lot([(0, 0), (1, 1)], 2)] == \
+        [['A', 'B'], ['A', 'B']]
+
+def test_k_plus_grand_que_le_nombre_de_stations():
+    index = metro.IndexSpatial(STATIONS)
+    assert [nom for (nom, _) in index.k_plus_proches((5, 4), 10)] == ['E', 'B', 'C', 'A', 'D']
@@ -0,0 +1,54 @@
+'''Instantanés binaires (.csr) abîmés: le graphe doit être recompilé du fichier texte, sans planter.'''
+
+import os
+import shutil
+
+import pytest
+
+import metro
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def fichier_graphe(tmp_path):
+    chemin = str(tmp_path / 'caps_metro.txt')
+    shutil.copyfile(os.path.join(RACINE, 'caps_metro.txt'), chemin)
+    yield chemin
+    metro._graphes_charges.pop(os.path.abspath(chemin), None)
+
+def aretes(G):
+    return sorted((s, v, poids) for s in G.listeSommets() for (v, poids) in G.aretesSortantes(s))
+
+@pytest.mark.parametrize('octets_retires', [1, 3, 8, 100])
+def test_instantane_tronque_recompile(fichier_graphe, octets_retires):
+    G = metro.charger_graphe(fichier_graphe)
+    attendu = (G.listeSommets(), aretes(G))
+    nom_instantane = fichier_graphe + '.csr'
+    with open(nom_instantane, 'r+b') as fp:
+        fp.truncate(os.path.getsize(nom_instantane) - octets_retires)
+    assert metro.lire_instantane(nom_instantane, fichier_graphe) is None
+
+    metro._graphes_charges.clear()
+    G = metro.charger_graphe(fichier_graphe)
+    assert (G.listeSommets(), aretes(G)) == attendu
+    assert metro.lire_instantane(nom_instantane, fichier_graphe) is not None   # Instantané réécrit
+
+def test_instantane_vide(fichier_graphe):
+    metro.charger_graphe(fichier_graphe)
+    open(fichier_graphe + '.csr', 'wb').close()
+    assert metro.lire_instantane(fichier_graphe + '.csr', fichier_graphe) is None
+
+@pytest.mark.parametrize('octets_retires', [1, 3, 8])
+def test_hierarchie_tronquee_reconstruite(fichier_graphe, octets_retires):
+    import contraction
+    routeur = metro.Routeur(fichier_graphe)
+    attendu = routeur.trajet('ANGRIGNON', 'LONGUEUIL', 'dijkstra')
+    assert routeur.trajet('ANGRIGNON', 'LONGUEUIL', 'hierarchie') == attendu
+    nom_hierarchie = fichier_graphe + '.ch'
+    with open(nom_hierarchie, 'r+b') as fp:
+        fp.truncate(os.path.getsize(nom_hierarchie) - octets_retires)
+    assert contraction.lire_hierarchie(nom_hierarchie, fichier_graphe) is None
+
+    routeur = metro.Routeur(fichier_graphe)
+    assert routeur.trajet('ANGRIGNON', 'LONGUEUIL', 'hierarchie') == attendu
+    assert contraction.lire_hierarchie(nom_hierarchie, fichier_graphe) is not None
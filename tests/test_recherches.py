@@ -0,0 +1,119 @@
+'''Fermetures et réparation des arbres, trajets alternatifs (Yen) et hiérarchie de contraction, comparés à une
+recherche complète sur de petits graphes au hasard.'''
+
+import itertools
+import math
+import random
+
+import pytest
+
+import contraction
+import metro
+
+def graphe_hasard(n, m, graine, oriente=False):
+    '''Retourne un Graphe de n stations et d'environ m arêtes au hasard (une chaîne, pour qu'il soit connexe)'''
+    hasard = random.Random(graine)
+    G = metro.Graphe(oriente=oriente)
+    for i in range(n):
+        G.ajouteSommet('S%d' % i)
+    for i in range(n - 1):
+        G.ajouteArete('S%d' % i, 'S%d' % (i + 1), hasard.randint(1, 20))
+    for _ in range(m - (n - 1)):
+        (a, b) = hasard.sample(range(n), 2)
+        G.ajouteArete('S%d' % a, 'S%d' % b, hasard.randint(1, 20))
+    return G
+
+def modifier_au_hasard(C, hasard):
+    '''Ferme, rouvre ou change le poids d'une arête ou d'une station au hasard'''
+    noms = C.listeSommets(True)
+    (s, v, _) = hasard.choice(C.listeAretes(True) or [(noms[0], noms[1], None)])
+    (aretes_fermees, sommets_fermes) = C.fermetures()
+    choix = hasard.randrange(6)
+    if choix == 0 and aretes_fermees:
+        C.ouvreArete(*hasard.choice(aretes_fermees))
+    elif choix == 1 and sommets_fermes:
+        C.ouvreSommet(hasard.choice(sommets_fermes))
+    elif choix == 2:
+        C.fermeSommet(hasard.choice(noms))
+    elif choix == 3 and C.poids(C.sommet(s), C.sommet(v)) is not None:
+        C.changePoids(s, v, hasard.randint(1, 20))
+    else:
+        C.fermeArete(s, v)
+
+def distances(dist):
+    return {s: d for (s, d) in dist.items() if d != math.inf}
+
+@pytest.mark.parametrize('oriente', [False, True])
+@pytest.mark.parametrize('graine', range(5))
+def test_reparer_arbre_egal_reconstruction(oriente, graine):
+    hasard = random.Random(graine)
+    C = graphe_hasard(40, 80, graine, oriente).grapheCompact()
+    destination = hasard.randrange(C.taille())
+    (dist, suivant) = metro.arbre_plus_courts_chemins(C, destination)
+    for _ in range(40):
+        version = C.version()
+        modifier_au_hasard(C, hasard)
+        metro.reparer_arbre(C, dist, suivant, C.modificationsDepuis(version))
+        (dist_complet, _) = metro.arbre_plus_courts_chemins(C, destination)
+        assert distances(dist) == distances(dist_complet)
+        for (station, prochaine) in suivant.items():    # Chaque pointeur suit une arête ouverte de l'arbre
+            if prochaine is not None:
+                assert dist[station] == C.poids(station, prochaine) + dist[prochaine]
+
+def test_fermetures_rouvertes_graphe_intact():
+    C = graphe_hasard(30, 60, 0).grapheCompact()
+    poids = C._poids
+    aretes = C.listeAretes(True)
+    C.fermeArete(aretes[0][0], aretes[0][1])
+    C.fermeSommet(aretes[5][0])
+    C.changePoids(aretes[9][0], aretes[9][1], aretes[9][2] + 1)
+    copie = C.copie()
+    assert not C.estIntact() and copie.estIntact()
+    C.ouvreArete(aretes[0][0], aretes[0][1])
+    C.ouvreSommet(aretes[5][0])
+    C.changePoids(aretes[9][0], aretes[9][1], aretes[9][2])
+    assert C.estIntact()
+    assert C._poids is poids and not C._poids_changes     # Les poids d'origine n'ont jamais été copiés
+    assert C.listeAretes(True) == aretes
+
+def chemins_sans_boucle(C, depart, destination):
+    '''Retourne les longueurs de tous les trajets sans boucle, triées (recherche exhaustive)'''
+    longueurs = []
+    pile = [(depart, [depart], 0)]
+    while pile:
+        (station, chemin, longueur) = pile.pop()
+        if station == destination:
+            longueurs.append(longueur)
+            continue
+        for (voisin, poids) in C.aretesSortantes(station):
+            if voisin not in chemin and poids != math.inf:
+                pile.append((voisin, chemin + [voisin], longueur + poids))
+    return sorted(longueurs)
+
+@pytest.mark.parametrize('oriente', [False, True])
+@pytest.mark.parametrize('graine', range(5))
+def test_k_plus_courts_chemins(oriente, graine):
+    hasard = random.Random(graine)
+    C = graphe_hasard(9, 16, graine, oriente).grapheCompact()
+    C.fermeArete(*C.listeAretes(True)[hasard.randrange(16)][:2])
+    for (depart, destination) in itertools.islice(itertools.permutations(range(9), 2), 0, None, 7):
+        trajets = metro.k_plus_courts_chemins(C, depart, destination, 6)
+        assert [longueur for (longueur, _) in trajets] == chemins_sans_boucle(C, depart, destination)[:6]
+        for (longueur, chemin) in trajets:
+            sommets = [C.sommet(nom) for nom in chemin]
+            assert sommets[0] == depart and sommets[-1] == destination and len(set(sommets)) == len(sommets)
+            assert longueur == sum(C.poids(a, b) for (a, b) in zip(sommets, sommets[1:]))
+        assert len({tuple(chemin) for (_, chemin) in trajets}) == len(trajets)
+
+def test_alternatives_routeur():
+    routeur = metro.Routeur()
+    trajets = routeur.alternatives('ANGRIGNON', 'LONGUEUIL', 3)
+    assert trajets[0][1] == routeur.trajet('ANGRIGNON', 'LONGUEUIL', 'dijkstra')
+    assert [longueur for (longueur, _) in trajets] == sorted(longueur for (longueur, _) in trajets)
+
+@pytest.mark.parametrize('oriente', [False, True])
+@pytest.mark.parametrize('graine', range(3))
+def test_hierarchie_egale_dijkstra(oriente, graine):
+    G = graphe_hasard(60, 130, graine, oriente)
+    (H, _) = contraction.construire(G)
+    assert contraction.verifier(G.grapheCompact(), H, 300, graine)['differences'] == 0